@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+Benchmark berry's fetch path against a local S3 stand-in.
+
+Drives run_berry() through many polling cycles for many application IDs and reports
+cycle latency percentiles, S3 requests and bytes per cycle, CPU time and peak RSS.
+
+    python3 benchmarks/bench_fetch.py --apps 50 --cycles 100 --latency 0.005
+    python3 benchmarks/bench_fetch.py --rotate-every 5 --baseline benchmarks/results/baseline.json
+'''
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import berry.cli  # noqa: E402
+from s3stub import S3Stub  # noqa: E402
+
+BUCKET = 'bench-mint-bucket'
+# metrics compared against the baseline, lower is better for all of them: S3 requests and bytes are deterministic
+# for the same options, timings depend on the machine and are only compared with --compare-timing
+COMPARED_METRICS = ('requests_per_cycle', 'bytes_per_cycle')
+TIMING_METRICS = ('cycle_p50_seconds', 'cycle_p99_seconds', 'cpu_seconds_per_cycle')
+# options which must match those of the baseline
+BENCHMARK_OPTIONS = ('apps', 'cycles', 'error_rate', 'object_size', 'rotate_every', 'berry_args')
+
+
+class BenchmarkDone(Exception):
+    pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_benchmark(opts):
+    stub = S3Stub(latency=opts.latency, error_rate=opts.error_rate).start()
+    application_ids = ['app{}'.format(i) for i in range(opts.apps)]
+    for application_id in application_ids:
+        for fn in ('user', 'client'):
+            stub.put_credentials(BUCKET, '{}/{}.json'.format(application_id, fn), opts.object_size)
+
+    local_directory = tempfile.mkdtemp(prefix='berry-bench-')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+
+    argv = [local_directory, '--config-file', os.devnull, '--mint-bucket', BUCKET,
+            '--s3-endpoint-url', stub.endpoint_url, '--interval', '0', '--jitter', '0',
+            '--workers', str(opts.workers)] + opts.berry_args
+    for application_id in application_ids:
+        argv.extend(['--application', application_id])
+    args = berry.cli.get_parser().parse_args(argv)
+
+    cycles = []
+    current = {}
+
+    def start_cycle():
+        stub.reset_counters()
+        current.update(start=time.time(), cpu=cpu_time())
+
+    def end_of_cycle(seconds):
+        if not current:
+            # the startup delay before the first cycle
+            start_cycle()
+            return
+        cycles.append({'seconds': time.time() - current['start'],
+                       'cpu_seconds': cpu_time() - current['cpu'],
+                       'requests': stub.requests,
+                       'bytes': stub.bytes_sent})
+        if len(cycles) >= opts.cycles:
+            raise BenchmarkDone()
+        if opts.rotate_every and len(cycles) % opts.rotate_every == 0:
+            for (bucket, key) in list(stub.objects):
+                stub.put_credentials(bucket, key, opts.object_size, version=len(cycles))
+        start_cycle()
+
+    # only the polling loop's sleeps end a cycle, not those of the S3 stand-in or of botocore's retries
+    cycle_time = types.ModuleType('time')
+    cycle_time.__dict__.update(time.__dict__)
+    cycle_time.sleep = end_of_cycle
+    berry.cli.time = cycle_time
+    try:
+        berry.cli.run_berry(args)
+    except BenchmarkDone:
+        pass
+    finally:
+        berry.cli.time = time
+        stub.stop()
+        shutil.rmtree(local_directory)
+
+    steady = cycles[1:] or cycles
+    latencies = [cycle['seconds'] for cycle in steady]
+    return {
+        'timestamp': time.time(),
+        'berry_version': berry.__version__,
+        'python': sys.version.split()[0],
+        'options': {'apps': opts.apps, 'cycles': opts.cycles, 'latency': opts.latency,
+                    'error_rate': opts.error_rate, 'object_size': opts.object_size,
+                    'workers': opts.workers, 'rotate_every': opts.rotate_every, 'berry_args': opts.berry_args},
+        'first_cycle_seconds': cycles[0]['seconds'],
+        'first_cycle_requests': cycles[0]['requests'],
+        'cycle_p50_seconds': percentile(latencies, 50),
+        'cycle_p90_seconds': percentile(latencies, 90),
+        'cycle_p99_seconds': percentile(latencies, 99),
+        'cpu_seconds_per_cycle': sum(cycle['cpu_seconds'] for cycle in steady) / len(steady),
+        'requests_per_cycle': sum(cycle['requests'] for cycle in steady) / float(len(steady)),
+        'bytes_per_cycle': sum(cycle['bytes'] for cycle in steady) / float(len(steady)),
+        # kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def compare(result, baseline, tolerance, names=COMPARED_METRICS):
+    regressions = []
+    for name in names:
+        old, new = baseline.get(name), result.get(name)
+        if old is None or new is None:
+            continue
+        # ignore noise on tiny absolute values
+        if new > old * (1 + tolerance) and new - old > 1e-3:
+            regressions.append('{}: {:.6g} -> {:.6g} (+{:.0%})'.format(name, old, new, (new - old) / (old or 1)))
+    return regressions
+
+
+def write_results(result, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as fd:
+        json.dump(result, fd, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apps', type=int, default=10, help='Number of application IDs')
+    parser.add_argument('--cycles', type=int, default=20, help='Number of polling cycles')
+    parser.add_argument('--latency', type=float, default=0.0, help='Injected latency per S3 request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of S3 requests failing with 500')
+    parser.add_argument('--object-size', type=int, default=0, help='Pad credentials files to this size in bytes')
+    parser.add_argument('--rotate-every', type=int, default=0, help='Rotate all credentials every N cycles')
+    parser.add_argument('--workers', type=int, default=4, help='berry --workers')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results', 'latest.json'),
+                        help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare against the results in this file, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--compare-timing', action='store_true',
+                        help='Also compare cycle latency and CPU time (only meaningful on the same machine)')
+    parser.add_argument('berry_args', nargs=argparse.REMAINDER, help='Extra berry options (after "--")')
+    opts = parser.parse_args()
+    opts.berry_args = [arg for arg in opts.berry_args if arg != '--']
+
+    logging.basicConfig(level=logging.ERROR, format='%(levelname)s: %(message)s')
+    result = run_benchmark(opts)
+
+    for name in sorted(result):
+        if name not in ('options', 'timestamp'):
+            print('{:<24} {}'.format(name, result[name]))
+
+    if opts.output:
+        write_results(result, opts.output)
+
+    if opts.baseline:
+        with open(opts.baseline) as fd:
+            baseline = json.load(fd)
+        differing = [name for name in BENCHMARK_OPTIONS
+                     if baseline.get('options', {}).get(name) != result['options'][name]]
+        if differing:
+            print('Options differ from the baseline: {}'.format(', '.join(differing)))
+            return 1
+        names = COMPARED_METRICS + (TIMING_METRICS if opts.compare_timing else ())
+        regressions = compare(result, baseline, opts.tolerance, names)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
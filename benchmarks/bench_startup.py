@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''
+Benchmark berry's startup: the import time of berry.cli and the wall time of a complete
+"berry --once" run against a local S3 stand-in, each measured in fresh interpreters.
+
+    python3 benchmarks/bench_startup.py --runs 10
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fetch import BUCKET, compare, percentile, write_results  # noqa: E402
+from s3stub import S3Stub  # noqa: E402
+
+COMPARED_METRICS = ('import_median_seconds', 'once_median_seconds')
+
+IMPORT_SCRIPT = 'import time; start = time.time(); import berry.cli; print(time.time() - start)'
+
+
+def run_python(args, env):
+    start = time.time()
+    output = subprocess.check_output([sys.executable] + args, env=env)
+    return time.time() - start, output
+
+
+def run_benchmark(opts):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root, AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench',
+               AWS_DEFAULT_REGION='eu-west-1')
+
+    import_times = []
+    for i in range(opts.runs):
+        _, output = run_python(['-c', IMPORT_SCRIPT], env)
+        import_times.append(float(output.decode('utf-8').strip()))
+
+    stub = S3Stub().start()
+    stub.put_credentials(BUCKET, 'myapp/user.json')
+    stub.put_credentials(BUCKET, 'myapp/client.json')
+    once_times = []
+    try:
+        for i in range(opts.runs):
+            local_directory = tempfile.mkdtemp(prefix='berry-bench-')
+            try:
+                seconds, _ = run_python(['-m', 'berry', local_directory, '--once', '--silent',
+                                         '--config-file', os.devnull, '--application-id', 'myapp',
+                                         '--mint-bucket', BUCKET, '--s3-endpoint-url', stub.endpoint_url], env)
+                once_times.append(seconds)
+            finally:
+                shutil.rmtree(local_directory)
+    finally:
+        stub.stop()
+
+    return {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'runs': opts.runs,
+        'import_median_seconds': percentile(import_times, 50),
+        'import_min_seconds': min(import_times),
+        'once_median_seconds': percentile(once_times, 50),
+        'once_min_seconds': min(once_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs of each measurement')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results', 'startup.json'),
+                        help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare against the results in this file, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    opts = parser.parse_args()
+
+    result = run_benchmark(opts)
+    for name in sorted(result):
+        if name != 'timestamp':
+            print('{:<24} {}'.format(name, result[name]))
+
+    if opts.output:
+        write_results(result, opts.output)
+
+    if opts.baseline:
+        with open(opts.baseline) as fd:
+            regressions = compare(result, json.load(fd), opts.tolerance, COMPARED_METRICS)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+'''
+Minimal in-process stand-in for the parts of S3 berry uses (GetObject, GetBucketLocation, ListObjectsV2),
+with injectable latency and errors
+'''
+
+import email.utils
+import hashlib
+import json
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+ERROR_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<Error><Code>{code}</Code><Message>{message}</Message></Error>')
+LOCATION_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{}</LocationConstraint>')
+
+LIST_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>{bucket}</Name>'
+                 '<Prefix>{prefix}</Prefix><KeyCount>{count}</KeyCount><IsTruncated>{truncated}</IsTruncated>'
+                 '{contents}{token}</ListBucketResult>')
+CONTENTS_TEMPLATE = ('<Contents><Key>{key}</Key><LastModified>{last_modified}</LastModified>'
+                     '<ETag>{etag}</ETag><Size>{size}</Size><StorageClass>STANDARD</StorageClass></Contents>')
+
+
+class S3Object(object):
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        self.last_modified = time.time()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class S3Stub(object):
+    def __init__(self, latency=0.0, error_rate=0.0, region='eu-west-1'):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.region = region
+        self.objects = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def put_credentials(self, bucket, key, size=0, version=0):
+        data = {'application_username': key.split('/')[0], 'application_password': 'secret-{}'.format(version)}
+        if size:
+            data['padding'] = 'x' * max(0, size - len(json.dumps(data)))
+        self.objects[(bucket, key)] = S3Object(json.dumps(data).encode('utf-8'))
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def count(self, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def list_objects(self, bucket, query):
+        prefix = query.get('prefix', [''])[0]
+        start = query.get('continuation-token', [''])[0]
+        max_keys = int(query.get('max-keys', ['1000'])[0])
+        keys = sorted(key for (b, key) in self.objects if b == bucket and key.startswith(prefix) and key > start)
+        contents = []
+        for key in keys[:max_keys]:
+            obj = self.objects[(bucket, key)]
+            contents.append(CONTENTS_TEMPLATE.format(
+                key=escape(key), etag=escape(obj.etag), size=len(obj.body),
+                last_modified=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(obj.last_modified))))
+        truncated = len(keys) > max_keys
+        token = '<NextContinuationToken>{}</NextContinuationToken>'.format(escape(keys[max_keys - 1])) \
+            if truncated else ''
+        return LIST_TEMPLATE.format(bucket=escape(bucket), prefix=escape(prefix), count=len(contents),
+                                    truncated='true' if truncated else 'false', contents=''.join(contents),
+                                    token=token).encode('utf-8')
+
+    @property
+    def endpoint_url(self):
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+                stub.count(len(body))
+
+            def send_error_xml(self, status, code, message):
+                body = ERROR_TEMPLATE.format(code=code, message=message).encode('utf-8')
+                self.send(status, body, {'Content-Type': 'application/xml'})
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    self.send_error_xml(500, 'InternalError', 'Injected error')
+                    return
+                url = urlparse(self.path)
+                bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+                query = parse_qs(url.query, keep_blank_values=True)
+                if query.get('list-type') == ['2'] and not key:
+                    self.send(200, stub.list_objects(bucket, query), {'Content-Type': 'application/xml'})
+                    return
+                if url.query.startswith('location') and not key:
+                    self.send(200, LOCATION_TEMPLATE.format(stub.region).encode('utf-8'),
+                              {'Content-Type': 'application/xml'})
+                    return
+                obj = stub.objects.get((bucket, key))
+                if obj is None:
+                    self.send_error_xml(404, 'NoSuchKey', 'The specified key does not exist.')
+                    return
+                headers = {'ETag': obj.etag, 'Last-Modified': email.utils.formatdate(obj.last_modified, usegmt=True)}
+                if self.headers.get('If-None-Match') == obj.etag:
+                    self.send(304, headers=headers)
+                    return
+                headers['Content-Type'] = 'application/json'
+                self.send(200, obj.body, headers)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name='s3stub')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
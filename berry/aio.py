@@ -0,0 +1,116 @@
+'''
+asyncio based download scheduling for hosts serving many applications (requires Python 3.5+)
+'''
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncFetchEngine(object):
+    '''
+    Multiplexes the downloads of a polling cycle on one event loop: at most "workers" downloads run at once
+    (sharing the connection pools of the S3 clients), at most "bucket_concurrency" of them per mint bucket,
+    and each download has to finish within "deadline" seconds.
+
+    The S3 clients are blocking, so their calls run in a bounded thread pool
+    and retries, redirects and file writes behave exactly as with the thread engine.
+    A rotation by a download which missed its deadline is reported in the next polling cycle.
+    '''
+
+    def __init__(self, fetch, context, workers, bucket_concurrency=None, deadline=None):
+        self.fetch = fetch
+        self.context = context
+        self.bucket_concurrency = bucket_concurrency or workers
+        self.deadline = deadline
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.semaphores = {}
+        # (local directory, file) => download which missed its deadline but is still running
+        self.pending = {}
+        # (local directory, file) of the downloads which missed their deadline
+        self.late = set()
+        # (local directory, file) => application of the late downloads which rotated the file
+        self.late_rotated = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, bucket):
+        if bucket not in self.semaphores:
+            self.semaphores[bucket] = asyncio.Semaphore(self.bucket_concurrency)
+        return self.semaphores[bucket]
+
+    def fetch_job(self, app, fn, clients):
+        rotated = app.rotated
+        err_count = self.fetch(app, fn, clients, self.context)
+        key = (app.local_directory, fn)
+        with self.lock:
+            if key in self.late:
+                self.late.discard(key)
+                # the polling cycle may already have notified the rotation hook: report it in the next cycle
+                for files in (rotated, app.rotated):
+                    if fn in files:
+                        files.remove(fn)
+                        self.late_rotated[key] = app
+        return err_count
+
+    def report_late_rotations(self):
+        with self.lock:
+            late_rotated, self.late_rotated = self.late_rotated, {}
+        for (local_directory, fn), app in late_rotated.items():
+            if fn not in app.rotated:
+                app.rotated.append(fn)
+                logging.info('Rotated {} credentials for {} in a download of an earlier cycle'.format(
+                             fn, app.application_id))
+
+    async def fetch_file(self, app, fn, clients):
+        key = (app.local_directory, fn)
+        pending = self.pending.pop(key, None)
+        if pending is not None and not pending.done():
+            # never write the same file from two threads
+            self.pending[key] = pending
+            logging.error('Download of {} credentials for {} from an earlier cycle is still running'.format(
+                          fn, app.application_id))
+            self.context.metrics.errors.inc('timeout')
+            self.context.metrics.failed(app.application_id, fn, 'timeout',
+                                        'Download from an earlier cycle still running')
+            return 1
+
+        async with self.semaphore(app.mint_bucket):
+            future = self.loop.run_in_executor(self.executor, self.fetch_job, app, fn, clients)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.deadline)
+            except asyncio.TimeoutError:
+                with self.lock:
+                    self.late.add(key)
+                self.pending[key] = future
+                logging.error('Download of {} credentials for {} did not finish within {} seconds'.format(
+                              fn, app.application_id, self.deadline))
+                self.context.metrics.errors.inc('timeout')
+                self.context.metrics.failed(app.application_id, fn, 'timeout',
+                                            'Download did not finish within {} seconds'.format(self.deadline))
+                return 1
+
+    async def fetch_files(self, jobs):
+        return await asyncio.gather(*[self.fetch_file(app, fn, clients) for app, fn, clients in jobs])
+
+    def fetch_all(self, jobs):
+        '''
+        Download the given (application, file, client manager) jobs, return the error count of each job
+        '''
+        self.report_late_rotations()
+        return self.loop.run_until_complete(self.fetch_files(jobs))
+
+    async def call_all(self, function, calls):
+        return await asyncio.gather(*[self.loop.run_in_executor(self.executor, function, *arguments)
+                                      for arguments in calls])
+
+    def map(self, function, calls):
+        '''
+        Call the function with each of the given argument tuples concurrently, return the results
+        '''
+        return self.loop.run_until_complete(self.call_all(function, calls))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.loop.close()
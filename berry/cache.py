@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+from berry.state import FetchState, content_digest, load_json_file, write_json_file
+
+LEASE_FILE_NAME = '.berry-lease.json'
+LOCK_FILE_NAME = '.berry-lease.lock'
+FILES = ('user', 'client')
+
+
+class SharedCache(object):
+    '''
+    Node-wide cache of credentials files for several berry processes, e.g. one per container.
+
+    Each (mint bucket, application ID) has a cache entry directory with a lease: only the berry process holding
+    the lease downloads the entry from S3, all processes copy it to their local directories.
+    '''
+
+    def __init__(self, directory, lease_ttl, entry_class):
+        self.directory = directory
+        self.lease_ttl = lease_ttl
+        # creates the Application of a cache entry
+        self.entry_class = entry_class
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        # (mint bucket, application ID) => Application of the cache entry
+        self.entries = {}
+        self.held = set()
+
+    def entry(self, mint_bucket, application_id):
+        key = (mint_bucket, application_id)
+        if key not in self.entries:
+            directory = os.path.join(self.directory, mint_bucket, application_id)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            self.entries[key] = self.entry_class(application_id, mint_bucket, directory)
+        return self.entries[key]
+
+    def sources(self, applications):
+        '''
+        Return (cache entry, applications) pairs, one per mint bucket and application ID
+        '''
+        sources = []
+        for app in applications:
+            entry = self.entry(app.mint_bucket, app.application_id)
+            entry.replica_buckets = app.replica_buckets
+            for source, targets in sources:
+                if source is entry:
+                    targets.append(app)
+                    break
+            else:
+                sources.append((entry, [app]))
+        return sources
+
+    def update_lease(self, entry, take):
+        import fcntl
+
+        path = os.path.join(entry.local_directory, LEASE_FILE_NAME)
+        with open(os.path.join(entry.local_directory, LOCK_FILE_NAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                lease = load_json_file(path)
+                now = time.time()
+                if lease.get('owner') not in (None, self.owner) and lease.get('expires', 0) > now:
+                    return False
+                if take:
+                    write_json_file(path, {'owner': self.owner, 'expires': now + self.lease_ttl})
+                elif lease.get('owner') == self.owner:
+                    os.remove(path)
+                return True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, entry):
+        '''
+        Take or renew the lease of the entry unless another live process holds it, return True if we hold it
+        '''
+        if not self.update_lease(entry, take=True):
+            self.held.discard(entry)
+            return False
+        if entry not in self.held:
+            logging.info('Downloading {} credentials for the shared cache in {}'.format(
+                         entry.application_id, entry.local_directory))
+            # the previous holder changed the state meanwhile
+            entry.fetch_state = FetchState(entry.local_directory)
+            self.held.add(entry)
+        return True
+
+    def release(self):
+        '''
+        Give up all leases, so that another process can take over immediately
+        '''
+        for entry in self.held:
+            try:
+                self.update_lease(entry, take=False)
+            except (IOError, OSError) as e:
+                logging.warning('Could not release the lease in {}: {}'.format(entry.local_directory, e))
+        self.held = set()
+
+
+def fan_out(entry, app, context):
+    '''
+    Copy the credentials files of the cache entry to the application's local directory where they differ,
+    return the number of files missing in the cache or failing to copy
+    '''
+    errors = 0
+    for fn in FILES:
+        source = os.path.join(entry.local_directory, '{}.json'.format(fn))
+        local_file = os.path.join(app.local_directory, '{}.json'.format(fn))
+        digest = entry.fetch_state.local_digest(source)
+        if digest is None:
+            logging.error('Credentials file {} is missing in the shared cache'.format(source))
+            errors += 1
+            context.metrics.failed(app.application_id, fn, 'other', 'Missing in the shared cache')
+            continue
+        try:
+            changed = digest != app.fetch_state.local_digest(local_file)
+            if changed or not context.output.complete(app, fn):
+                with open(source, 'rb') as fd:
+                    data = fd.read()
+                content = json.loads(data.decode('utf-8'))
+                if content_digest(content) != digest:
+                    # replaced meanwhile, copied in the next cycle
+                    continue
+                context.output.write(app, fn, data, digest, content)
+            if changed:
+                app.rotated.append(fn)
+                logging.info('Rotated {} credentials for {} from the shared cache'.format(fn, app.application_id))
+                if context.store is not None:
+                    context.store.put(app.application_id, fn, data, digest)
+            elif context.store is not None:
+                context.store.load(app.application_id, fn, local_file)
+        except (IOError, OSError, ValueError) as e:
+            # e.g. replaced by an invalid file or the local directory is not writable
+            logging.error('Could not copy {} to {}: {}'.format(source, app.local_directory, e))
+            errors += 1
+            context.metrics.failed(app.application_id, fn, 'other', str(e))
+            continue
+        context.metrics.refreshed(app.application_id, fn)
+    return errors
@@ -1,15 +1,34 @@
 #!/usr/bin/env python3
 
 import argparse
-import boto3.session
-import botocore.exceptions
 import json
 import logging
 import os
-import yaml
+import signal
+import socket
+import sys
+import threading
 import time
-import dns.resolver
-from botocore.client import Config
+
+# boto3/botocore, dnspython and PyYAML are imported where they are needed:
+# importing them dominates the run time of "berry --once"
+
+from berry.cache import SharedCache, fan_out
+from berry.client import S3ClientManager
+from berry.config import ConfigWatcher
+from berry.engine import ThreadFetchEngine
+from berry.hedge import HedgedReader
+from berry.hooks import HookRunner, RotationHook
+from berry.listing import ChangeDetector
+from berry.metrics import Metrics, start_metrics_server
+from berry.output import RENDER_FORMATS, FileOutput, GenerationOutput
+from berry.resolver import CachingResolver
+from berry.retry import RetryPolicy, now
+from berry.scheduler import PollScheduler
+from berry.server import CredentialStore, is_loopback, start_credentials_server
+from berry.trace import StackSampler, Tracer
+from berry.state import (ENDPOINT_CACHE_FILE_NAME, EndpointCache, FetchState, content_digest, file_signature,
+                         write_json_file)
 
 
 class UsageError(Exception):
@@ -20,19 +39,49 @@ class UsageError(Exception):
         return 'Usage Error: {}'.format(self.msg)
 
 
-def get_bucket_region(client, bucket_name, endpoint):
-    try:
-        return client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
-    except botocore.exceptions.ClientError as e:
-        if e.response['Error'].get('Code') != 'AccessDenied':
-            logging.error('Unkown Error on get_bucket_location({})! (S3 error message: {})'.format(bucket_name, e))
-    if endpoint.endswith('.amazonaws.com'):
-        endpoint_parts = endpoint.split('.')
-        if endpoint_parts[-3].startswith('s3-'):
-            return endpoint_parts[-3].replace('s3-', '')
+class NotReadyError(Exception):
+    def __init__(self, msg, exit_code):
+        self.msg = msg
+        self.exit_code = exit_code
+
+    def __str__(self):
+        return self.msg
+
+
+REGION_LOOKUP_METHODS = ('location', 'endpoint', 'dns')
+# exit codes of --wait-ready
+EXIT_TIMEOUT = 3
+EXIT_ACCESS_DENIED = 4
+EXIT_NOT_FOUND = 5
+# delay in seconds before the first retry of --wait-ready, doubled up to the maximum
+WAIT_READY_DELAY = 0.1
+WAIT_READY_MAX_DELAY = 2.0
+# S3 error codes worth retrying (besides all 5xx responses)
+TRANSIENT_ERROR_CODES = ('RequestTimeout', 'SlowDown', 'Throttling')
+# name in the "berry_retry" configuration, command line option, type
+RETRY_SETTINGS = (('attempts', 'retry_attempts', int),
+                  ('backoff', 'retry_backoff', float),
+                  ('max_backoff', 'retry_max_backoff', float),
+                  ('connect_timeout', 'connect_timeout', float),
+                  ('read_timeout', 'read_timeout', float),
+                  ('cycle_deadline', 'cycle_deadline', float))
+# name in the "berry_on_rotate"/"on_rotate" configuration, command line option
+ROTATION_HOOK_SETTINGS = (('signal', 'on_rotate_signal'),
+                          ('pid', 'on_rotate_pid'),
+                          ('pidfile', 'on_rotate_pidfile'),
+                          ('command', 'on_rotate_command'),
+                          ('touch', 'on_rotate_touch'),
+                          ('timeout', 'hook_timeout'))
+
+
+def get_bucket_region_from_dns(bucket_name, resolver=None):
     bucket_dns = '{}.s3.amazonaws.com'.format(bucket_name)
     try:
-        answers = dns.resolver.query(bucket_dns, 'CNAME')
+        if resolver:
+            answers = resolver.query(bucket_dns, 'CNAME')
+        else:
+            import dns.resolver
+            answers = dns.resolver.query(bucket_dns, 'CNAME')
         if len(answers) == 1:
             answer = answers[0]
             if (len(answer.target) == 5 and
@@ -50,15 +99,61 @@ def get_bucket_region(client, bucket_name, endpoint):
     return None
 
 
-def lookup_aws_credentials(application_id, path):
+def get_bucket_region(client, bucket_name, endpoint, resolver=None, lookup_order=REGION_LOOKUP_METHODS,
+                      client_error=None):
+    if client_error is None:
+        import botocore.exceptions
+        client_error = botocore.exceptions.ClientError
+
+    for method in lookup_order:
+        if method == 'location':
+            try:
+                return client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+            except client_error as e:
+                if e.response['Error'].get('Code') != 'AccessDenied':
+                    logging.error('Unkown Error on get_bucket_location({})! (S3 error message: {})'.format(
+                                  bucket_name, e))
+        elif method == 'endpoint':
+            if endpoint.endswith('.amazonaws.com'):
+                endpoint_parts = endpoint.split('.')
+                if endpoint_parts[-3].startswith('s3-'):
+                    return endpoint_parts[-3].replace('s3-', '')
+        elif method == 'dns':
+            region = get_bucket_region_from_dns(bucket_name, resolver)
+            if region:
+                return region
+    return None
+
+
+# parsed AWS credentials files by path, see load_aws_credentials_index()
+aws_credentials_indexes = {}
+aws_credentials_indexes_lock = threading.Lock()
+
+
+def load_aws_credentials_index(path):
+    signature = file_signature(path)
+    with aws_credentials_indexes_lock:
+        cached = aws_credentials_indexes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    index = {}
     with open(path) as fd:
         for line in fd:
             line = line.strip()
             if not line.startswith('#'):
                 parts = line.split(':')
-                if parts[0] == application_id:
-                    return parts[1], parts[2]
-    return None, None
+                # the first entry for an application wins
+                if len(parts) >= 3 and parts[0] not in index:
+                    index[parts[0]] = (parts[1], parts[2])
+
+    with aws_credentials_indexes_lock:
+        aws_credentials_indexes[path] = (signature, index)
+    return index
+
+
+def lookup_aws_credentials(application_id, path):
+    return load_aws_credentials_index(path).get(application_id, (None, None))
 
 
 def use_aws_credentials(application_id, path):
@@ -68,126 +163,824 @@ def use_aws_credentials(application_id, path):
     return {'aws_access_key_id': access_key_id, 'aws_secret_access_key': secret_access_key}
 
 
+class Application(object):
+    def __init__(self, application_id, mint_bucket, local_directory, hook=None, replica_buckets=()):
+        self.application_id = application_id
+        self.mint_bucket = mint_bucket
+        self.local_directory = local_directory
+        self.hook = hook
+        # buckets the mint bucket is replicated to, in order of preference
+        self.replica_buckets = list(replica_buckets)
+        self.fetch_state = FetchState(local_directory)
+        self.err_count = 0
+        # files written in the current cycle
+        self.rotated = []
+
+    @property
+    def buckets(self):
+        return [self.mint_bucket] + self.replica_buckets
+
+
+def get_mint_buckets(value):
+    '''
+    Return the buckets of a "mint_bucket" setting: a bucket name or a list (or comma separated string) of
+    the mint bucket followed by its replicas
+    '''
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        buckets = [str(bucket).strip() for bucket in value]
+    else:
+        buckets = [bucket.strip() for bucket in str(value).split(',')]
+    return [bucket for bucket in buckets if bucket]
+
+
+def get_rotation_hook(settings):
+    if not settings:
+        return None
+    if not isinstance(settings, dict):
+        raise UsageError('Invalid rotation hook {}, expected a mapping'.format(settings))
+    unknown = set(settings) - set(name for name, option in ROTATION_HOOK_SETTINGS)
+    if unknown:
+        raise UsageError('Unknown rotation hook setting(s): {}'.format(', '.join(sorted(unknown))))
+
+    signum = None
+    pid = settings.get('pid')
+    if settings.get('signal') or pid or settings.get('pidfile'):
+        if not (pid or settings.get('pidfile')):
+            raise UsageError('Rotation hook signal needs a "pid" or "pidfile"')
+        name = str(settings.get('signal') or 'HUP').upper()
+        signum = getattr(signal, name if name.startswith('SIG') else 'SIG' + name, None)
+        if not isinstance(signum, int):
+            raise UsageError('Unknown signal "{}"'.format(settings['signal']))
+    try:
+        pid = int(pid) if pid else None
+        timeout = float(settings['timeout']) if settings.get('timeout') is not None else 30
+    except (TypeError, ValueError):
+        raise UsageError('Invalid rotation hook {}'.format(settings))
+    if timeout <= 0:
+        raise UsageError('Rotation hook timeout must be positive')
+    return RotationHook(signum, pid, settings.get('pidfile'), settings.get('command'), settings.get('touch'),
+                        timeout)
+
+
+def get_applications(args, config):
+    mint_buckets = get_mint_buckets(args.mint_bucket or config.get('mint_bucket'))
+
+    hook_settings = config.get('berry_on_rotate') or {}
+    if not isinstance(hook_settings, dict):
+        raise UsageError('Invalid "berry_on_rotate" configuration, expected a mapping')
+    # command line options override the configuration YAML
+    hook_settings = dict(hook_settings, **dict((name, getattr(args, option))
+                                               for name, option in ROTATION_HOOK_SETTINGS
+                                               if getattr(args, option) is not None))
+
+    entries = []
+    for value in args.applications or []:
+        entries.append(dict(zip(('application_id', 'mint_bucket', 'local_directory'), value.split(':', 2))))
+    if not entries:
+        entries = config.get('berry_applications') or []
+
+    if not entries:
+        application_id = args.application_id or config.get('application_id')
+
+        if not application_id:
+            raise UsageError('Application ID missing, please set "application_id" in your configuration YAML')
+
+        if not mint_buckets:
+            raise UsageError('Mint Bucket is not configured, please set "mint_bucket" in your configuration YAML')
+
+        return [Application(application_id, mint_buckets[0], args.local_directory, get_rotation_hook(hook_settings),
+                            mint_buckets[1:])]
+
+    applications = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('application_id'):
+            raise UsageError('Invalid application entry {}, "application_id" is required'.format(entry))
+        application_id = entry['application_id']
+        buckets = get_mint_buckets(entry.get('mint_bucket')) or mint_buckets
+        if not buckets:
+            raise UsageError('Mint Bucket is not configured for application "{}"'.format(application_id))
+        local_directory = entry.get('local_directory') or os.path.join(args.local_directory, application_id)
+        if local_directory in [app.local_directory for app in applications]:
+            raise UsageError('Local directory {} is used by more than one application'.format(local_directory))
+        if not os.path.isdir(local_directory):
+            try:
+                os.makedirs(local_directory)
+            except OSError as e:
+                raise UsageError('Could not create local directory {}: {}'.format(local_directory, e))
+        hook = get_rotation_hook(entry.get('on_rotate', hook_settings))
+        applications.append(Application(application_id, buckets[0], local_directory, hook, buckets[1:]))
+    return applications
+
+
+def get_client_manager(client_managers, application_id, args, endpoint_cache, retry_policy=None, metrics=None):
+    if args.backend == 'native':
+        from berry.native import NativeClientManager as manager_class
+    else:
+        manager_class = S3ClientManager
+
+    aws_credentials_file = args.aws_credentials_file
+    # without a credentials file all applications share the same session and clients
+    key = application_id if aws_credentials_file else None
+    if key not in client_managers:
+        if aws_credentials_file:
+            client_managers[key] = manager_class(
+                aws_credentials_file, lambda: use_aws_credentials(application_id, aws_credentials_file),
+                endpoint_cache, args.s3_endpoint_url, max_pool_connections=args.workers, retry_policy=retry_policy,
+                metrics=metrics)
+        else:
+            client_managers[key] = manager_class(endpoint_cache=endpoint_cache, endpoint_url=args.s3_endpoint_url,
+                                                 max_pool_connections=args.workers, retry_policy=retry_policy,
+                                                 metrics=metrics)
+    return client_managers[key]
+
+
+class FetchContext(object):
+    '''
+    Settings and helpers shared by all fetches of a berry process
+    '''
+
+    def __init__(self, resolver=None, region_lookup_order=REGION_LOOKUP_METHODS, scheduler=None, metrics=None,
+                 retry_policy=None, store=None, hedged_reader=None, output=None, tracer=None):
+        self.resolver = resolver
+        self.region_lookup_order = region_lookup_order
+        self.scheduler = scheduler
+        self.metrics = metrics or Metrics()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # CredentialStore of the credentials server, if enabled
+        self.store = store
+        # HedgedReader for applications with replica mint buckets
+        self.hedged_reader = hedged_reader
+        # writes the local credentials files, see berry.output
+        self.output = output or FileOutput()
+        # spans of the polling cycle, see berry.trace
+        self.tracer = tracer or Tracer(enabled=False)
+        # deadline of the current polling cycle, see start_cycle()
+        self.deadline = None
+
+    def start_cycle(self, limit=None):
+        self.deadline = self.retry_policy.deadline()
+        if limit is not None and (self.deadline is None or limit < self.deadline):
+            self.deadline = limit
+
+    def expired(self):
+        return self.deadline is not None and now() >= self.deadline
+
+
+def fetch_credentials(app, fn, clients, context):
+    application_id = app.application_id
+    mint_bucket = app.mint_bucket
+    local_directory = app.local_directory
+    fetch_state = app.fetch_state
+    metrics = context.metrics
+    span = context.tracer.span
+
+    # only the creation of a client counts as setup time, see S3ClientManager.client
+    with span('client_setup', application_id=application_id, file=fn):
+        s3 = clients.client(mint_bucket)
+    err_count = 0
+    # error class and message of the last failure
+    failure = None
+    key_name = '{}/{}.json'.format(application_id, fn)
+    try:
+        local_file = os.path.join(local_directory, '{}.json'.format(fn))
+        response = None
+        retry_policy = context.retry_policy
+        attempt = 0
+        while attempt < retry_policy.attempts:
+            if context.expired():
+                logging.error(('Polling cycle deadline exceeded before "{}" could be read ' +
+                               'from mint S3 bucket "{}"').format(key_name, mint_bucket))
+                metrics.errors.inc('timeout')
+                err_count += 1
+                failure = ('timeout', 'Polling cycle deadline exceeded')
+                break
+            attempt += 1
+            transient_error = None
+            # download the file again if a pre-rendered format is missing
+            conditions = fetch_state.conditions(key_name, local_file) if context.output.complete(app, fn) else {}
+            try:
+                with metrics.get_object_seconds.time(), span('get_object', application_id=application_id, file=fn,
+                                                             attempt=attempt):
+                    if context.hedged_reader and app.replica_buckets:
+                        # the error handling below applies to the bucket that answered
+                        mint_bucket, future = context.hedged_reader.get_object(
+                            clients, app.buckets, Key=key_name, **conditions)
+                        s3 = clients.client(mint_bucket)
+                        response = future.result()
+                    else:
+                        response = s3.get_object(Bucket=mint_bucket, Key=key_name, **conditions)
+                break
+            except clients.timeout_errors as e:
+                metrics.errors.inc('timeout')
+                transient_error = 'Timeout while trying to read "{}" from mint S3 bucket "{}": {}'.format(
+                                  key_name, mint_bucket, e)
+                failure = ('timeout', transient_error)
+            except clients.connection_errors as e:
+                metrics.errors.inc('other')
+                transient_error = 'Could not connect to mint S3 bucket "{}": {}'.format(mint_bucket, e)
+                failure = ('other', transient_error)
+            except clients.client_error as e:
+                # more friendly error messages
+                # https://github.com/zalando-stups/berry/issues/2
+                status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+                msg = e.response['Error'].get('Message')
+                error_code = e.response['Error'].get('Code')
+                endpoint = e.response['Error'].get('Endpoint', '')
+                if status_code == 304:
+                    # our ETag/Last-Modified still matches, the local file is up to date
+                    logging.debug('Credentials file "{}" in mint S3 bucket "{}" not modified'.format(
+                                  key_name, mint_bucket))
+                    break
+                elif error_code == 'InvalidRequest' and 'Please use AWS4-HMAC-SHA256.' in msg:
+                    logging.debug(('Invalid Request while trying to read "{}" from mint S3 bucket "{}". ' +
+                                   'Retrying with signature version v4! ' +
+                                   '(S3 error message: {})').format(
+                                 key_name, mint_bucket, msg))
+                    metrics.errors.inc('sigv4_fallback')
+                    with span('client_setup', application_id=application_id, file=fn, signature_version='s3v4'):
+                        s3 = clients.use_signature_version(mint_bucket, 's3v4')
+                elif error_code == 'PermanentRedirect' and endpoint.endswith('.amazonaws.com'):
+                    metrics.errors.inc('redirect')
+                    clients.invalidate_endpoint(mint_bucket)
+                    with metrics.bucket_region_seconds.time(), span('get_bucket_region', application_id=application_id,
+                                                                    file=fn, bucket=mint_bucket):
+                        region = get_bucket_region(s3, mint_bucket, endpoint, context.resolver,
+                                                   context.region_lookup_order, clients.client_error)
+                    logging.debug(('Got Redirect while trying to read "{}" from mint S3 bucket "{}". ' +
+                                   'Retrying with region {}, endpoint {}! ' +
+                                   '(S3 error message: {})').format(
+                                 key_name, mint_bucket, region, endpoint, msg))
+                    with span('client_setup', application_id=application_id, file=fn, region=region):
+                        s3 = clients.use_region(mint_bucket, region)
+                elif error_code == 'AuthorizationHeaderMalformed' and e.response['Error'].get('Region'):
+                    # SigV4 request signed for the wrong region, S3 tells us the right one
+                    region = e.response['Error']['Region']
+                    logging.debug(('Wrong signing region while trying to read "{}" from mint S3 bucket "{}". ' +
+                                   'Retrying with region {}! (S3 error message: {})').format(
+                                 key_name, mint_bucket, region, msg))
+                    metrics.errors.inc('redirect')
+                    with span('client_setup', application_id=application_id, file=fn, region=region):
+                        s3 = clients.use_region(mint_bucket, region)
+                elif status_code == 403:
+                    logging.error(('Access denied while trying to read "{}" from mint S3 bucket "{}". ' +
+                                   'Check your IAM role/user policy to allow read access! ' +
+                                   '(S3 error message: {})').format(
+                                  key_name, mint_bucket, msg))
+                    metrics.errors.inc('403')
+                    err_count += 1
+                    failure = ('403', msg)
+                    break
+                elif status_code == 404:
+                    logging.error(('Credentials file "{}" not found in mint S3 bucket "{}". ' +
+                                   'Mint either did not sync them yet or the mint configuration is wrong. ' +
+                                   '(S3 error message: {})').format(
+                                  key_name, mint_bucket, msg))
+                    metrics.errors.inc('404')
+                    err_count += 1
+                    failure = ('404', msg)
+                    fetch_state.forget(key_name)
+                    break
+                elif (status_code or 0) >= 500 or error_code in TRANSIENT_ERROR_CODES:
+                    metrics.errors.inc('timeout' if error_code == 'RequestTimeout' else 'other')
+                    transient_error = 'Could not read from mint S3 bucket "{}": {}'.format(mint_bucket, e)
+                    failure = ('timeout' if error_code == 'RequestTimeout' else 'other', transient_error)
+                else:
+                    logging.error('Could not read from mint S3 bucket "{}": {}'.format(
+                                  mint_bucket, e))
+                    metrics.errors.inc('other')
+                    err_count += 1
+                    failure = ('other', str(e))
+                    break
+
+            if transient_error:
+                if not retry_policy.wait(attempt, context.deadline):
+                    logging.error(transient_error)
+                    err_count += 1
+                    break
+                logging.warning('{} (attempt {} of {}, retrying)'.format(transient_error, attempt,
+                                                                         retry_policy.attempts))
+        else:
+            # all attempts were used up by changing the signature version or region
+            logging.error('Could not read "{}" from mint S3 bucket "{}" after {} attempts'.format(
+                          key_name, mint_bucket, attempt))
+            metrics.errors.inc('redirect')
+            err_count += 1
+            failure = ('redirect', 'Still redirected after {} attempts'.format(attempt))
+
+        if response:
+            body = response['Body']
+            with span('read_body', application_id=application_id, file=fn):
+                json_data = body.read()
+            metrics.body_bytes.observe(len(json_data))
+
+            # check that the file contains valid JSON
+            with metrics.json_parse_seconds.time(), span('json_decode', application_id=application_id, file=fn):
+                new_data = json.loads(json_data.decode('utf-8'))
+                new_digest = content_digest(new_data)
+
+            # check whether the file contents changed
+            with metrics.local_update_seconds.time(), span('local_update', application_id=application_id, file=fn):
+                if new_digest != fetch_state.local_digest(local_file):
+                    context.output.write(app, fn, json_data, new_digest, new_data)
+                    app.rotated.append(fn)
+                    logging.info('Rotated {} credentials for {}'.format(fn, application_id))
+                elif not context.output.complete(app, fn):
+                    context.output.write(app, fn, json_data, new_digest, new_data)
+            fetch_state.update(key_name, response, new_digest)
+            if context.scheduler:
+                context.scheduler.observe_modified(key_name, response.get('LastModified'))
+            if context.store is not None:
+                context.store.put(application_id, fn, json_data, new_digest)
+        elif context.store is not None:
+            context.store.load(application_id, fn, local_file)
+        if not err_count:
+            metrics.refreshed(application_id, fn)
+    except:
+        logging.exception('Failed to download {} credentials'.format(fn))
+        metrics.errors.inc('other')
+        err_count += 1
+        failure = ('other', str(sys.exc_info()[1]))
+        # start over with a fresh session and connections in the next cycle
+        clients.reset()
+
+    if err_count:
+        metrics.failed(application_id, fn, *(failure or ('other', None)))
+    return err_count
+
+
+def load_config(path):
+    import yaml
+
+    # the C implementation is much faster, but not always available
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path) as fd:
+        return yaml.load(fd, Loader=loader) or {}
+
+
+def get_retry_policy(args, config):
+    settings = config.get('berry_retry') or {}
+    if not isinstance(settings, dict):
+        raise UsageError('Invalid "berry_retry" configuration, expected a mapping')
+    unknown = set(settings) - set(name for name, option, type_ in RETRY_SETTINGS)
+    if unknown:
+        raise UsageError('Unknown "berry_retry" setting(s): {}'.format(', '.join(sorted(unknown))))
+
+    kwargs = {}
+    for name, option, type_ in RETRY_SETTINGS:
+        # command line options override the configuration YAML
+        value = getattr(args, option)
+        if value is None:
+            value = settings.get(name)
+        if value is None:
+            continue
+        try:
+            kwargs[name] = type_(value)
+        except (TypeError, ValueError):
+            raise UsageError('Invalid value for "{}": {}'.format(name, value))
+    if kwargs.get('cycle_deadline') is None and args.interval > 0:
+        kwargs['cycle_deadline'] = args.interval
+
+    retry_policy = RetryPolicy(**kwargs)
+    if retry_policy.attempts < 1:
+        raise UsageError('Number of attempts must be at least 1')
+    if retry_policy.connect_timeout <= 0 or retry_policy.read_timeout <= 0:
+        raise UsageError('Timeouts must be positive')
+    if retry_policy.backoff < 0 or retry_policy.max_backoff < 0:
+        raise UsageError('Backoff must not be negative')
+    if retry_policy.cycle_deadline is not None and retry_policy.cycle_deadline <= 0:
+        raise UsageError('Cycle deadline must be positive')
+    return retry_policy
+
+
+def reload_config(args, applications, context, client_managers):
+    '''
+    Apply a changed configuration YAML and return the new applications,
+    applications with unchanged settings keep their state (and thereby their client manager)
+    '''
+    try:
+        config = load_config(args.config_file)
+    except Exception as e:
+        raise UsageError('Could not load configuration from {}: {}'.format(args.config_file, e))
+    new_applications = get_applications(args, config)
+    retry_policy = get_retry_policy(args, config)
+
+    def settings(app):
+        return app.application_id, app.mint_bucket, app.local_directory
+
+    current = dict((settings(app), app) for app in applications)
+    for i, app in enumerate(new_applications):
+        if settings(app) in current:
+            current[settings(app)].hook = app.hook
+            current[settings(app)].replica_buckets = app.replica_buckets
+            new_applications[i] = current[settings(app)]
+    application_ids = set(app.application_id for app in new_applications)
+    for app in applications:
+        if app not in new_applications:
+            logging.info('Application "{}" ({}) removed from the configuration'.format(
+                         app.application_id, app.mint_bucket))
+            if app.application_id not in application_ids:
+                context.metrics.forget(app.application_id)
+                if context.store is not None:
+                    context.store.forget(app.application_id)
+    for app in new_applications:
+        if app not in applications:
+            logging.info('Application "{}" ({}) added to the configuration'.format(
+                         app.application_id, app.mint_bucket))
+
+    old_policy = context.retry_policy
+    timeouts_changed = ((retry_policy.connect_timeout, retry_policy.read_timeout) !=
+                        (old_policy.connect_timeout, old_policy.read_timeout))
+    context.retry_policy = retry_policy
+    for manager in client_managers.values():
+        manager.retry_policy = retry_policy
+        if timeouts_changed:
+            # the timeouts are settings of the clients
+            manager.reset()
+    return new_applications
+
+
+def refresh_applications(applications, engine, get_clients, context, shared_cache=None, change_detector=None):
+    '''
+    Download the credentials files of all applications (through the shared cache, if enabled),
+    setting their error counts and rotated files
+    '''
+    for app in applications:
+        app.err_count = 0
+        app.rotated = []
+    if shared_cache:
+        sources = shared_cache.sources(applications)
+        downloads = [entry for entry, targets in sources if shared_cache.acquire(entry)]
+        for entry in downloads:
+            entry.err_count = 0
+    else:
+        downloads = applications
+
+    # user.json and client.json are fetched concurrently, using the same client
+    jobs = [(app, fn, get_clients(app)) for app in downloads for fn in ['user', 'client']]
+    if change_detector:
+        jobs = change_detector.filter(jobs, engine)
+    for (app, fn, clients), err_count in zip(jobs, engine.fetch_all(jobs)):
+        app.err_count += err_count
+    for app in downloads:
+        app.err_count += context.output.commit(app, context.metrics)
+
+    if shared_cache:
+        for entry, targets in sources:
+            if entry in downloads:
+                entry.fetch_state.save()
+            for app in targets:
+                app.err_count = (entry.err_count if entry in downloads else 0) + fan_out(entry, app, context)
+                app.err_count += context.output.commit(app, context.metrics)
+
+
+def get_fetch_engine(args, context, workers):
+    if args.bucket_concurrency is not None and args.bucket_concurrency < 1:
+        raise UsageError('Bucket concurrency must be at least 1')
+    if args.fetch_deadline is not None and args.fetch_deadline <= 0:
+        raise UsageError('Fetch deadline must be positive')
+
+    if args.engine == 'asyncio':
+        if sys.version_info < (3, 5):
+            raise UsageError('The asyncio engine requires Python 3.5 or newer')
+        from berry.aio import AsyncFetchEngine
+        return AsyncFetchEngine(fetch_credentials, context, workers, args.bucket_concurrency, args.fetch_deadline)
+    return ThreadFetchEngine(fetch_credentials, context, workers)
+
+
+def ready(applications):
+    '''
+    Whether both credentials files of all applications exist
+    '''
+    return all(os.path.exists(os.path.join(app.local_directory, '{}.json'.format(fn)))
+               for app in applications for fn in ['user', 'client'])
+
+
+def transient_failure(applications, metrics):
+    '''
+    Whether the polling cycle failed with transient errors (S3 or network), access denied to or a missing
+    key of one application must not slow down polling for the others
+    '''
+    for app in applications:
+        if app.err_count:
+            error_classes = set(metrics.file_status(app.application_id, fn)['error_class']
+                                for fn in ['user', 'client'])
+            error_classes.discard(None)
+            if not error_classes or error_classes - set(['403', '404']):
+                return True
+    return False
+
+
+def not_ready_error(applications, metrics, deadline):
+    error_classes = set(metrics.file_status(app.application_id, fn)['error_class']
+                        for app in applications for fn in ['user', 'client'])
+    if '403' in error_classes:
+        return NotReadyError('Access denied to the credentials files', EXIT_ACCESS_DENIED)
+    if '404' in error_classes:
+        return NotReadyError('Credentials files not found in the mint S3 bucket', EXIT_NOT_FOUND)
+    return NotReadyError('Credentials not ready after {} seconds'.format(deadline), EXIT_TIMEOUT)
+
+
+def write_status_file(path, applications, metrics, success):
+    status = {'ready': success and ready(applications), 'updated': time.time(), 'applications': {}}
+    for app in applications:
+        status['applications'][app.application_id] = dict((fn, metrics.file_status(app.application_id, fn))
+                                                          for fn in ['user', 'client'])
+    try:
+        write_json_file(path, status)
+    except (IOError, OSError) as e:
+        logging.warning('Could not write status file {}: {}'.format(path, e))
+
+
 def run_berry(args):
+    config_watcher = ConfigWatcher(args.config_file)
     try:
-        with open(args.config_file) as fd:
-            config = yaml.load(fd)
+        config = load_config(args.config_file)
     except Exception as e:
         logging.warn('Could not load configuration from {}: {}'.format(args.config_file, e))
         config = {}
 
-    application_id = args.application_id or config.get('application_id')
-    mint_bucket = args.mint_bucket or config.get('mint_bucket')
-    local_directory = args.local_directory
+    applications = get_applications(args, config)
 
-    if not application_id:
-        raise UsageError('Application ID missing, please set "application_id" in your configuration YAML')
+    if args.workers < 1:
+        raise UsageError('Number of workers must be at least 1')
 
-    if not mint_bucket:
-        raise UsageError('Mint Bucket is not configured, please set "mint_bucket" in your configuration YAML')
+    region_lookup_order = tuple(method.strip() for method in args.region_lookup_order.split(','))
+    unknown_methods = set(region_lookup_order) - set(REGION_LOOKUP_METHODS)
+    if unknown_methods:
+        raise UsageError('Unknown region lookup method(s) {}, supported are: {}'.format(
+                         ', '.join(sorted(unknown_methods)), ', '.join(REGION_LOOKUP_METHODS)))
+    if not 0 <= args.jitter < 1:
+        raise UsageError('Jitter must be a fraction between 0 and 1')
+    if args.hedge_after <= 0:
+        raise UsageError('Hedging threshold must be positive')
+    if args.wait_ready is not None and args.wait_ready <= 0:
+        raise UsageError('Readiness deadline must be positive')
+    if args.generations is not None and args.generations < 2:
+        raise UsageError('At least 2 generations must be kept')
+    scheduler = PollScheduler(args.interval, args.jitter, args.max_backoff, args.fast_interval)
+    metrics = Metrics()
+    if args.metrics_port:
+        try:
+            start_metrics_server(metrics, args.metrics_port, args.metrics_address)
+        except socket.error as e:
+            raise UsageError('Could not serve metrics on {}:{}: {}'.format(args.metrics_address, args.metrics_port, e))
+    retry_policy = get_retry_policy(args, config)
+    store = None
+    servers = []
+    if args.credentials_socket or args.credentials_port is not None:
+        store = CredentialStore()
+        addresses = []
+        if args.credentials_socket:
+            addresses.append(args.credentials_socket)
+        if args.credentials_port is not None:
+            if not args.credentials_allow_remote and not is_loopback(args.credentials_address):
+                raise UsageError(('Refusing to serve credentials without authentication on {}, ' +
+                                  'use --credentials-allow-remote to allow it').format(args.credentials_address))
+            addresses.append((args.credentials_address, args.credentials_port))
+        for address in addresses:
+            try:
+                servers.append(start_credentials_server(store, address))
+            except socket.error as e:
+                for server in servers:
+                    server.server_close()
+                raise UsageError('Could not serve credentials on {}: {}'.format(address, e))
+    context = FetchContext(CachingResolver(timeout=args.dns_timeout), region_lookup_order, scheduler, metrics,
+                           retry_policy, store, HedgedReader(args.hedge_after, args.workers, metrics),
+                           GenerationOutput(args.generations, args.render or ()) if args.generations
+                           else FileOutput(args.render or ()),
+                           Tracer(None if args.trace == '-' else args.trace) if args.trace else None)
+    tracer = context.tracer
 
-    while True:
-        if args.aws_credentials_file:
-            aws_credentials = use_aws_credentials(application_id, args.aws_credentials_file)
-        else:
-            aws_credentials = {}
+    endpoint_cache_file = args.endpoint_cache_file or os.path.join(args.local_directory, ENDPOINT_CACHE_FILE_NAME)
+    endpoint_cache = EndpointCache(endpoint_cache_file, args.endpoint_cache_ttl)
+    client_managers = {}
+    clients = [get_client_manager(client_managers, app.application_id, args, endpoint_cache, retry_policy, metrics)
+               for app in applications]
 
-        session = boto3.session.Session(**aws_credentials)
-        s3 = session.client('s3')
-        err_count = 0
-        for fn in ['user', 'client']:
-            key_name = '{}/{}.json'.format(application_id, fn)
+    # the number of applications may change with the configuration, threads are only started when needed
+    engine = get_fetch_engine(args, context, args.workers)
+    hook_runner = HookRunner()
+    change_detector = ChangeDetector(context) if args.list_objects else None
+    shared_cache = None
+    if args.shared_cache:
+        if args.shared_cache_lease is not None and args.shared_cache_lease <= 0:
+            raise UsageError('Shared cache lease must be positive')
+        shared_cache = SharedCache(args.shared_cache, args.shared_cache_lease or max(3 * args.interval, 60),
+                                   Application)
+    once = args.once or args.wait_ready is not None
+    ready_deadline = now() + args.wait_ready if args.wait_ready is not None else None
+    ready_cycles = 0
+    previous_sighup_handler = None
+    previous_profile_handler = None
+    if args.profile_signal:
+        name = args.profile_signal.upper()
+        profile_signal = getattr(signal, name if name.startswith('SIG') else 'SIG' + name, None)
+        if not isinstance(profile_signal, int):
+            raise UsageError('Unknown signal "{}"'.format(args.profile_signal))
+    try:
+        if args.profile_signal:
+            sampler = StackSampler(args.profile_output)
+            previous_profile_handler = signal.signal(profile_signal, sampler.toggle)
+        if not once:
             try:
-                local_file = os.path.join(local_directory, '{}.json'.format(fn))
-                tmp_file = local_file + '.tmp'
-                response = None
-                retry = 3
-                while retry:
-                    try:
-                        response = s3.get_object(Bucket=mint_bucket, Key=key_name)
-                        retry = False
-                    except botocore.exceptions.ClientError as e:
-                        # more friendly error messages
-                        # https://github.com/zalando-stups/berry/issues/2
-                        status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
-                        msg = e.response['Error'].get('Message')
-                        error_code = e.response['Error'].get('Code')
-                        endpoint = e.response['Error'].get('Endpoint', '')
-                        retry -= 1
-                        if error_code == 'InvalidRequest' and 'Please use AWS4-HMAC-SHA256.' in msg:
-                            logging.debug(('Invalid Request while trying to read "{}" from mint S3 bucket "{}". ' +
-                                           'Retrying with signature version v4! ' +
-                                           '(S3 error message: {})').format(
-                                         key_name, mint_bucket, msg))
-                            s3 = session.client('s3', config=Config(signature_version='s3v4'))
-                        elif error_code == 'PermanentRedirect' and endpoint.endswith('.amazonaws.com'):
-                            region = get_bucket_region(s3, mint_bucket, endpoint)
-                            logging.debug(('Got Redirect while trying to read "{}" from mint S3 bucket "{}". ' +
-                                           'Retrying with region {}, endpoint {}! ' +
-                                           '(S3 error message: {})').format(
-                                         key_name, mint_bucket, region, endpoint, msg))
-                            s3 = session.client('s3', region)
-                        elif status_code == 403:
-                            logging.error(('Access denied while trying to read "{}" from mint S3 bucket "{}". ' +
-                                           'Check your IAM role/user policy to allow read access! ' +
-                                           '(S3 error message: {})').format(
-                                          key_name, mint_bucket, msg))
-                            retry = False
-                            err_count += 1
-                        elif status_code == 404:
-                            logging.error(('Credentials file "{}" not found in mint S3 bucket "{}". ' +
-                                           'Mint either did not sync them yet or the mint configuration is wrong. ' +
-                                           '(S3 error message: {})').format(
-                                          key_name, mint_bucket, msg))
-                            retry = False
-                            err_count += 1
-                        else:
-                            logging.error('Could not read from mint S3 bucket "{}": {}'.format(
-                                          mint_bucket, e))
-                            retry = False
-                            err_count += 1
-
-                if response:
-                    body = response['Body']
-                    json_data = body.read()
-
-                    # check that the file contains valid JSON
-                    new_data = json.loads(json_data.decode('utf-8'))
-
-                    try:
-                        with open(local_file, 'r') as fd:
-                            old_data = json.load(fd)
-                    except:
-                        old_data = None
-                    # check whether the file contents changed
-                    if new_data != old_data:
-                        with open(tmp_file, 'wb') as fd:
-                            fd.write(json_data)
-                        os.rename(tmp_file, local_file)
-                        logging.info('Rotated {} credentials for {}'.format(fn, application_id))
-            except:
-                logging.exception('Failed to download {} credentials'.format(fn))
-                err_count += 1
+                previous_sighup_handler = signal.signal(signal.SIGHUP, config_watcher.request_reload)
+            except (AttributeError, ValueError):
+                # no SIGHUP on Windows, signal handlers can only be installed in the main thread
+                pass
+            # spread the first requests of many instances booted at the same time
+            time.sleep(scheduler.startup_delay())  # pragma: no cover
 
-        if args.once:
-            return err_count == 0
+        while True:
+            if config_watcher.changed():
+                logging.info('Reloading configuration from {}'.format(args.config_file))
+                try:
+                    applications = reload_config(args, applications, context, client_managers)
+                except UsageError as e:
+                    logging.error('{}, keeping the previous configuration'.format(e))
+                clients = [get_client_manager(client_managers, app.application_id, args, endpoint_cache,
+                                              context.retry_policy, metrics)
+                           for app in applications]
+                for key, manager in list(client_managers.items()):
+                    if manager not in clients:
+                        del client_managers[key]
 
-        time.sleep(args.interval)  # pragma: no cover
+            context.start_cycle(ready_deadline)
+            tracer.start_cycle()
+            for manager in client_managers.values():
+                with tracer.span('session_refresh'):
+                    manager.refresh()
 
+            with tracer.span('refresh_applications', applications=len(applications)):
+                refresh_applications(applications, engine,
+                                     lambda app: get_client_manager(client_managers, app.application_id, args,
+                                                                    endpoint_cache, context.retry_policy, metrics),
+                                     context, shared_cache, change_detector)
+            for app in applications:
+                if app.rotated and app.hook:
+                    # one notification for all files of the application rotated in this cycle
+                    hook_runner.notify(app, app.rotated)
+                app.fetch_state.save()
+                if app.err_count and len(applications) > 1:
+                    logging.error('Failed to refresh credentials for application "{}" ({} errors)'.format(
+                                  app.application_id, app.err_count))
+            endpoint_cache.save()
 
-def configure():
+            success = all(app.err_count == 0 for app in applications)
+            tracer.end_cycle(success=success, errors=sum(app.err_count for app in applications),
+                             rotated=sum(len(app.rotated) for app in applications))
+            if args.status_file:
+                write_status_file(args.status_file, applications, metrics, success)
+            if args.wait_ready is not None and not (success and ready(applications)):
+                if now() < ready_deadline:
+                    ready_cycles += 1
+                    time.sleep(min(WAIT_READY_DELAY * 2 ** (ready_cycles - 1), WAIT_READY_MAX_DELAY,
+                                   max(0, ready_deadline - now())))
+                    continue
+                raise not_ready_error(applications, metrics, args.wait_ready)
+            if once:
+                hook_runner.join(max([app.hook.timeout for app in applications if app.hook] or [0]))
+                return success
+
+            scheduler.record_cycle(not transient_failure(applications, metrics))  # pragma: no cover
+            time.sleep(scheduler.next_delay())  # pragma: no cover
+    finally:
+        if shared_cache:
+            shared_cache.release()
+        if previous_sighup_handler is not None:
+            signal.signal(signal.SIGHUP, previous_sighup_handler)
+        if previous_profile_handler is not None:
+            signal.signal(profile_signal, previous_profile_handler)
+        engine.close()
+        context.hedged_reader.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('local_directory', help='Local directory to write credentials to')
     parser.add_argument('-f', '--config-file', help='Read berry settings from given YAML file',
                         default='/etc/taupage.yaml')
     parser.add_argument('-a', '--application-id', help='Application ID as registered in Kio')
-    parser.add_argument('-m', '--mint-bucket', help='Mint S3 bucket name')
+    parser.add_argument('-m', '--mint-bucket',
+                        help='Mint S3 bucket name, optionally followed by comma separated replica buckets')
+    parser.add_argument('--hedge-after', type=float, default=1.0,
+                        help='Ask the next replica mint bucket if a bucket did not answer within this many seconds ' +
+                        '(default: %(default)s)')
     parser.add_argument('-c', '--aws-credentials-file',
                         help='Lookup AWS credentials by application ID in the given file')
     parser.add_argument('-i', '--interval', help='Interval in seconds', type=int, default=120)
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Randomize the interval by this fraction (default: %(default)s)')
+    parser.add_argument('--max-backoff', type=int, default=960,
+                        help='Maximum interval in seconds when backing off after cycles with transient errors')
+    parser.add_argument('--fast-interval', type=int,
+                        help='Poll with this interval in seconds when the next rotation is expected soon')
+    parser.add_argument('--s3-endpoint-url',
+                        help='Use the given S3 compatible endpoint instead of AWS S3 (e.g. for testing)')
+    parser.add_argument('--backend', choices=['boto3', 'native'], default='boto3',
+                        help='S3 client implementation, "native" is a lightweight SigV4 client without boto3 ' +
+                        '(default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on http://METRICS_ADDRESS:METRICS_PORT/metrics')
+    parser.add_argument('--metrics-address', default='127.0.0.1',
+                        help='Address to bind the metrics endpoint to (default: %(default)s)')
+    parser.add_argument('--credentials-socket',
+                        help='Serve the current credentials on the given Unix domain socket')
+    parser.add_argument('--credentials-port', type=int,
+                        help='Serve the current credentials on http://CREDENTIALS_ADDRESS:CREDENTIALS_PORT/')
+    parser.add_argument('--credentials-address', default='127.0.0.1',
+                        help='Address to bind the credentials endpoint to (default: %(default)s)')
+    parser.add_argument('--credentials-allow-remote', action='store_true',
+                        help='Allow binding the credentials endpoint to a non-loopback address')
+    parser.add_argument('--on-rotate-signal',
+                        help='Send this signal (default: HUP) to --on-rotate-pid/--on-rotate-pidfile ' +
+                        'after credentials were rotated')
+    parser.add_argument('--on-rotate-pid', type=int, help='Process to signal after credentials were rotated')
+    parser.add_argument('--on-rotate-pidfile', help='Read the process to signal from this file')
+    parser.add_argument('--on-rotate-command',
+                        help='Run this shell command after credentials were rotated (with BERRY_APPLICATION_ID, ' +
+                        'BERRY_LOCAL_DIRECTORY and BERRY_ROTATED_FILES in its environment)')
+    parser.add_argument('--on-rotate-touch', help='Touch this file after credentials were rotated')
+    parser.add_argument('--hook-timeout', type=float,
+                        help='Kill the --on-rotate-command after this many seconds (default: 30)')
+    parser.add_argument('--generations', type=int, metavar='N',
+                        help='Write the credentials files changed in a cycle into a new generation directory and ' +
+                        'switch the "current" symlink to it, so that both files change at once; keep N generations')
+    parser.add_argument('--render', action='append', choices=RENDER_FORMATS,
+                        help='Also write the credentials as USER/CLIENT.env (shell variables), .properties ' +
+                        '(Java properties) or as one file per field in USER/CLIENT/ (can be repeated)')
+    parser.add_argument('--shared-cache', metavar='DIRECTORY',
+                        help='Share downloaded credentials with the other berry processes of this host ' +
+                        'through the given directory, only one process downloads each application\'s files')
+    parser.add_argument('--shared-cache-lease', type=int,
+                        help='Seconds until another process takes over the downloads of a silent one ' +
+                        '(default: three intervals, at least 60)')
+    parser.add_argument('--list-objects', action='store_true',
+                        help='Detect changed credentials files with one ListObjectsV2 request per mint bucket ' +
+                        'and only download those (needs s3:ListBucket, falls back to downloading each file)')
+    parser.add_argument('--trace', nargs='?', const='-', metavar='FILE',
+                        help='Log the timed steps of every polling cycle as one JSON line ' +
+                        '(or append them to FILE)')
+    parser.add_argument('--profile-signal', metavar='SIGNAL',
+                        help='Start and stop a sampling profiler on this signal (e.g. USR2), ' +
+                        'the hottest stacks are logged when it stops')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Write the hottest stacks of the profiler to FILE (collapsed, for flame graphs)')
     parser.add_argument('--once', help='Download credentials once and exit', action='store_true')
+    parser.add_argument('--wait-ready', type=float, metavar='SECONDS',
+                        help='Retry until both credentials files are downloaded, then exit; fail after SECONDS ' +
+                        '(exit code 3: timeout, 4: access denied, 5: not found)')
+    parser.add_argument('--status-file',
+                        help='Write the last success and error of each credentials file to this JSON file ' +
+                        'after every cycle')
     parser.add_argument('-s', '--silent', action='store_true',
                         help='silent output - only errors will be displayed')
+    parser.add_argument('-A', '--application', dest='applications', action='append',
+                        metavar='APPLICATION_ID[:MINT_BUCKET[:LOCAL_DIRECTORY]]',
+                        help='Serve the given application (can be repeated), ' +
+                        'credentials are written to LOCAL_DIRECTORY/APPLICATION_ID by default')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Maximum number of credential files fetched concurrently')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='Download scheduling, "asyncio" adds per bucket concurrency limits and deadlines ' +
+                        'for hosts serving many applications (default: %(default)s)')
+    parser.add_argument('--bucket-concurrency', type=int,
+                        help='Maximum number of concurrent downloads per mint bucket (asyncio engine, ' +
+                        'default: number of workers)')
+    parser.add_argument('--fetch-deadline', type=float,
+                        help='Seconds a single download may take before it counts as failed (asyncio engine)')
+    parser.add_argument('--retry-attempts', type=int,
+                        help='Maximum number of attempts to download a credentials file per cycle (default: 3)')
+    parser.add_argument('--retry-backoff', type=float,
+                        help='Base delay in seconds before retrying after a transient error, doubled for every ' +
+                        'further attempt and randomized (default: 0.5)')
+    parser.add_argument('--retry-max-backoff', type=float,
+                        help='Maximum delay in seconds before retrying after a transient error (default: 8)')
+    parser.add_argument('--connect-timeout', type=float,
+                        help='Timeout in seconds for connecting to S3 (default: 5)')
+    parser.add_argument('--read-timeout', type=float,
+                        help='Timeout in seconds for reading from S3 (default: 15)')
+    parser.add_argument('--cycle-deadline', type=float,
+                        help='Give up retrying after this many seconds per polling cycle (default: the interval)')
+    parser.add_argument('--endpoint-cache-file',
+                        help='Remember the region and signature version of mint buckets in the given file ' +
+                        '(default: .berry-endpoints.json in the local directory)')
+    parser.add_argument('--endpoint-cache-ttl', type=int, default=86400,
+                        help='Seconds to trust a remembered bucket region and signature version')
+    parser.add_argument('--region-lookup-order', default=','.join(REGION_LOOKUP_METHODS),
+                        help='Comma separated methods to find the region of a redirected mint bucket ' +
+                        '(default: %(default)s)')
+    parser.add_argument('--dns-timeout', type=float, default=2.0,
+                        help='Timeout in seconds for the DNS lookup of the mint bucket region')
+    return parser
+
+
+def configure():
+    parser = get_parser()
     args = parser.parse_args()
     log_level = logging.ERROR if args.silent else logging.INFO
     logging.basicConfig(level=log_level, format='%(levelname)s: %(message)s')
@@ -206,6 +999,9 @@ def main():
     except UsageError as e:
         logging.error(str(e))
         return 1
+    except NotReadyError as e:
+        logging.error(str(e))
+        return e.exit_code
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+import logging
+import threading
+
+from berry.retry import now
+from berry.state import file_signature
+
+# size of the connection pool of a botocore client unless configured otherwise
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+class S3ClientManager(object):
+    '''
+    Keeps the boto3 session and S3 clients (and thereby their connection pools) across polling cycles.
+
+    The session is only rebuilt when the AWS credentials file changes or after reset() was called,
+    the region and signature version negotiated for a bucket are kept until then.
+    '''
+
+    def __init__(self, aws_credentials_file=None, load_credentials=None, endpoint_cache=None, endpoint_url=None,
+                 max_pool_connections=None, retry_policy=None, metrics=None):
+        self.aws_credentials_file = aws_credentials_file
+        self.load_credentials = load_credentials
+        self.endpoint_cache = endpoint_cache
+        self.endpoint_url = endpoint_url
+        self.max_pool_connections = max_pool_connections
+        self.retry_policy = retry_policy
+        self.metrics = metrics
+        self.credentials_signature = None
+        self.session = None
+        self.clients = {}
+        self.endpoints = {}
+        self.reset_requested = False
+        # boto3 sessions are not thread safe, clients are
+        self.lock = threading.Lock()
+
+    @property
+    def client_error(self):
+        '''
+        Exception class raised by the clients for S3 error responses
+        '''
+        import botocore.exceptions
+        return botocore.exceptions.ClientError
+
+    @property
+    def timeout_errors(self):
+        '''
+        Exception classes raised by the clients for connect and read timeouts
+        '''
+        import botocore.exceptions
+        return (botocore.exceptions.ConnectTimeoutError, botocore.exceptions.ReadTimeoutError)
+
+    @property
+    def connection_errors(self):
+        '''
+        Exception classes raised by the clients for other network errors
+        '''
+        import botocore.exceptions
+        return (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
+
+    def create_session(self, aws_credentials):
+        import boto3.session
+        return boto3.session.Session(**aws_credentials)
+
+    def create_client(self, region, signature_version):
+        from botocore.client import Config
+
+        kwargs = {}
+        config = {}
+        if region:
+            kwargs['region_name'] = region
+        if signature_version:
+            config['signature_version'] = signature_version
+        if self.endpoint_url:
+            # S3 compatible services usually do not support virtual host style addressing
+            kwargs['endpoint_url'] = self.endpoint_url
+            config['s3'] = {'addressing_style': 'path'}
+        if self.max_pool_connections and self.max_pool_connections > DEFAULT_MAX_POOL_CONNECTIONS:
+            # keep a connection per concurrent download instead of discarding the surplus ones
+            config['max_pool_connections'] = self.max_pool_connections
+        if self.retry_policy:
+            config['connect_timeout'] = self.retry_policy.connect_timeout
+            config['read_timeout'] = self.retry_policy.read_timeout
+            # berry retries itself, within the deadline of the polling cycle
+            config['retries'] = {'max_attempts': 0}
+        if config:
+            kwargs['config'] = Config(**config)
+        return self.session.client('s3', **kwargs)
+
+    def refresh(self):
+        '''
+        Called once per cycle: re-read the credentials file if (and only if) it changed
+        '''
+        if self.reset_requested:
+            self.session = None
+            self.credentials_signature = None
+            self.reset_requested = False
+        if self.aws_credentials_file:
+            signature = file_signature(self.aws_credentials_file)
+            if signature != self.credentials_signature or self.session is None:
+                aws_credentials = self.load_credentials()
+                if self.session is not None:
+                    logging.info('AWS credentials file {} changed, creating new session'.format(
+                                 self.aws_credentials_file))
+                self.setup_session(aws_credentials)
+                self.credentials_signature = signature
+        elif self.session is None:
+            self.setup_session({})
+
+    def setup_session(self, aws_credentials):
+        start = now()
+        self.session = self.create_session(aws_credentials)
+        self.clients = {}
+        if self.metrics:
+            self.metrics.client_setup_seconds.observe(now() - start)
+
+    def reset(self):
+        '''
+        Drop session and clients after a fatal error, they are rebuilt on the next refresh()
+        '''
+        self.reset_requested = True
+
+    def endpoint(self, bucket):
+        if bucket not in self.endpoints:
+            cached = self.endpoint_cache.get(bucket) if self.endpoint_cache else None
+            self.endpoints[bucket] = cached or {'region': None, 'signature_version': None}
+        return self.endpoints[bucket]
+
+    def remember_endpoint(self, bucket):
+        if self.endpoint_cache:
+            endpoint = self.endpoint(bucket)
+            self.endpoint_cache.set(bucket, endpoint['region'], endpoint['signature_version'])
+
+    def invalidate_endpoint(self, bucket):
+        '''
+        Forget the negotiated endpoint, e.g. after a redirect showed that the cached region is stale
+        '''
+        self.endpoints[bucket] = {'region': None, 'signature_version': None}
+        if self.endpoint_cache:
+            self.endpoint_cache.invalidate(bucket)
+
+    def client(self, bucket):
+        '''
+        Return the (cached) client for the region and signature version negotiated for the bucket
+        '''
+        endpoint = self.endpoint(bucket)
+        cache_key = (endpoint['region'], endpoint['signature_version'])
+        with self.lock:
+            s3 = self.clients.get(cache_key)
+            if s3 is None:
+                start = now()
+                s3 = self.create_client(endpoint['region'], endpoint['signature_version'])
+                self.clients[cache_key] = s3
+                if self.metrics:
+                    self.metrics.client_setup_seconds.observe(now() - start)
+        return s3
+
+    def use_region(self, bucket, region):
+        self.endpoint(bucket)['region'] = region
+        self.remember_endpoint(bucket)
+        return self.client(bucket)
+
+    def use_signature_version(self, bucket, signature_version):
+        self.endpoint(bucket)['signature_version'] = signature_version
+        self.remember_endpoint(bucket)
+        return self.client(bucket)
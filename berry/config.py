@@ -0,0 +1,27 @@
+from berry.state import local_file_signature
+
+
+class ConfigWatcher(object):
+    '''
+    Detects changes of the configuration YAML by its stat signature, and reload requests (SIGHUP)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # taken before the file is read, so that a change while reading is not missed
+        self.signature = self.current_signature()
+        self.reload_requested = False
+
+    def current_signature(self):
+        return local_file_signature(self.path) if self.path else None
+
+    def request_reload(self, signum=None, frame=None):
+        self.reload_requested = True
+
+    def changed(self):
+        signature = self.current_signature()
+        if signature == self.signature and not self.reload_requested:
+            return False
+        self.signature = signature
+        self.reload_requested = False
+        return True
@@ -0,0 +1,28 @@
+class ThreadFetchEngine(object):
+    '''
+    Runs the downloads of a polling cycle in a pool of threads
+    '''
+
+    def __init__(self, fetch, context, workers):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.fetch = fetch
+        self.context = context
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def fetch_all(self, jobs):
+        '''
+        Download the given (application, file, client manager) jobs, return the error count of each job
+        '''
+        futures = [self.executor.submit(self.fetch, app, fn, clients, self.context) for app, fn, clients in jobs]
+        return [future.result() for future in futures]
+
+    def map(self, function, calls):
+        '''
+        Call the function with each of the given argument tuples concurrently, return the results
+        '''
+        futures = [self.executor.submit(function, *arguments) for arguments in calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
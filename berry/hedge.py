@@ -0,0 +1,115 @@
+import threading
+
+from berry.retry import now
+
+# a failed request counts as this many hedging thresholds of latency
+FAILURE_PENALTY = 3
+# weight of the latest observation in the moving average of a bucket's latency
+SMOOTHING = 0.3
+# seconds until a bucket's score is forgotten, so that a demoted bucket gets tried first again
+HEALTH_TTL = 300
+
+
+class BucketHealth(object):
+    '''
+    Moving average of the GetObject latency per bucket, decides which replica is asked first
+    '''
+
+    def __init__(self, threshold, ttl=HEALTH_TTL):
+        self.threshold = threshold
+        self.ttl = ttl
+        # score, time of the last observation by bucket
+        self.scores = {}
+        self.lock = threading.Lock()
+
+    def observe(self, bucket, seconds, valid):
+        value = seconds if valid else max(seconds, FAILURE_PENALTY * self.threshold)
+        current_time = now()
+        with self.lock:
+            score, updated = self.scores.get(bucket, (None, None))
+            if score is None or current_time - updated > self.ttl:
+                score = value
+            else:
+                score += SMOOTHING * (value - score)
+            self.scores[bucket] = (score, current_time)
+
+    def score(self, bucket):
+        with self.lock:
+            score, updated = self.scores.get(bucket, (0.0, None))
+        if updated is None or now() - updated > self.ttl:
+            return 0.0
+        return score
+
+    def order(self, buckets):
+        '''
+        Return the healthy buckets (scoring below the hedging threshold) in the configured order,
+        followed by the others from best to worst
+        '''
+        keys = []
+        for i, bucket in enumerate(buckets):
+            score = self.score(bucket)
+            keys.append((0, 0, i) if score < self.threshold else (1, score, i))
+        return [buckets[key[2]] for key in sorted(keys)]
+
+
+class HedgedReader(object):
+    '''
+    Reads a credentials file from replicated mint buckets: if a bucket did not answer within the threshold
+    (or failed), the same request is sent to the next one and the first valid response wins
+    '''
+
+    def __init__(self, threshold, workers, metrics=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.threshold = threshold
+        self.health = BucketHealth(threshold)
+        self.metrics = metrics
+        # requests losing the race keep their thread until they complete or time out
+        self.executor = ThreadPoolExecutor(max_workers=2 * workers)
+
+    def valid(self, clients, error):
+        '''
+        Whether the request failed with an error (or "Not Modified") that ends the race
+        '''
+        if error is None:
+            return True
+        return (isinstance(error, clients.client_error) and
+                error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304)
+
+    def request(self, clients, bucket, kwargs):
+        start = now()
+        try:
+            response = clients.client(bucket).get_object(Bucket=bucket, **kwargs)
+        except Exception as e:
+            self.health.observe(bucket, now() - start, self.valid(clients, e))
+            raise
+        self.health.observe(bucket, now() - start, True)
+        return response
+
+    def get_object(self, clients, buckets, **kwargs):
+        '''
+        Return the bucket and the future of the first valid response, or those of the preferred bucket if none was
+        '''
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        order = self.health.order(buckets)
+        futures = []
+        pending = set()
+        while True:
+            if len(futures) < len(order):
+                bucket = order[len(futures)]
+                if futures and self.metrics:
+                    self.metrics.hedged_requests.inc(bucket)
+                future = self.executor.submit(self.request, clients, bucket, kwargs)
+                futures.append((bucket, future))
+                pending.add(future)
+            done, pending = wait(pending, self.threshold if len(futures) < len(order) else None,
+                                 return_when=FIRST_COMPLETED)
+            for bucket, future in futures:
+                if future in done and self.valid(clients, future.exception()):
+                    return bucket, future
+            if not pending and len(futures) == len(order):
+                return futures[0]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
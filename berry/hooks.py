@@ -0,0 +1,117 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+
+class RotationHook(object):
+    '''
+    Actions notifying an application about rotated credentials: send a signal to a process (by PID or pidfile),
+    run a shell command and/or touch a trigger file. The command is killed after "timeout" seconds.
+    '''
+
+    def __init__(self, signum=None, pid=None, pidfile=None, command=None, touch=None, timeout=30):
+        self.signum = signum
+        self.pid = pid
+        self.pidfile = pidfile
+        self.command = command
+        self.touch = touch
+        self.timeout = timeout
+
+    def send_signal(self):
+        pid = self.pid
+        if self.pidfile:
+            with open(self.pidfile) as fd:
+                pid = int(fd.read().strip())
+        os.kill(pid, self.signum)
+        logging.debug('Sent signal {} to process {}'.format(self.signum, pid))
+
+    def touch_file(self):
+        with open(self.touch, 'a'):
+            os.utime(self.touch, None)
+
+    def run_command(self, app, files):
+        env = dict(os.environ)
+        env.update(BERRY_APPLICATION_ID=app.application_id, BERRY_LOCAL_DIRECTORY=app.local_directory,
+                   BERRY_ROTATED_FILES=','.join(files))
+        process = subprocess.Popen(self.command, shell=True, env=env)
+        deadline = time.time() + self.timeout
+        while process.poll() is None:
+            if time.time() > deadline:
+                process.kill()
+                process.wait()
+                raise RuntimeError('killed after {} seconds'.format(self.timeout))
+            time.sleep(0.05)
+        if process.returncode:
+            raise RuntimeError('exit code {}'.format(process.returncode))
+
+    def run(self, app, files):
+        actions = []
+        if self.touch:
+            actions.append(('touch {}'.format(self.touch), self.touch_file))
+        if self.signum:
+            actions.append(('signal {}'.format(self.signum), self.send_signal))
+        if self.command:
+            actions.append(('command "{}"'.format(self.command), lambda: self.run_command(app, files)))
+        for description, action in actions:
+            try:
+                action()
+            except Exception as e:
+                logging.error('Rotation hook {} for {} failed: {}'.format(description, app.application_id, e))
+
+
+class HookRunner(object):
+    '''
+    Runs rotation hooks in background threads, so that a slow hook does not delay the polling loop.
+
+    All files rotated while the hook of an application runs are coalesced into one further notification.
+    '''
+
+    def __init__(self):
+        # local directory (unique per application, the ID is not) => thread running its hook
+        self.threads = {}
+        # local directory => (application, rotated files) waiting for the running hook
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def notify(self, app, files):
+        with self.lock:
+            key = app.local_directory
+            if key in self.threads:
+                waiting = self.pending.get(key, (app, set()))[1]
+                self.pending[key] = (app, waiting | set(files))
+                return
+            thread = threading.Thread(target=self.run, args=(app, set(files)),
+                                      name='berry-hook-{}'.format(app.application_id))
+            thread.daemon = True
+            self.threads[key] = thread
+        thread.start()
+
+    def run(self, app, files):
+        key = app.local_directory
+        while True:
+            logging.info('Running rotation hook for {} ({} rotated)'.format(
+                         app.application_id, ', '.join(sorted(files))))
+            # the hook may have been removed by a configuration reload meanwhile
+            if app.hook:
+                app.hook.run(app, sorted(files))
+            with self.lock:
+                if key not in self.pending:
+                    del self.threads[key]
+                    return
+                app, files = self.pending.pop(key)
+
+    def join(self, timeout):
+        '''
+        Wait up to "timeout" seconds for the running hooks
+        '''
+        deadline = time.time() + timeout
+        while True:
+            with self.lock:
+                threads = list(self.threads.values())
+            if not threads:
+                return
+            threads[0].join(max(0, deadline - time.time()))
+            if time.time() >= deadline:
+                return
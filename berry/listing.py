@@ -0,0 +1,92 @@
+import logging
+import os
+
+
+def list_objects(s3, bucket, prefix, metrics):
+    '''
+    Return all objects with the given key prefix by key, following the pagination of ListObjectsV2
+    '''
+    objects = {}
+    kwargs = {'Bucket': bucket}
+    if prefix:
+        kwargs['Prefix'] = prefix
+    while True:
+        with metrics.list_objects_seconds.time():
+            response = s3.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            objects[obj['Key']] = obj
+        if not response.get('IsTruncated'):
+            return objects
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+class ChangeDetector(object):
+    '''
+    Finds the unchanged credentials files of a cycle with one paginated ListObjectsV2 per mint bucket
+    (and client manager) instead of a conditional GetObject per file.
+
+    Buckets which may not be listed (AccessDenied) are not listed again, their files are downloaded one by one.
+    '''
+
+    def __init__(self, context):
+        self.context = context
+        # (client manager, bucket) without s3:ListBucket permission
+        self.denied = set()
+
+    def listing(self, clients, bucket, keys):
+        '''
+        Return the objects with the given keys (and possibly others) by key, None if the bucket could not be listed
+        '''
+        try:
+            return list_objects(clients.client(bucket), bucket, os.path.commonprefix(keys), self.context.metrics)
+        except clients.client_error as e:
+            error = e.response.get('Error', {})
+            status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if error.get('Code') == 'AccessDenied' or status_code == 403:
+                logging.info(('Listing mint S3 bucket "{}" is not allowed, ' +
+                              'downloading each credentials file instead').format(bucket))
+                self.denied.add((clients, bucket))
+            else:
+                logging.warning('Could not list mint S3 bucket "{}": {}'.format(bucket, e))
+        except clients.timeout_errors + clients.connection_errors as e:
+            logging.warning('Could not list mint S3 bucket "{}": {}'.format(bucket, e))
+        return None
+
+    def skip(self, app, fn, key_name, obj):
+        context = self.context
+        context.metrics.refreshed(app.application_id, fn)
+        if context.scheduler:
+            context.scheduler.observe_modified(key_name, obj.get('LastModified'))
+        if context.store is not None:
+            context.store.load(app.application_id, fn, os.path.join(app.local_directory, '{}.json'.format(fn)))
+
+    def filter(self, jobs, engine):
+        '''
+        Return the (application, file, client manager) jobs whose file changed or could not be checked
+        '''
+        groups = []
+        for job in jobs:
+            app, fn, clients = job
+            if (clients, app.mint_bucket) in self.denied:
+                continue
+            for group in groups:
+                if group[0] is clients and group[1] == app.mint_bucket:
+                    group[2].append(job)
+                    break
+            else:
+                groups.append((clients, app.mint_bucket, [job]))
+
+        listings = engine.map(self.listing, [(clients, bucket, ['{}/{}.json'.format(app.application_id, fn)
+                                                                for app, fn, c in group_jobs])
+                                             for clients, bucket, group_jobs in groups])
+        unchanged = set()
+        for (clients, bucket, group_jobs), listing in zip(groups, listings):
+            for app, fn, c in group_jobs:
+                key_name = '{}/{}.json'.format(app.application_id, fn)
+                obj = (listing or {}).get(key_name)
+                local_file = os.path.join(app.local_directory, '{}.json'.format(fn))
+                if (obj and app.fetch_state.unchanged(key_name, local_file, obj.get('ETag')) and
+                        self.context.output.complete(app, fn)):
+                    self.skip(app, fn, key_name, obj)
+                    unchanged.add((id(app), fn))
+        return [job for job in jobs if (id(job[0]), job[1]) not in unchanged]
@@ -0,0 +1,192 @@
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+ERROR_CLASSES = ('403', '404', 'redirect', 'sigv4_fallback', 'timeout', 'other')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+now = getattr(time, 'monotonic', time.time)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(now() - self.start)
+
+
+class Histogram(object):
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return Timer(self)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels({'le': format_value(bound)}),
+                                                     cumulative))
+            lines.append('{}_sum {}'.format(self.name, format_value(self.sum)))
+            lines.append('{}_count {}'.format(self.name, cumulative))
+        return lines
+
+
+class Counter(object):
+    def __init__(self, name, documentation, label_name, label_values=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.values = dict((value, 0) for value in label_values)
+        self.lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            for label_value, value in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(self.name, format_labels({self.label_name: label_value}),
+                                              format_value(value)))
+        return lines
+
+
+class Metrics(object):
+    '''
+    Latency histograms, error counters and freshness gauges of the fetch loop
+    '''
+
+    def __init__(self):
+        self.client_setup_seconds = Histogram('berry_client_setup_seconds',
+                                              'Time spent setting up the boto3 session and S3 clients')
+        self.get_object_seconds = Histogram('berry_get_object_seconds', 'Latency of S3 GetObject requests')
+        self.body_bytes = Histogram('berry_body_bytes', 'Size of downloaded credentials files', SIZE_BUCKETS)
+        self.json_parse_seconds = Histogram('berry_json_parse_seconds',
+                                            'Time spent parsing downloaded credentials files')
+        self.local_update_seconds = Histogram('berry_local_update_seconds',
+                                              'Time spent comparing and writing local credentials files')
+        self.bucket_region_seconds = Histogram('berry_get_bucket_region_seconds',
+                                               'Time spent looking up the region of a redirected mint bucket')
+        self.list_objects_seconds = Histogram('berry_list_objects_seconds',
+                                              'Latency of S3 ListObjectsV2 requests for change detection')
+        self.errors = Counter('berry_s3_errors_total', 'S3 errors by error class', 'error', ERROR_CLASSES)
+        self.hedged_requests = Counter('berry_hedged_requests_total',
+                                       'GetObject requests sent to a replica mint bucket because the ones ' +
+                                       'before were slow or failed', 'bucket')
+        self.last_success = {}
+        # (application ID, file) => time, error class, message of the last failed download
+        self.last_error = {}
+        self.lock = threading.Lock()
+
+    def histograms(self):
+        return [self.client_setup_seconds, self.get_object_seconds, self.body_bytes, self.json_parse_seconds,
+                self.local_update_seconds, self.bucket_region_seconds, self.list_objects_seconds]
+
+    def refreshed(self, application_id, fn):
+        with self.lock:
+            self.last_success[(application_id, fn)] = time.time()
+            self.last_error.pop((application_id, fn), None)
+
+    def failed(self, application_id, fn, error_class, message=None):
+        with self.lock:
+            self.last_error[(application_id, fn)] = (time.time(), error_class, message)
+
+    def file_status(self, application_id, fn):
+        '''
+        Time of the last successful refresh and the error since then of the given credentials file
+        '''
+        with self.lock:
+            last_success = self.last_success.get((application_id, fn))
+            error_time, error_class, message = self.last_error.get((application_id, fn), (None, None, None))
+        return {'last_success': last_success, 'error_time': error_time, 'error_class': error_class,
+                'error': message}
+
+    def forget(self, application_id):
+        with self.lock:
+            for key in [key for key in self.last_success if key[0] == application_id]:
+                del self.last_success[key]
+            for key in [key for key in self.last_error if key[0] == application_id]:
+                del self.last_error[key]
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms():
+            lines.extend(histogram.render())
+        lines.extend(self.errors.render())
+        lines.extend(self.hedged_requests.render())
+        name = 'berry_seconds_since_last_refresh'
+        lines.append('# HELP {} Seconds since the credentials file was last refreshed successfully'.format(name))
+        lines.append('# TYPE {} gauge'.format(name))
+        current_time = time.time()
+        with self.lock:
+            for (application_id, fn), timestamp in sorted(self.last_success.items()):
+                lines.append('{}{} {}'.format(name, format_labels({'application_id': application_id, 'file': fn}),
+                                              format_value(current_time - timestamp)))
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(metrics, port, address='127.0.0.1'):
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:  # Python 2
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='berry-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,369 @@
+'''
+Lightweight S3 backend: signs GetObject/GetBucketLocation requests with AWS Signature Version 4 itself
+and sends them over persistent HTTPS connections, without loading boto3/botocore
+'''
+
+import datetime
+import email.utils
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+try:
+    import http.client as httplib
+    from urllib.parse import quote, urlparse
+except ImportError:  # Python 2
+    import httplib
+    from urllib import quote
+    from urlparse import urlparse
+
+from berry.client import S3ClientManager
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+METADATA_HOST = '169.254.169.254'
+# refresh instance profile credentials this many seconds before they expire
+CREDENTIALS_REFRESH_MARGIN = 300
+DEFAULT_REGION = 'us-east-1'
+# same as botocore
+DEFAULT_TIMEOUT = 60
+
+
+class S3ClientError(Exception):
+    '''
+    S3 error response, with the same "response" structure as botocore's ClientError
+    '''
+
+    def __init__(self, response, operation_name):
+        self.response = response
+        self.operation_name = operation_name
+        error = response.get('Error', {})
+        super(S3ClientError, self).__init__('An error occurred ({}) when calling the {} operation: {}'.format(
+                                            error.get('Code', 'Unknown'), operation_name,
+                                            error.get('Message', 'Unknown')))
+
+
+class Credentials(object):
+    def __init__(self, access_key, secret_key, token=None, expiration=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.token = token
+        self.expiration = expiration
+
+
+def parse_timestamp(value):
+    '''
+    Parse ISO 8601 ("2016-01-02T03:04:05Z", "2016-01-02T03:04:05+00:00") timestamps as naive UTC datetime
+    '''
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def http_date(value):
+    if not isinstance(value, datetime.datetime):
+        value = parse_timestamp(value)
+    timestamp = (value - datetime.datetime(1970, 1, 1)).total_seconds()
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+class MetadataCredentialsProvider(object):
+    '''
+    Temporary credentials of the EC2 instance profile (IMDSv2, falling back to IMDSv1)
+    '''
+
+    def __init__(self, timeout=2):
+        self.timeout = timeout
+
+    def request(self, method, path, headers):
+        connection = httplib.HTTPConnection(METADATA_HOST, timeout=self.timeout)
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            body = response.read().decode('utf-8')
+            if response.status != 200:
+                raise IOError('Instance metadata request {} {} failed with status {}'.format(
+                              method, path, response.status))
+            return body
+        finally:
+            connection.close()
+
+    def __call__(self):
+        headers = {}
+        try:
+            headers['X-aws-ec2-metadata-token'] = self.request(
+                'PUT', '/latest/api/token', {'X-aws-ec2-metadata-token-ttl-seconds': '21600'})
+        except (IOError, socket.error, httplib.HTTPException) as e:
+            logging.debug('Could not get instance metadata token, using IMDSv1: {}'.format(e))
+        path = '/latest/meta-data/iam/security-credentials/'
+        role = self.request('GET', path, headers).splitlines()[0].strip()
+        data = json.loads(self.request('GET', path + role, headers))
+        expiration = time.time() + 3600
+        if data.get('Expiration'):
+            expiration = (parse_timestamp(data['Expiration']) - datetime.datetime(1970, 1, 1)).total_seconds()
+        return Credentials(data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'), expiration)
+
+
+class CredentialsChain(object):
+    '''
+    Same sources as berry with boto3: the explicit credentials (-c file), environment variables and the
+    instance profile
+    '''
+
+    def __init__(self, aws_credentials=None, metadata_provider=None):
+        self.aws_credentials = aws_credentials or {}
+        self.metadata_provider = metadata_provider or MetadataCredentialsProvider()
+        self.credentials = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.aws_credentials.get('aws_access_key_id'):
+            return Credentials(self.aws_credentials['aws_access_key_id'],
+                               self.aws_credentials['aws_secret_access_key'],
+                               self.aws_credentials.get('aws_session_token'))
+        if os.environ.get('AWS_ACCESS_KEY_ID') and os.environ.get('AWS_SECRET_ACCESS_KEY'):
+            return Credentials(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'],
+                               os.environ.get('AWS_SESSION_TOKEN') or os.environ.get('AWS_SECURITY_TOKEN'))
+        return self.metadata_provider()
+
+    def get(self):
+        with self.lock:
+            credentials = self.credentials
+            if (credentials is None or
+                    (credentials.expiration and credentials.expiration - CREDENTIALS_REFRESH_MARGIN < time.time())):
+                credentials = self.credentials = self.load()
+            return credentials
+
+
+def sign(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+def signature_headers(credentials, region, method, host, path, query, headers, now=None):
+    '''
+    Return the headers to add for a SigV4 signed S3 request without payload
+    '''
+    now = now or datetime.datetime.utcnow()
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = now.strftime('%Y%m%d')
+    signed = dict((name.lower(), str(value).strip()) for name, value in headers.items())
+    signed['host'] = host
+    signed['x-amz-date'] = amz_date
+    signed['x-amz-content-sha256'] = EMPTY_SHA256
+    if credentials.token:
+        signed['x-amz-security-token'] = credentials.token
+    signed_header_names = ';'.join(sorted(signed))
+    canonical_query = '&'.join('{}={}'.format(quote(k, safe='-_.~'), quote(v, safe='-_.~'))
+                               for k, v in sorted(query.items()))
+    canonical_request = '\n'.join([method, quote(path, safe='/-_.~'), canonical_query,
+                                   ''.join('{}:{}\n'.format(k, signed[k]) for k in sorted(signed)),
+                                   signed_header_names, EMPTY_SHA256])
+    scope = '{}/{}/s3/aws4_request'.format(date_stamp, region)
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+    key = sign(('AWS4' + credentials.secret_key).encode('utf-8'), date_stamp)
+    for part in (region, 's3', 'aws4_request'):
+        key = sign(key, part)
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    result = {'x-amz-date': amz_date, 'x-amz-content-sha256': EMPTY_SHA256,
+              'Authorization': 'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+                  credentials.access_key, scope, signed_header_names, signature)}
+    if credentials.token:
+        result['x-amz-security-token'] = credentials.token
+    return result
+
+
+def parse_error(body):
+    error = {}
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        return error
+    for child in root:
+        error[child.tag.split('}')[-1]] = child.text
+    return error
+
+
+class Body(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class ConnectionPool(object):
+    '''
+    Idle keep-alive connections per host
+    '''
+
+    def __init__(self, connect_timeout, read_timeout):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, scheme, host):
+        with self.lock:
+            connections = self.idle.get((scheme, host))
+            if connections:
+                return connections.pop(), True
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        connection = connection_class(host, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def release(self, scheme, host, connection):
+        with self.lock:
+            self.idle.setdefault((scheme, host), []).append(connection)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+class NativeSession(object):
+    def __init__(self, credentials, connect_timeout=DEFAULT_TIMEOUT, read_timeout=DEFAULT_TIMEOUT):
+        self.credentials = credentials
+        self.pool = ConnectionPool(connect_timeout, read_timeout)
+
+
+class NativeS3Client(object):
+    '''
+    Implements the subset of the boto3 S3 client API used by berry
+    '''
+
+    def __init__(self, session, region=None, endpoint_url=None):
+        self.session = session
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or \
+            DEFAULT_REGION
+        self.endpoint_url = endpoint_url
+
+    def address(self, bucket, key):
+        '''
+        Return scheme, host and path of the given object
+        '''
+        if self.endpoint_url:
+            url = urlparse(self.endpoint_url)
+            return url.scheme, url.netloc, '{}/{}/{}'.format(url.path.rstrip('/'), bucket, key)
+        host = 's3.amazonaws.com' if self.region == DEFAULT_REGION else 's3.{}.amazonaws.com'.format(self.region)
+        if '.' in bucket:
+            # the wildcard certificate does not match bucket names with dots
+            return 'https', host, '/{}/{}'.format(bucket, key)
+        return 'https', '{}.{}'.format(bucket, host), '/' + key
+
+    def request(self, operation_name, bucket, key='', query=None, headers=None):
+        query = query or {}
+        headers = dict(headers or {})
+        scheme, host, path = self.address(bucket, key)
+        headers.update(signature_headers(self.session.credentials.get(), self.region, 'GET', host, path,
+                                         query, headers))
+        url = quote(path, safe='/-_.~')
+        if query:
+            url += '?' + '&'.join('{}={}'.format(quote(k, safe='-_.~'), quote(v, safe='-_.~')) if v else k
+                                  for k, v in sorted(query.items()))
+
+        for attempt in range(2):
+            connection, reused = self.session.pool.acquire(scheme, host)
+            try:
+                connection.request('GET', url, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except socket.timeout:
+                connection.close()
+                raise
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                # a kept-alive connection may have been closed by the server meanwhile
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.getheader('connection', '').lower() == 'close':
+                connection.close()
+            else:
+                self.session.pool.release(scheme, host, connection)
+            break
+
+        if response.status >= 300:
+            error = parse_error(body) if body else {}
+            if response.status == 304:
+                error = {'Code': '304', 'Message': 'Not Modified'}
+            error.setdefault('Code', str(response.status))
+            bucket_region = response.getheader('x-amz-bucket-region')
+            if bucket_region:
+                error.setdefault('Region', bucket_region)
+            raise S3ClientError({'Error': error,
+                                 'ResponseMetadata': {'HTTPStatusCode': response.status,
+                                                      'HTTPHeaders': dict((k.lower(), v)
+                                                                          for k, v in response.getheaders())}},
+                                operation_name)
+        return response, body
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, IfModifiedSince=None):
+        headers = {}
+        if IfNoneMatch:
+            headers['If-None-Match'] = IfNoneMatch
+        if IfModifiedSince:
+            headers['If-Modified-Since'] = http_date(IfModifiedSince)
+        response, body = self.request('GetObject', Bucket, Key, headers=headers)
+        result = {'Body': Body(body), 'ContentLength': len(body), 'ETag': response.getheader('etag')}
+        last_modified = response.getheader('last-modified')
+        if last_modified:
+            result['LastModified'] = datetime.datetime(*email.utils.parsedate(last_modified)[:6])
+        return result
+
+    def get_bucket_location(self, Bucket):
+        response, body = self.request('GetBucketLocation', Bucket, query={'location': ''})
+        root = ElementTree.fromstring(body)
+        return {'LocationConstraint': root.text or None}
+
+    def list_objects_v2(self, Bucket, Prefix=None, ContinuationToken=None):
+        query = {'list-type': '2'}
+        if Prefix:
+            query['prefix'] = Prefix
+        if ContinuationToken:
+            query['continuation-token'] = ContinuationToken
+        response, body = self.request('ListObjectsV2', Bucket, query=query)
+        result = {'Contents': [], 'IsTruncated': False}
+        for child in ElementTree.fromstring(body):
+            tag = child.tag.split('}')[-1]
+            if tag == 'Contents':
+                obj = dict((field.tag.split('}')[-1], field.text) for field in child)
+                if obj.get('LastModified'):
+                    obj['LastModified'] = parse_timestamp(obj['LastModified'])
+                obj['Size'] = int(obj.get('Size') or 0)
+                result['Contents'].append(obj)
+            elif tag == 'IsTruncated':
+                result['IsTruncated'] = child.text == 'true'
+            elif tag == 'NextContinuationToken':
+                result['NextContinuationToken'] = child.text
+        return result
+
+
+class NativeClientManager(S3ClientManager):
+    '''
+    Client manager for the lightweight backend, see S3ClientManager
+    '''
+
+    client_error = S3ClientError
+    timeout_errors = (socket.timeout,)
+    connection_errors = (socket.error, httplib.HTTPException)
+
+    def create_session(self, aws_credentials):
+        if self.session is not None:
+            self.session.pool.close()
+        if self.retry_policy:
+            return NativeSession(CredentialsChain(aws_credentials), self.retry_policy.connect_timeout,
+                                 self.retry_policy.read_timeout)
+        return NativeSession(CredentialsChain(aws_credentials))
+
+    def create_client(self, region, signature_version):
+        # always signs with SigV4, the signature version negotiated by boto3 does not matter
+        return NativeS3Client(self.session, region, self.endpoint_url)
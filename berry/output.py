@@ -0,0 +1,269 @@
+import logging
+import os
+import re
+import shutil
+import threading
+
+from berry.state import string_types
+
+FILES = ('user', 'client')
+GENERATIONS_DIRECTORY = 'generations'
+CURRENT_LINK = 'current'
+# pre-rendered formats written next to the JSON files, see render()
+RENDER_FORMATS = ('env', 'properties', 'fields')
+FIELD_NAME = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*$')
+ENV_NAME = re.compile(r'^[A-Z_][A-Z0-9_]*$')
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, string_types):
+        return value
+    return u'{}'.format(value)
+
+
+def shell_quote(value):
+    return u"'" + value.replace(u"'", u"'\"'\"'") + u"'"
+
+
+def properties_escape(value, key=False):
+    result = []
+    for i, char in enumerate(value):
+        if char in u'\\=:#!' or (char == u' ' and (key or i == 0)):
+            result.append(u'\\' + char)
+        elif char in u'\t\n\r\f':
+            result.append(u'\\' + u'tnrf'[u'\t\n\r\f'.index(char)])
+        elif ord(char) > 0xffff:
+            # as UTF-16 surrogate pair
+            code = ord(char) - 0x10000
+            result.append(u'\\u{:04x}\\u{:04x}'.format(0xd800 + (code >> 10), 0xdc00 + (code & 0x3ff)))
+        elif ord(char) < 0x20 or ord(char) > 0x7e:
+            result.append(u'\\u{:04x}'.format(ord(char)))
+        else:
+            result.append(char)
+    return u''.join(result)
+
+
+def rendered_names(fn, formats):
+    '''
+    Return the names of the files (and directories) rendered for the given credentials file
+    '''
+    return [fn if output_format == 'fields' else '{}.{}'.format(fn, output_format) for output_format in formats]
+
+
+def env_variables(fields):
+    '''
+    Return (name, value) pairs of the fields with valid and unique shell variable names
+    '''
+    names = set()
+    variables = []
+    for key, value in fields:
+        name = re.sub(r'[^A-Z0-9_]', '_', key.upper())
+        if ENV_NAME.match(name) and name not in names:
+            names.add(name)
+            variables.append((name, value))
+    return variables
+
+
+def render(fn, content, formats):
+    '''
+    Return the pre-rendered files (path relative to the local directory => data) of the given parsed
+    credentials file, top level fields with a scalar value are rendered
+    '''
+    fields = []
+    if isinstance(content, dict):
+        fields = [(key, format_value(value)) for key, value in sorted(content.items())
+                  if isinstance(value, string_types + (bool, int, float))]
+    files = {}
+    for output_format in formats:
+        if output_format == 'env':
+            files[fn + '.env'] = u''.join(u'{}={}\n'.format(name, shell_quote(value))
+                                          for name, value in env_variables(fields)).encode('utf-8')
+        elif output_format == 'properties':
+            files[fn + '.properties'] = u''.join(u'{}={}\n'.format(properties_escape(key, key=True),
+                                                                   properties_escape(value))
+                                                 for key, value in fields).encode('ascii')
+        elif output_format == 'fields':
+            for key, value in fields:
+                if FIELD_NAME.match(key):
+                    files[os.path.join(fn, key)] = value.encode('utf-8')
+    return files
+
+
+def write_file(path, data, sync=False):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as fd:
+        fd.write(data)
+        if sync:
+            fd.flush()
+            os.fsync(fd.fileno())
+    os.rename(tmp_file, path)
+
+
+def write_files(directory, fn, files, formats, sync=False):
+    '''
+    Write the files of a credentials file (the JSON file last), removing fields which disappeared
+    '''
+    fields_directory = os.path.join(directory, fn)
+    if 'fields' in formats:
+        if not os.path.isdir(fields_directory):
+            os.makedirs(fields_directory)
+        for name in os.listdir(fields_directory):
+            if os.path.join(fn, name) not in files:
+                os.remove(os.path.join(fields_directory, name))
+    json_name = '{}.json'.format(fn)
+    for name in sorted(files, key=lambda name: name == json_name):
+        write_file(os.path.join(directory, name), files[name], sync)
+
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_symlink(target, path):
+    '''
+    Atomically (re)place the symbolic link at path
+    '''
+    tmp_path = path + '.tmp'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.symlink(target, tmp_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # fields rendered before the generations were enabled
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def link_files(source, target):
+    '''
+    Hard link the file or the files of the directory at source to target
+    '''
+    if os.path.isdir(source):
+        os.makedirs(target)
+        for name in os.listdir(source):
+            os.link(os.path.join(source, name), os.path.join(target, name))
+    elif os.path.exists(source):
+        os.link(source, target)
+
+
+class FileOutput(object):
+    '''
+    Replaces each changed credentials file (and its pre-rendered formats) on its own,
+    every file with a temporary file and a rename
+    '''
+
+    def __init__(self, formats=()):
+        self.formats = tuple(formats)
+
+    def write(self, app, fn, data, digest, content=None):
+        files = render(fn, content, self.formats)
+        files['{}.json'.format(fn)] = data
+        write_files(app.local_directory, fn, files, self.formats)
+        app.fetch_state.written(os.path.join(app.local_directory, '{}.json'.format(fn)), digest)
+
+    def complete(self, app, fn):
+        '''
+        Whether all pre-rendered formats of the credentials file exist
+        '''
+        return all(os.path.exists(os.path.join(app.local_directory, name))
+                   for name in rendered_names(fn, self.formats))
+
+    def commit(self, app, metrics=None):
+        return 0
+
+
+class GenerationOutput(FileOutput):
+    '''
+    Writes the credentials files changed in a polling cycle into a new generation directory and then switches
+    the "current" symlink to it, so that consumers see user.json and client.json change together.
+
+    LOCAL_DIRECTORY/user.json and client.json (and their pre-rendered formats) are symlinks into "current"
+    for consumers reading single files.
+    '''
+
+    def __init__(self, retention, formats=()):
+        FileOutput.__init__(self, formats)
+        self.retention = retention
+        # Application => {file: (files, digest)} written since the last commit
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def write(self, app, fn, data, digest, content=None):
+        files = render(fn, content, self.formats)
+        files['{}.json'.format(fn)] = data
+        with self.lock:
+            self.pending.setdefault(app, {})[fn] = (files, digest)
+
+    def generations(self, directory):
+        '''
+        Return the numbers of the generations in the given directory, oldest first
+        '''
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def commit(self, app, metrics=None):
+        '''
+        Publish the files written for the application as a new generation, return the number of errors
+        '''
+        with self.lock:
+            files = self.pending.pop(app, None)
+        if not files:
+            return 0
+        try:
+            self.publish(app, files)
+        except (IOError, OSError) as e:
+            logging.error('Could not write a new generation of credentials in {}: {}'.format(app.local_directory, e))
+            for fn in files:
+                # downloaded again in the next cycle
+                app.fetch_state.forget('{}/{}.json'.format(app.application_id, fn))
+                if metrics:
+                    metrics.failed(app.application_id, fn, 'other', str(e))
+            app.rotated = [fn for fn in app.rotated if fn not in files]
+            return 1
+        self.prune(app)
+        return 0
+
+    def publish(self, app, files):
+        generations_directory = os.path.join(app.local_directory, GENERATIONS_DIRECTORY)
+        numbers = self.generations(generations_directory)
+        generation = os.path.join(generations_directory, str(numbers[-1] + 1 if numbers else 1))
+        tmp_directory = generation + '.tmp'
+        if os.path.exists(tmp_directory):
+            shutil.rmtree(tmp_directory)
+        os.makedirs(tmp_directory)
+        for fn in FILES:
+            if fn in files:
+                write_files(tmp_directory, fn, files[fn][0], self.formats, sync=True)
+            else:
+                # unchanged, from the current generation (or plain files written before)
+                for name in ['{}.json'.format(fn)] + rendered_names(fn, self.formats):
+                    link_files(os.path.realpath(os.path.join(app.local_directory, name)),
+                               os.path.join(tmp_directory, name))
+        os.rename(tmp_directory, generation)
+        fsync_directory(generations_directory)
+
+        replace_symlink(os.path.join(GENERATIONS_DIRECTORY, os.path.basename(generation)),
+                        os.path.join(app.local_directory, CURRENT_LINK))
+        for fn in FILES:
+            for name in ['{}.json'.format(fn)] + rendered_names(fn, self.formats):
+                path = os.path.join(app.local_directory, name)
+                target = os.path.join(CURRENT_LINK, name)
+                if not os.path.islink(path) or os.readlink(path) != target:
+                    replace_symlink(target, path)
+        fsync_directory(app.local_directory)
+
+        for fn, (fn_files, digest) in files.items():
+            app.fetch_state.written(os.path.join(app.local_directory, '{}.json'.format(fn)), digest)
+
+    def prune(self, app):
+        generations_directory = os.path.join(app.local_directory, GENERATIONS_DIRECTORY)
+        for number in self.generations(generations_directory)[:-self.retention]:
+            shutil.rmtree(os.path.join(generations_directory, str(number)), ignore_errors=True)
@@ -0,0 +1,36 @@
+import collections
+import threading
+import time
+
+
+class CachingResolver(object):
+    '''
+    DNS lookups with a bounded cache which honours the TTL of the answer
+    '''
+
+    def __init__(self, timeout=2.0, max_size=128):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def query(self, name, rdtype):
+        key = (name, rdtype)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and entry[0] > now:
+                # re-insert to mark as most recently used
+                self.entries[key] = entry
+                return entry[1]
+
+        import dns.resolver
+        answers = dns.resolver.query(name, rdtype, lifetime=self.timeout)
+
+        ttl = getattr(getattr(answers, 'rrset', None), 'ttl', 0)
+        if isinstance(ttl, int) and ttl > 0:
+            with self.lock:
+                self.entries[key] = (now + ttl, answers)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return answers
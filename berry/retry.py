@@ -0,0 +1,45 @@
+import random
+import time
+
+# not affected by changes of the system clock
+now = getattr(time, 'monotonic', time.time)
+
+
+class RetryPolicy(object):
+    '''
+    Timeouts and retries of S3 requests: transient errors (timeouts, connection errors, 5xx responses)
+    are retried with exponential backoff and full jitter as long as the deadline of the polling cycle allows
+    '''
+
+    def __init__(self, attempts=3, connect_timeout=5.0, read_timeout=15.0, backoff=0.5, max_backoff=8.0,
+                 cycle_deadline=None):
+        self.attempts = attempts
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cycle_deadline = cycle_deadline
+
+    def delay(self, attempt):
+        '''
+        Randomized delay after the given failed attempt (starting with 1)
+        '''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def deadline(self):
+        '''
+        Point in time (see now()) by which a cycle starting now has to be finished, None for no deadline
+        '''
+        return now() + self.cycle_deadline if self.cycle_deadline else None
+
+    def wait(self, attempt, deadline=None):
+        '''
+        Sleep before retrying after the given failed attempt, return False if no retry should be made
+        '''
+        if attempt >= self.attempts:
+            return False
+        delay = self.delay(attempt)
+        if deadline is not None and now() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
@@ -0,0 +1,80 @@
+import calendar
+import datetime
+import random
+import threading
+import time
+
+# number of distinct Last-Modified timestamps remembered per key to predict the next rotation
+HISTORY_SIZE = 10
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return None
+
+
+class PollScheduler(object):
+    '''
+    Decides how long to sleep between polling cycles:
+
+    * the delay is randomized by +/- jitter (a fraction of the delay) so that instances do not poll in lockstep
+    * consecutive cycles failing with transient errors back off exponentially up to max_backoff seconds
+    * with fast_interval set, berry polls at that interval when the next rotation is expected soon,
+      the expected time is predicted from the history of Last-Modified timestamps in S3
+    '''
+
+    def __init__(self, interval, jitter=0.1, max_backoff=None, fast_interval=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max(max_backoff or interval, interval)
+        self.fast_interval = fast_interval
+        self.failures = 0
+        self.history = {}
+        self.lock = threading.Lock()
+
+    def randomize(self, delay):
+        return max(0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def startup_delay(self):
+        return random.uniform(0, self.interval * self.jitter)
+
+    def record_cycle(self, success):
+        self.failures = 0 if success else self.failures + 1
+
+    def observe_modified(self, key_name, last_modified):
+        timestamp = to_timestamp(last_modified)
+        if timestamp is None:
+            return
+        with self.lock:
+            history = self.history.setdefault(key_name, [])
+            if timestamp not in history:
+                history.append(timestamp)
+                history.sort()
+                del history[:-HISTORY_SIZE]
+
+    def predict_rotation(self, key_name):
+        with self.lock:
+            history = list(self.history.get(key_name, []))
+        if len(history) < 2:
+            return None
+        intervals = sorted(b - a for a, b in zip(history, history[1:]))
+        median = intervals[len(intervals) // 2]
+        return history[-1] + median
+
+    def next_rotation(self, now):
+        predictions = [self.predict_rotation(key_name) for key_name in list(self.history)]
+        # rotations which should have happened more than one interval ago are not coming "soon" anymore
+        upcoming = [p for p in predictions if p is not None and p > now - self.interval]
+        return min(upcoming) if upcoming else None
+
+    def next_delay(self, now=None):
+        if self.failures:
+            return self.randomize(min(self.interval * 2 ** self.failures, self.max_backoff))
+        delay = self.interval
+        if self.fast_interval:
+            now = time.time() if now is None else now
+            rotation = self.next_rotation(now)
+            if rotation is not None and rotation - now < self.interval:
+                delay = max(self.fast_interval, min(self.interval, rotation - now))
+        return self.randomize(delay)
@@ -0,0 +1,188 @@
+'''
+Serves the current credentials from memory over a Unix domain socket or localhost HTTP.
+
+    GET /credentials/<application ID>/<user|client>  content of the user.json/client.json file
+    GET /credentials/<application ID>                 {"user": ..., "client": ...}
+
+Responses carry an ETag. With "If-None-Match: <ETag>" and "?wait=<seconds>" the request blocks until the credentials
+rotate (or the wait time is over, answered with 304), so consumers learn about a rotation without polling.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import stat
+import threading
+
+from berry.retry import now
+from berry.state import content_digest
+
+try:
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:  # Python 2
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+FILES = ('user', 'client')
+# upper limit for the wait time of a long-poll request in seconds
+MAX_WAIT = 300
+
+
+class CredentialStore(object):
+    '''
+    Current content and digest of the credentials files of all applications
+    '''
+
+    def __init__(self):
+        # (application ID, file) => (digest, content)
+        self.entries = {}
+        self.condition = threading.Condition()
+
+    def put(self, application_id, fn, data, digest):
+        with self.condition:
+            if self.entries.get((application_id, fn), (None, None))[0] != digest:
+                self.entries[(application_id, fn)] = (digest, data)
+                self.condition.notify_all()
+
+    def load(self, application_id, fn, path):
+        '''
+        Serve the local file as long as nothing was downloaded, e.g. after a restart when S3 answers 304
+        '''
+        if (application_id, fn) in self.entries:
+            return
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            digest = content_digest(json.loads(data.decode('utf-8')))
+        except (IOError, OSError, ValueError):
+            return
+        with self.condition:
+            if (application_id, fn) not in self.entries:
+                self.entries[(application_id, fn)] = (digest, data)
+                self.condition.notify_all()
+
+    def forget(self, application_id):
+        with self.condition:
+            for key in [key for key in self.entries if key[0] == application_id]:
+                del self.entries[key]
+
+    def etag(self, application_id, fns):
+        digests = [self.entries.get((application_id, fn), (None, None))[0] for fn in fns]
+        if None in digests:
+            return None
+        if len(digests) == 1:
+            return '"{}"'.format(digests[0])
+        return '"{}"'.format(hashlib.sha256(':'.join(digests).encode('utf-8')).hexdigest())
+
+    def get(self, application_id, fns, etag=None, wait=0):
+        '''
+        Return ETag and content of the given files, waiting up to "wait" seconds while the ETag equals
+        the given one or the files are not available yet
+        '''
+        deadline = now() + wait
+        with self.condition:
+            current = self.etag(application_id, fns)
+            while wait and (current is None or current == etag):
+                remaining = deadline - now()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+                current = self.etag(application_id, fns)
+            if current is None:
+                return None, None
+            return current, dict((fn, self.entries[(application_id, fn)][1]) for fn in fns)
+
+
+def is_loopback(host):
+    '''
+    Whether the host name or address only resolves to loopback addresses
+    '''
+    try:
+        addresses = set(info[4][0] for info in socket.getaddrinfo(host, None))
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(address.startswith(('127.', '::ffff:127.')) or address == '::1'
+                                   for address in addresses)
+
+
+def start_credentials_server(store, address):
+    '''
+    Serve the store on the given Unix domain socket path or (host, port) address
+    '''
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn, UnixStreamServer
+    except ImportError:  # Python 2
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn, UnixStreamServer
+
+    class CredentialsHandler(BaseHTTPRequestHandler):
+        def send(self, status, etag=None, body=b''):
+            self.send_response(status)
+            if etag:
+                self.send_header('ETag', etag)
+            if body:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [unquote(part) for part in url.path.strip('/').split('/')]
+            if parts[0] != 'credentials' or len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] not in FILES):
+                self.send_error(404)
+                return
+            try:
+                wait = min(float(parse_qs(url.query).get('wait', ['0'])[0]), MAX_WAIT)
+            except ValueError:
+                self.send_error(400)
+                return
+
+            fns = parts[2:] or FILES
+            etag = self.headers.get('If-None-Match')
+            current, files = store.get(parts[1], fns, etag, wait if etag else 0)
+            if current is None:
+                self.send_error(404)
+            elif current == etag:
+                self.send(304, current)
+            elif len(fns) == 1:
+                self.send(200, current, files[fns[0]])
+            else:
+                body = b'{' + b', '.join('"{}": '.format(fn).encode('utf-8') + files[fn] for fn in fns) + b'}'
+                self.send(200, current, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    if isinstance(address, tuple):
+        class CredentialsServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = CredentialsServer(address, CredentialsHandler)
+    else:
+        class CredentialsServer(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+
+            def server_close(self):
+                UnixStreamServer.server_close(self)
+                try:
+                    os.remove(address)
+                except OSError:
+                    pass
+
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            # left over by a previous berry process
+            os.remove(address)
+        server = CredentialsServer(address, CredentialsHandler)
+        # only the owner of the berry process may read the credentials
+        os.chmod(address, 0o600)
+
+    thread = threading.Thread(target=server.serve_forever, name='berry-credentials')
+    thread.daemon = True
+    thread.start()
+    logging.info('Serving credentials on {}'.format(address))
+    return server
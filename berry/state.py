@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    string_types = (basestring,)  # noqa: F821 (Python 2)
+except NameError:
+    string_types = (str,)
+
+STATE_FILE_NAME = '.berry-state.json'
+ENDPOINT_CACHE_FILE_NAME = '.berry-endpoints.json'
+
+
+def content_digest(data):
+    '''
+    Digest of the canonical JSON representation, equal for equal (parsed) data
+    '''
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
+
+def local_file_signature(path):
+    try:
+        return file_signature(path)
+    except OSError:
+        return None
+
+
+def load_json_file(path):
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_json_file(path, data):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as fd:
+        json.dump(data, fd, sort_keys=True)
+    os.rename(tmp_file, path)
+
+
+class FetchState(object):
+    '''
+    Last seen ETag/Last-Modified per S3 key, kept in memory and in a sidecar file
+    so that conditional GETs survive restarts
+    '''
+
+    def __init__(self, local_directory):
+        self.path = os.path.join(local_directory, STATE_FILE_NAME)
+        self.entries = load_json_file(self.path)
+        self.dirty = False
+        # local file path => (file signature, content digest)
+        self.local_digests = {}
+
+    def conditions(self, key_name, local_file):
+        '''
+        Return the extra get_object() arguments for a conditional download of the given key
+        '''
+        entry = self.entries.get(key_name)
+        # the local file is the only copy of the content, never skip the download if it is missing or was edited
+        if not entry or not entry.get('digest') or self.local_digest(local_file) != entry['digest']:
+            return {}
+        conditions = {}
+        if entry.get('etag'):
+            conditions['IfNoneMatch'] = entry['etag']
+        if entry.get('last_modified'):
+            conditions['IfModifiedSince'] = entry['last_modified']
+        return conditions
+
+    def unchanged(self, key_name, local_file, etag):
+        '''
+        True if the given ETag (e.g. from a bucket listing) is the one of the local file's content
+        '''
+        return bool(etag) and self.conditions(key_name, local_file).get('IfNoneMatch') == etag
+
+    def update(self, key_name, response, digest=None):
+        '''
+        Remember ETag and Last-Modified of the response together with the content digest of the local file
+        '''
+        etag = response.get('ETag')
+        last_modified = response.get('LastModified')
+        if hasattr(last_modified, 'isoformat'):
+            last_modified = last_modified.isoformat()
+        entry = {}
+        if isinstance(etag, string_types):
+            entry['etag'] = etag
+        if isinstance(last_modified, string_types):
+            entry['last_modified'] = last_modified
+        if entry and digest:
+            entry['digest'] = digest
+        if self.entries.get(key_name, {}) != entry:
+            if entry:
+                self.entries[key_name] = entry
+            else:
+                self.entries.pop(key_name, None)
+            self.dirty = True
+
+    def local_digest(self, local_file):
+        '''
+        Digest of the local file's content, the file is only read again if its stat changed
+        '''
+        signature = local_file_signature(local_file)
+        cached = self.local_digests.get(local_file)
+        if cached and cached[0] == signature:
+            return cached[1]
+        try:
+            with open(local_file) as fd:
+                digest = content_digest(json.load(fd))
+        except (IOError, OSError, ValueError):
+            digest = None
+        self.local_digests[local_file] = (signature, digest)
+        return digest
+
+    def written(self, local_file, digest):
+        self.local_digests[local_file] = (local_file_signature(local_file), digest)
+
+    def forget(self, key_name):
+        if self.entries.pop(key_name, None) is not None:
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            # a copy, downloads which missed their deadline may still update the entries
+            write_json_file(self.path, dict(self.entries))
+            self.dirty = False
+        except (IOError, OSError) as e:
+            logging.warning('Could not write berry state file {}: {}'.format(self.path, e))
+
+
+class EndpointCache(object):
+    '''
+    Region and signature version negotiated per bucket, persisted with a TTL
+    so that later cycles and restarts go straight to the right endpoint
+    '''
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.entries = load_json_file(path) if path else {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def get(self, bucket):
+        entry = self.entries.get(bucket)
+        if entry and entry.get('expires', 0) > time.time():
+            return {'region': entry.get('region'), 'signature_version': entry.get('signature_version')}
+        return None
+
+    def set(self, bucket, region, signature_version):
+        with self.lock:
+            if region or signature_version:
+                self.entries[bucket] = {'region': region, 'signature_version': signature_version,
+                                        'expires': time.time() + self.ttl}
+            else:
+                self.entries.pop(bucket, None)
+            self.dirty = True
+
+    def invalidate(self, bucket):
+        with self.lock:
+            if self.entries.pop(bucket, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty or not self.path:
+            return
+        with self.lock:
+            try:
+                write_json_file(self.path, self.entries)
+                self.dirty = False
+            except (IOError, OSError) as e:
+                logging.warning('Could not write endpoint cache file {}: {}'.format(self.path, e))
@@ -0,0 +1,167 @@
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from berry.retry import now
+
+# seconds between two stack samples of the profiler
+SAMPLE_INTERVAL = 0.005
+# number of hottest stacks dumped when the profiler is stopped
+TOP_STACKS = 20
+
+
+class Span(object):
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start, now() - self.start, self.attributes,
+                           exc_type.__name__ if exc_type else None)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    '''
+    Collects the spans (timed steps) of a polling cycle and writes them as one JSON line per cycle,
+    to the log or appended to a file
+    '''
+
+    def __init__(self, path=None, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.cycle = 0
+        self.cycle_start = None
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def record(self, name, start, duration, attributes, error=None):
+        span = dict(attributes, name=name, start=round(start - (self.cycle_start or start), 6),
+                    duration=round(duration, 6))
+        if error:
+            span['error'] = error
+        with self.lock:
+            self.spans.append(span)
+
+    def start_cycle(self):
+        with self.lock:
+            self.cycle += 1
+            self.cycle_start = now()
+            self.spans = []
+
+    def end_cycle(self, **attributes):
+        if not self.enabled or self.cycle_start is None:
+            return
+        with self.lock:
+            spans, self.spans = self.spans, []
+            record = dict(attributes, cycle=self.cycle, time=time.time(),
+                          duration=round(now() - self.cycle_start, 6), spans=spans)
+        line = json.dumps(record, sort_keys=True)
+        if self.path:
+            try:
+                with open(self.path, 'a') as fd:
+                    fd.write(line + '\n')
+            except (IOError, OSError) as e:
+                logging.warning('Could not write trace to {}: {}'.format(self.path, e))
+        else:
+            logging.info('TRACE {}'.format(line))
+
+
+def format_stack(frame):
+    '''
+    Collapsed stack ("file:function;file:function", outermost first) as used by flame graph tools
+    '''
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    '''
+    Sampling profiler toggled by a signal: while running, the stacks of all other threads are sampled periodically,
+    when stopped the hottest stacks are written to the log or a file
+    '''
+
+    def __init__(self, path=None, interval=SAMPLE_INTERVAL, top=TOP_STACKS):
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def toggle(self, signum=None, frame=None):
+        if self.thread is None:
+            self.start()
+        else:
+            self.stop()
+
+    def start(self):
+        self.counts = collections.Counter()
+        self.samples = 0
+        # a new event per run, a sampling thread still finishing its last sample must not continue
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stopped,), name='berry-profiler')
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info('Profiler started')
+
+    def sample(self):
+        current = threading.current_thread().ident
+        with self.lock:
+            for ident, frame in sys._current_frames().items():
+                if ident != current:
+                    self.counts[format_stack(frame)] += 1
+            self.samples += 1
+
+    def run(self, stopped):
+        while not stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        # called from a signal handler: do not wait for the sampling thread
+        self.stopped.set()
+        self.thread = None
+        self.dump()
+
+    def dump(self):
+        with self.lock:
+            lines = ['{} {}'.format(stack, count) for stack, count in self.counts.most_common(self.top)]
+        if self.path:
+            try:
+                with open(self.path, 'w') as fd:
+                    fd.write(''.join(line + '\n' for line in lines))
+            except (IOError, OSError) as e:
+                logging.warning('Could not write profile to {}: {}'.format(self.path, e))
+        else:
+            logging.info('Profiler stopped after {} samples, hottest stacks:\n{}'.format(
+                         self.samples, '\n'.join(lines)))
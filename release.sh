@@ -19,6 +19,7 @@ if [ -z "$GO_PIPELINE_LABEL" ]; then
     python3 setup.py clean
     python3 setup.py test
     python3 setup.py flake8
+    python3 benchmarks/bench_fetch.py --rotate-every 5 --baseline benchmarks/results/baseline.json
 
     git add */__init__.py
 
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from berry.aio import AsyncFetchEngine
+from berry.cli import Application, FetchContext
+from mock import MagicMock
+
+
+def test_bucket_concurrency(tmpdir):
+    running = {}
+    peak = {}
+    lock = threading.Lock()
+
+    def fetch(app, fn, clients, context):
+        with lock:
+            running[app.mint_bucket] = running.get(app.mint_bucket, 0) + 1
+            peak[app.mint_bucket] = max(peak.get(app.mint_bucket, 0), running[app.mint_bucket])
+        time.sleep(0.02)
+        with lock:
+            running[app.mint_bucket] -= 1
+        return 1 if fn == 'client' else 0
+
+    apps = [Application('app{}'.format(i), 'bucket{}'.format(i % 2), str(tmpdir)) for i in range(6)]
+    jobs = [(app, fn, None) for app in apps for fn in ('user', 'client')]
+    engine = AsyncFetchEngine(fetch, FetchContext(), workers=8, bucket_concurrency=2)
+    try:
+        assert engine.fetch_all(jobs) == [0, 1] * 6
+    finally:
+        engine.close()
+    assert peak == {'bucket0': 2, 'bucket1': 2}
+
+
+def test_deadline(monkeypatch, tmpdir):
+    monkeypatch.setattr('berry.aio.logging', MagicMock())
+    release = threading.Event()
+    calls = []
+
+    def fetch(app, fn, clients, context):
+        calls.append(fn)
+        if fn == 'user':
+            release.wait(5)
+        return 0
+
+    context = FetchContext()
+    context.metrics = MagicMock()
+    app = Application('myapp', 'my-mint-bucket', str(tmpdir))
+    jobs = [(app, 'user', None), (app, 'client', None)]
+    engine = AsyncFetchEngine(fetch, context, workers=2, deadline=0.05)
+    try:
+        assert engine.fetch_all(jobs) == [1, 0]
+        context.metrics.errors.inc.assert_called_with('timeout')
+
+        # the hanging download is not started a second time
+        assert engine.fetch_all(jobs) == [1, 0]
+        assert sorted(calls) == ['client', 'client', 'user']
+
+        release.set()
+        time.sleep(0.05)
+        assert engine.fetch_all(jobs) == [0, 0]
+        assert calls.count('user') == 2
+    finally:
+        release.set()
+        engine.close()
+
+
+def test_late_rotation(monkeypatch, tmpdir):
+    monkeypatch.setattr('berry.aio.logging', MagicMock())
+    release = threading.Event()
+
+    def fetch(app, fn, clients, context):
+        if not release.is_set():
+            release.wait(5)
+            app.rotated.append(fn)
+        return 0
+
+    app = Application('myapp', 'my-mint-bucket', str(tmpdir))
+    jobs = [(app, 'user', None)]
+    context = FetchContext()
+    context.metrics = MagicMock()
+    engine = AsyncFetchEngine(fetch, context, workers=2, deadline=0.05)
+    try:
+        app.rotated = []
+        assert engine.fetch_all(jobs) == [1]
+        # the download finishes after the cycle, possibly after the rotation hook was notified
+        release.set()
+        time.sleep(0.05)
+        assert app.rotated == []
+
+        # the rotation is reported in the next cycle
+        app.rotated = []
+        assert engine.fetch_all(jobs) == [0]
+        assert app.rotated == ['user']
+
+        app.rotated = []
+        assert engine.fetch_all(jobs) == [0]
+        assert app.rotated == []
+    finally:
+        release.set()
+        engine.close()
@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+from berry.cache import LEASE_FILE_NAME, SharedCache, fan_out
+from berry.cli import Application, FetchContext
+from berry.server import CredentialStore
+from mock import MagicMock
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    # logging would configure the root logger on its own, see test_cli.test_rotate_credentials
+    monkeypatch.setattr('berry.cache.logging', MagicMock())
+
+
+def test_lease(tmpdir):
+    first = SharedCache(str(tmpdir), 60, Application)
+    second = SharedCache(str(tmpdir), 60, Application)
+    entry = first.entry('my-mint-bucket', 'myapp')
+    other_entry = second.entry('my-mint-bucket', 'myapp')
+    assert entry.local_directory == str(tmpdir.join('my-mint-bucket', 'myapp'))
+
+    assert first.acquire(entry)
+    # renewed by the holder
+    assert first.acquire(entry)
+    assert not second.acquire(other_entry)
+
+    first.release()
+    assert not tmpdir.join('my-mint-bucket', 'myapp', LEASE_FILE_NAME).exists()
+    assert second.acquire(other_entry)
+    assert not first.acquire(entry)
+
+    # the lease of a process which stopped renewing it expires
+    lease = tmpdir.join('my-mint-bucket', 'myapp', LEASE_FILE_NAME)
+    lease.write(json.dumps({'owner': second.owner, 'expires': time.time() - 1}))
+    assert first.acquire(entry)
+
+
+def test_sources(tmpdir):
+    cache = SharedCache(str(tmpdir.join('cache')), 60, Application)
+    apps = [Application('app1', 'bucket', str(tmpdir.join('a'))),
+            Application('app2', 'bucket', str(tmpdir.join('b'))),
+            Application('app1', 'bucket', str(tmpdir.join('c'))),
+            Application('app1', 'other-bucket', str(tmpdir.join('d')))]
+    sources = cache.sources(apps)
+    assert [(entry.application_id, entry.mint_bucket, targets) for entry, targets in sources] == [
+        ('app1', 'bucket', [apps[0], apps[2]]), ('app2', 'bucket', [apps[1]]), ('app1', 'other-bucket', [apps[3]])]
+    assert cache.sources(apps)[0][0] is sources[0][0]
+
+
+def test_fan_out(tmpdir):
+    cache = SharedCache(str(tmpdir.join('cache')), 60, Application)
+    entry = cache.entry('bucket', 'myapp')
+    tmpdir.join('cache', 'bucket', 'myapp', 'user.json').write('{"application_password": "secret"}')
+    tmpdir.mkdir('app')
+    app = Application('myapp', 'bucket', str(tmpdir.join('app')))
+    context = FetchContext(store=CredentialStore())
+
+    # client.json is missing
+    assert fan_out(entry, app, context) == 1
+    assert app.rotated == ['user']
+    assert tmpdir.join('app', 'user.json').read() == '{"application_password": "secret"}'
+    assert context.store.get('myapp', ('user',))[1] == {'user': b'{"application_password": "secret"}'}
+    assert ('myapp', 'user') in context.metrics.last_success
+
+    tmpdir.join('cache', 'bucket', 'myapp', 'client.json').write('{}')
+    app.rotated = []
+    assert fan_out(entry, app, context) == 0
+    assert app.rotated == ['client']
+
+    app.rotated = []
+    assert fan_out(entry, app, context) == 0
+    assert app.rotated == []
+
+    # unreadable cache file and unwritable local directory: counted as errors, the other files are copied
+    tmpdir.join('cache', 'bucket', 'myapp', 'user.json').write('{"application_password": "new"}')
+    tmpdir.join('cache', 'bucket', 'myapp', 'client.json').write('{"client_id": "new"}')
+    write = context.output.write
+
+    def fail_user(app, fn, *args):
+        if fn == 'user':
+            raise IOError('Disk full')
+        write(app, fn, *args)
+
+    context.output.write = fail_user
+    assert fan_out(entry, app, context) == 1
+    assert app.rotated == ['client']
+    assert context.metrics.file_status('myapp', 'user')['error'] == 'Disk full'
+
+    del context.output.write
+    tmpdir.join('cache', 'bucket', 'myapp', 'user.json').write('not JSON')
+    app.rotated = []
+    assert fan_out(entry, app, context) == 1
+    assert app.rotated == []
+    assert context.metrics.file_status('myapp', 'user')['error_class'] == 'other'
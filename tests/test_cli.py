@@ -1,13 +1,21 @@
 
 import botocore.exceptions
+import json
 import logging
 import os
 import pytest
+import signal
+import subprocess
+import sys
+import threading
+import time
 import yaml
 import dns
 
-from berry.cli import use_aws_credentials, run_berry, main, UsageError
+from berry.cli import get_bucket_region, lookup_aws_credentials, use_aws_credentials, run_berry, main, UsageError
 import berry.cli
+from berry.metrics import Metrics
+from berry.server import CredentialStore
 from mock import MagicMock
 
 
@@ -19,6 +27,10 @@ def test_use_aws_credentials(tmpdir):
     assert creds == {'aws_access_key_id': 'abc123', 'aws_secret_access_key': '456789'}
 
 
+def default_args():
+    return berry.cli.get_parser().parse_args(['.'])
+
+
 def mock_session(client):
     session = MagicMock()
     session.client.return_value = client
@@ -34,8 +46,9 @@ def test_rotate_credentials(monkeypatch, tmpdir, capsys):
     monkeypatch.setattr('boto3.session.Session', mock_session(s3))
     monkeypatch.setattr('time.sleep', lambda x: 0)
 
-    args = MagicMock()
+    args = default_args()
     args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
     args.config_file = str(tmpdir.join('taupage.yaml'))
     args.once = True
     args.aws_credentials_file = None
@@ -77,8 +90,9 @@ def test_rotate_credentials_with_file_config(monkeypatch, tmpdir):
     with open(credentials_path, 'w') as fd:
         fd.write('someapp:foo:bar')
 
-    args = MagicMock()
+    args = default_args()
     args.application_id = None
+    args.mint_bucket = 'my-mint-bucket'
     args.config_file = config_path
     args.once = True
     args.aws_credentials_file = credentials_path
@@ -87,7 +101,7 @@ def test_rotate_credentials_with_file_config(monkeypatch, tmpdir):
     os.makedirs(args.local_directory)
 
     assert run_berry(args) is True
-    log_info.assert_called_with('Rotated client credentials for someapp')
+    log_info.assert_any_call('Rotated client credentials for someapp')
 
     args.application_id = 'wrongapp'
     with pytest.raises(UsageError) as excinfo:
@@ -95,6 +109,732 @@ def test_rotate_credentials_with_file_config(monkeypatch, tmpdir):
     assert 'No AWS credentials found for application "wrongapp" in' in excinfo.value.msg
 
 
+def test_not_modified(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_username": "myteam_myapp", "application_password": "secret"}'
+    response.get.side_effect = {'ETag': '"abc"'}.get
+
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = str(tmpdir.join('taupage.yaml'))
+    args.once = True
+    args.aws_credentials_file = None
+    args.local_directory = str(tmpdir.join('credentials'))
+
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/client.json')
+
+    s3.get_object.side_effect = botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 304},
+         'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'get_object')
+    log_info = MagicMock()
+    monkeypatch.setattr('logging.info', log_info)
+    assert run_berry(args) is True
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/client.json', IfNoneMatch='"abc"')
+    assert not log_info.called
+
+
+def test_fetch_files_concurrently(monkeypatch, tmpdir):
+    started = []
+    both_started = threading.Event()
+
+    def get_object(Bucket, Key, **kwargs):
+        started.append(Key)
+        if len(started) == 2:
+            both_started.set()
+        # the first fetch only finishes once the second one is in flight as well
+        assert both_started.wait(5)
+        response = MagicMock()
+        response['Body'].read.return_value = b'{}'
+        return response
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+
+    assert run_berry(args) is True
+    assert sorted(started) == ['myapp/client.json', 'myapp/user.json']
+
+    del started[:]
+    both_started.clear()
+    args.engine = 'asyncio'
+    args.fetch_deadline = 10
+    assert run_berry(args) is True
+    assert sorted(started) == ['myapp/client.json', 'myapp/user.json']
+
+
+def test_fetch_metrics(monkeypatch, tmpdir):
+    s3 = MagicMock()
+    s3.get_object.side_effect = botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 404}, 'Error': {}}, 'get_object')
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    metrics = Metrics()
+    monkeypatch.setattr('berry.cli.Metrics', lambda: metrics)
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+
+    assert run_berry(args) is False
+    assert metrics.errors.values['404'] == 2
+    assert sum(metrics.get_object_seconds.counts) == 2
+    assert metrics.last_success == {}
+
+
+def test_retry_transient_errors(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{}'
+    slow_down = botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 503},
+         'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}}, 'get_object')
+    results = {'myapp/user.json': [botocore.exceptions.ReadTimeoutError(endpoint_url='https://s3.amazonaws.com'),
+                                   slow_down, response],
+               'myapp/client.json': [slow_down] * 3}
+
+    def get_object(Bucket, Key, **kwargs):
+        result = results[Key].pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    sleep = MagicMock()
+    monkeypatch.setattr('berry.retry.time.sleep', sleep)
+    metrics = Metrics()
+    monkeypatch.setattr('berry.cli.Metrics', lambda: metrics)
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+
+    # user.json succeeds with the third attempt, client.json gives up after the third
+    assert run_berry(args) is False
+    assert results == {'myapp/user.json': [], 'myapp/client.json': []}
+    assert sleep.call_count == 4
+    assert metrics.errors.values['timeout'] == 1
+    assert metrics.errors.values['other'] == 4
+    assert metrics.errors.values['403'] == 0
+    assert os.path.exists(str(tmpdir.join('user.json')))
+
+
+def test_cycle_deadline(monkeypatch, tmpdir):
+    s3 = MagicMock()
+    s3.get_object.side_effect = botocore.exceptions.ConnectTimeoutError(endpoint_url='https://s3.amazonaws.com')
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    sleep = MagicMock()
+    monkeypatch.setattr('berry.retry.time.sleep', sleep)
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+    args.cycle_deadline = 5
+    monkeypatch.setattr('berry.retry.RetryPolicy.delay', lambda self, attempt: 10.0)
+
+    # the backoff delay does not fit into the deadline, no retries
+    assert run_berry(args) is False
+    assert s3.get_object.call_count == 2
+    assert not sleep.called
+
+
+def test_retry_settings(tmpdir):
+    args = default_args()
+    policy = berry.cli.get_retry_policy(args, {'berry_retry': {'attempts': 5, 'read_timeout': '3.5'}})
+    assert (policy.attempts, policy.read_timeout, policy.connect_timeout) == (5, 3.5, 5.0)
+    assert policy.cycle_deadline == args.interval
+
+    args.retry_attempts = 2
+    args.cycle_deadline = 30
+    policy = berry.cli.get_retry_policy(args, {'berry_retry': {'attempts': 5}})
+    assert (policy.attempts, policy.cycle_deadline) == (2, 30)
+
+    with pytest.raises(UsageError):
+        berry.cli.get_retry_policy(args, {'berry_retry': {'atempts': 5}})
+    with pytest.raises(UsageError):
+        berry.cli.get_retry_policy(args, {'berry_retry': {'read_timeout': 'soon'}})
+    args.connect_timeout = 0
+    with pytest.raises(UsageError):
+        berry.cli.get_retry_policy(args, {})
+
+
+def test_credentials_store(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    stores = []
+    monkeypatch.setattr('berry.cli.CredentialStore', lambda: stores.append(CredentialStore()) or stores[-1])
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+    args.credentials_socket = str(tmpdir.join('berry.sock'))
+
+    assert run_berry(args) is True
+    etag, files = stores[0].get('myapp', ('user', 'client'))
+    assert files == {'user': b'{"application_password": "secret"}', 'client': b'{"application_password": "secret"}'}
+    # the server is stopped with berry
+    assert not tmpdir.join('berry.sock').exists()
+
+    # S3 answers 304 after a restart, the local files are served
+    s3.get_object.side_effect = botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 304}, 'Error': {}}, 'get_object')
+    assert run_berry(args) is True
+    assert stores[1].get('myapp', ('user', 'client')) == (etag, files)
+
+    # the unauthenticated HTTP endpoint only listens on loopback addresses unless allowed explicitly
+    args.credentials_port = 0
+    args.credentials_address = '0.0.0.0'
+    with pytest.raises(UsageError):
+        run_berry(args)
+    args.credentials_allow_remote = True
+    assert run_berry(args) is True
+
+
+def test_multiple_applications(monkeypatch, tmpdir):
+    def get_object(Bucket, Key, **kwargs):
+        if Key.startswith('denied/'):
+            raise botocore.exceptions.ClientError(
+                {'ResponseMetadata': {'HTTPStatusCode': 403}, 'Error': {'Message': 'Access Denied'}}, 'get_object')
+        response = MagicMock()
+        response['Body'].read.return_value = '{{"bucket": "{}", "key": "{}"}}'.format(Bucket, Key).encode('utf-8')
+        return response
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    log_error = MagicMock()
+    monkeypatch.setattr('logging.error', log_error)
+
+    config_path = str(tmpdir.join('taupage.yaml'))
+    with open(config_path, 'w') as fd:
+        yaml.safe_dump({'mint_bucket': 'my-mint-bucket',
+                        'berry_applications': [{'application_id': 'app1'},
+                                               {'application_id': 'app2', 'mint_bucket': 'other-bucket',
+                                                'local_directory': str(tmpdir.join('app2-credentials'))}]}, fd)
+
+    args = default_args()
+    args.config_file = config_path
+    args.once = True
+    args.local_directory = str(tmpdir)
+
+    assert run_berry(args) is True
+    assert tmpdir.join('app1', 'user.json').read() == '{"bucket": "my-mint-bucket", "key": "app1/user.json"}'
+    assert tmpdir.join('app2-credentials', 'client.json').read() == \
+        '{"bucket": "other-bucket", "key": "app2/client.json"}'
+
+    # command line entries take precedence over the YAML configuration
+    args.applications = ['app3', 'denied:my-mint-bucket']
+    assert run_berry(args) is False
+    assert tmpdir.join('app3', 'user.json').check()
+    log_error.assert_called_with('Failed to refresh credentials for application "denied" (2 errors)')
+
+    args.applications = ['app3', 'app3']
+    with pytest.raises(UsageError) as excinfo:
+        run_berry(args)
+    assert 'is used by more than one application' in excinfo.value.msg
+
+    args.applications = None
+    args.workers = 0
+    with pytest.raises(UsageError):
+        run_berry(args)
+
+
+def test_rotation_hook(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    notify = MagicMock()
+    monkeypatch.setattr('berry.hooks.HookRunner.notify', notify)
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir)
+    args.on_rotate_touch = str(tmpdir.join('trigger'))
+
+    assert run_berry(args) is True
+    # both files rotated, one notification
+    assert notify.call_count == 1
+    app, files = notify.call_args[0]
+    assert app.hook.touch == args.on_rotate_touch
+    assert sorted(files) == ['client', 'user']
+
+    assert run_berry(args) is True
+    assert notify.call_count == 1
+
+
+def test_get_rotation_hook():
+    assert berry.cli.get_rotation_hook({}) is None
+    hook = berry.cli.get_rotation_hook({'pidfile': '/run/app.pid'})
+    assert (hook.signum, hook.pidfile, hook.timeout) == (signal.SIGHUP, '/run/app.pid', 30)
+    hook = berry.cli.get_rotation_hook({'signal': 'usr1', 'pid': '123', 'timeout': 5})
+    assert (hook.signum, hook.pid, hook.timeout) == (signal.SIGUSR1, 123, 5)
+
+    for settings in ({'signal': 'HUP'}, {'signal': 'FOO', 'pid': 1}, {'command': 'true', 'timeout': 0},
+                     {'comand': 'true'}, 'true'):
+        with pytest.raises(UsageError):
+            berry.cli.get_rotation_hook(settings)
+
+
+def test_rotation_hook_config(tmpdir):
+    args = default_args()
+    args.local_directory = str(tmpdir)
+    args.on_rotate_command = 'systemctl reload myapp'
+    config = {'mint_bucket': 'my-mint-bucket',
+              'berry_on_rotate': {'touch': '/tmp/trigger', 'command': 'true'},
+              'berry_applications': [{'application_id': 'app1'},
+                                     {'application_id': 'app2', 'on_rotate': {'pidfile': '/run/app2.pid'}},
+                                     {'application_id': 'app3', 'on_rotate': None}]}
+    app1, app2, app3 = berry.cli.get_applications(args, config)
+    assert (app1.hook.touch, app1.hook.command) == ('/tmp/trigger', 'systemctl reload myapp')
+    assert (app2.hook.pidfile, app2.hook.command) == ('/run/app2.pid', None)
+    assert app3.hook is None
+
+
+def test_shared_cache(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir.join('credentials'))
+    args.shared_cache = str(tmpdir.join('cache'))
+    args.applications = ['myapp::{}'.format(tmpdir.join('pod1')), 'myapp::{}'.format(tmpdir.join('pod2'))]
+
+    # one download per file for both local directories
+    assert run_berry(args) is True
+    assert s3.get_object.call_count == 2
+    for directory in ('cache/my-mint-bucket/myapp', 'pod1', 'pod2'):
+        assert tmpdir.join(directory, 'user.json').read() == '{"application_password": "secret"}'
+        assert tmpdir.join(directory, 'client.json').read() == '{"application_password": "secret"}'
+    # the lease is released on exit
+    assert not tmpdir.join('cache/my-mint-bucket/myapp/.berry-lease.json').exists()
+
+    # another process holds the lease, a later container gets the cached files without asking S3
+    tmpdir.join('cache/my-mint-bucket/myapp/.berry-lease.json').write(
+        json.dumps({'owner': 'other', 'expires': time.time() + 60}))
+    s3.get_object.reset_mock()
+    args.applications = ['myapp::{}'.format(tmpdir.join('pod3'))]
+    assert run_berry(args) is True
+    assert not s3.get_object.called
+    assert tmpdir.join('pod3', 'user.json').read() == '{"application_password": "secret"}'
+
+
+def test_list_objects(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    response.get.side_effect = {'ETag': '"abc"'}.get
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    s3.list_objects_v2.return_value = {'Contents': [{'Key': 'myapp/user.json', 'ETag': '"abc"'},
+                                                    {'Key': 'myapp/client.json', 'ETag': '"new"'}]}
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.list_objects = True
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    assert s3.get_object.call_count == 2
+
+    # only the changed file is downloaded
+    s3.get_object.reset_mock()
+    assert run_berry(args) is True
+    s3.get_object.assert_called_once_with(Bucket='my-mint-bucket', Key='myapp/client.json', IfNoneMatch='"abc"')
+
+
+def test_replica_buckets(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    buckets = []
+
+    def get_object(Bucket, Key):
+        buckets.append(Bucket)
+        if Bucket == 'my-mint-bucket':
+            raise botocore.exceptions.ClientError({'ResponseMetadata': {'HTTPStatusCode': 500},
+                                                   'Error': {'Code': 'InternalError'}}, 'get_object')
+        return response
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket, my-mint-replica'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    assert sorted(buckets) == ['my-mint-bucket', 'my-mint-bucket', 'my-mint-replica', 'my-mint-replica']
+    assert tmpdir.join('credentials', 'user.json').read() == '{"application_password": "secret"}'
+
+    config = {'mint_bucket': ['bucket', 'replica'],
+              'berry_applications': [{'application_id': 'app1'},
+                                     {'application_id': 'app2', 'mint_bucket': 'other,other-replica'}]}
+    args.mint_bucket = None
+    applications = berry.cli.get_applications(args, config)
+    assert [app.buckets for app in applications] == [['bucket', 'replica'], ['other', 'other-replica']]
+
+
+def test_generations(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.generations = 2
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    assert os.readlink(str(tmpdir.join('credentials', 'current'))) == os.path.join('generations', '1')
+    assert tmpdir.join('credentials', 'current', 'user.json').read() == '{"application_password": "secret"}'
+    assert tmpdir.join('credentials', 'client.json').read() == '{"application_password": "secret"}'
+
+    # unchanged
+    assert run_berry(args) is True
+    assert os.listdir(str(tmpdir.join('credentials', 'generations'))) == ['1']
+
+    args.generations = 1
+    with pytest.raises(UsageError):
+        run_berry(args)
+
+
+def test_render(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    response.get.side_effect = {'ETag': '"abc"'}.get
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+    assert run_berry(args) is True
+
+    # enabled later, rendered without a rotation
+    args.render = ['env', 'properties']
+    s3.get_object.reset_mock()
+    assert run_berry(args) is True
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/user.json')
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/client.json')
+    assert tmpdir.join('credentials', 'user.env').read() == "APPLICATION_PASSWORD='secret'\n"
+    assert tmpdir.join('credentials', 'client.properties').read() == 'application_password=secret\n'
+
+    s3.get_object.reset_mock()
+    assert run_berry(args) is True
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/user.json', IfNoneMatch='"abc"')
+    s3.get_object.assert_any_call(Bucket='my-mint-bucket', Key='myapp/client.json', IfNoneMatch='"abc"')
+
+
+def test_wait_ready(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    not_found = botocore.exceptions.ClientError({'ResponseMetadata': {'HTTPStatusCode': 404},
+                                                 'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}},
+                                                'get_object')
+    results = {'myapp/user.json': [not_found, not_found, response], 'myapp/client.json': [response]}
+
+    def get_object(Bucket, Key, **kwargs):
+        result = results[Key].pop(0) if len(results[Key]) > 1 else results[Key][0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.wait_ready = 60
+    args.status_file = str(tmpdir.join('status.json'))
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    # short growing delays
+    assert [call[0][0] for call in sleep.call_args_list] == [0.1, 0.2]
+    status = json.loads(tmpdir.join('status.json').read())
+    assert status['ready'] is True
+    assert status['applications']['myapp']['user']['last_success'] > 0
+    assert status['applications']['myapp']['user']['error'] is None
+
+    results['myapp/user.json'] = [botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 403}, 'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}},
+        'get_object')]
+    current_time = [1000.0]
+
+    def fake_now():
+        current_time[0] += 0.1
+        return current_time[0]
+
+    monkeypatch.setattr('berry.cli.now', fake_now)
+    args.wait_ready = 1
+    with pytest.raises(berry.cli.NotReadyError) as excinfo:
+        run_berry(args)
+    assert excinfo.value.exit_code == berry.cli.EXIT_ACCESS_DENIED
+    status = json.loads(tmpdir.join('status.json').read())
+    assert status['ready'] is False
+    assert status['applications']['myapp']['user']['error_class'] == '403'
+    assert status['applications']['myapp']['user']['error'] == 'Denied'
+
+    results['myapp/user.json'] = [not_found]
+    with pytest.raises(berry.cli.NotReadyError) as excinfo:
+        run_berry(args)
+    assert excinfo.value.exit_code == berry.cli.EXIT_NOT_FOUND
+
+    monkeypatch.setattr('berry.cli.configure', lambda: args)
+    results['myapp/user.json'] = [botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 503}, 'Error': {'Code': 'SlowDown', 'Message': 'Slow down'}},
+        'get_object')]
+    assert main() == berry.cli.EXIT_TIMEOUT
+
+
+def test_transient_failure():
+    metrics = Metrics()
+    denied = berry.cli.Application('denied', 'bucket', '/tmp/denied')
+    healthy = berry.cli.Application('healthy', 'bucket', '/tmp/healthy')
+    metrics.failed('denied', 'user', '403', 'Access Denied')
+    metrics.failed('denied', 'client', '404', 'Not found')
+    denied.err_count = 2
+    # one application's missing or denied keys must not back off polling for all
+    assert not berry.cli.transient_failure([denied, healthy], metrics)
+
+    metrics.failed('healthy', 'user', 'timeout', 'Read timeout')
+    healthy.err_count = 1
+    assert berry.cli.transient_failure([denied, healthy], metrics)
+
+    # errors without a recorded class count as transient
+    metrics.refreshed('healthy', 'user')
+    assert berry.cli.transient_failure([denied, healthy], metrics)
+    healthy.err_count = 0
+    assert not berry.cli.transient_failure([denied, healthy], metrics)
+
+
+def test_trace(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{"application_password": "secret"}'
+    redirect = botocore.exceptions.ClientError({'ResponseMetadata': {'HTTPStatusCode': 301},
+                                                'Error': {'Code': 'PermanentRedirect', 'Message': 'Redirect',
+                                                          'Endpoint': 'my-mint-bucket.s3-eu-west-1.amazonaws.com'}},
+                                               'get_object')
+    results = {'myapp/user.json': [redirect, response], 'myapp/client.json': [response]}
+
+    def get_object(Bucket, Key, **kwargs):
+        result = results[Key].pop(0) if len(results[Key]) > 1 else results[Key][0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    s3 = MagicMock()
+    s3.get_object.side_effect = get_object
+    monkeypatch.setattr('boto3.session.Session', mock_session(s3))
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.once = True
+    args.region_lookup_order = 'endpoint'
+    args.trace = str(tmpdir.join('trace.json'))
+    args.local_directory = str(tmpdir.join('credentials'))
+    os.makedirs(args.local_directory)
+
+    assert run_berry(args) is True
+    record = json.loads(tmpdir.join('trace.json').read())
+    assert record['success'] is True
+    names = [span['name'] for span in record['spans']]
+    for name in ('session_refresh', 'refresh_applications', 'client_setup', 'get_object', 'get_bucket_region',
+                 'read_body', 'json_decode', 'local_update'):
+        assert name in names
+    region_span = [span for span in record['spans'] if span['name'] == 'get_bucket_region'][0]
+    assert region_span['application_id'] == 'myapp'
+    assert region_span['file'] == 'user'
+    assert [span.get('error') for span in record['spans'] if span['name'] == 'get_object'].count('ClientError') == 1
+
+    previous_handler = signal.getsignal(signal.SIGUSR2)
+    toggle = MagicMock()
+    monkeypatch.setattr('berry.cli.StackSampler', MagicMock(return_value=MagicMock(toggle=toggle)))
+    handlers = []
+    original_signal = signal.signal
+    monkeypatch.setattr('signal.signal', lambda signum, handler: handlers.append((signum, handler)) or
+                        original_signal(signum, handler))
+    args.profile_signal = 'usr2'
+    assert run_berry(args) is True
+    assert (signal.SIGUSR2, toggle) in handlers
+    assert signal.getsignal(signal.SIGUSR2) == previous_handler
+
+    args.profile_signal = 'NOSUCHSIGNAL'
+    with pytest.raises(UsageError):
+        run_berry(args)
+
+
+class StopBerry(Exception):
+    pass
+
+
+def test_reload_config(monkeypatch, tmpdir):
+    response = MagicMock()
+    response['Body'].read.return_value = b'{}'
+    s3 = MagicMock()
+    s3.get_object.return_value = response
+    session = MagicMock(return_value=mock_session(s3)())
+    monkeypatch.setattr('boto3.session.Session', session)
+
+    config = tmpdir.join('taupage.yaml')
+    config.write(yaml.dump({'mint_bucket': 'my-mint-bucket', 'berry_applications': [{'application_id': 'app1'}]}))
+    configs = [
+        {'mint_bucket': 'my-mint-bucket',
+         'berry_applications': [{'application_id': 'app1'}, {'application_id': 'app2'}],
+         'berry_retry': {'attempts': 5}},
+        'invalid: [yaml',
+        # the local directory cannot be created below a file
+        {'mint_bucket': 'my-mint-bucket',
+         'berry_applications': [{'application_id': 'app3', 'local_directory': str(config.join('app3'))}]},
+        {'mint_bucket': 'my-mint-bucket', 'berry_applications': [{'application_id': 'app2'}],
+         'berry_retry': {'read_timeout': 1}},
+    ]
+    cycles = []
+
+    def sleep(seconds):
+        cycles.append(sorted(call[1]['Key'] for call in s3.get_object.call_args_list))
+        s3.get_object.reset_mock()
+        if len(cycles) > len(configs) + 1:
+            raise StopBerry()
+        if len(cycles) > 1:
+            content = configs[len(cycles) - 2]
+            config.write(content if isinstance(content, str) else yaml.dump(content))
+            os.utime(str(config), (len(cycles), len(cycles)))
+
+    monkeypatch.setattr('time.sleep', sleep)
+
+    args = default_args()
+    args.config_file = str(config)
+    args.local_directory = str(tmpdir)
+    with pytest.raises(StopBerry):
+        run_berry(args)
+
+    assert cycles == [
+        [],  # startup delay
+        ['app1/client.json', 'app1/user.json'],
+        ['app1/client.json', 'app1/user.json', 'app2/client.json', 'app2/user.json'],
+        # the invalid configurations are ignored
+        ['app1/client.json', 'app1/user.json', 'app2/client.json', 'app2/user.json'],
+        ['app1/client.json', 'app1/user.json', 'app2/client.json', 'app2/user.json'],
+        ['app2/client.json', 'app2/user.json'],
+    ]
+    # the session was only rebuilt for the changed read timeout
+    assert session.call_count == 2
+
+
+def test_get_bucket_region_lookup_order(monkeypatch):
+    s3 = MagicMock()
+    s3.get_bucket_location.return_value = {'LocationConstraint': 'eu-central-1'}
+    dns_resolver = MagicMock()
+    monkeypatch.setattr('dns.resolver.query', dns_resolver)
+
+    endpoint = 'my-mint-bucket.s3-eu-west-1.amazonaws.com'
+    assert get_bucket_region(s3, 'my-mint-bucket', endpoint) == 'eu-central-1'
+    assert get_bucket_region(s3, 'my-mint-bucket', endpoint, lookup_order=('endpoint', 'location')) == 'eu-west-1'
+    assert get_bucket_region(s3, 'my-mint-bucket', 'my-mint-bucket.s3.amazonaws.com', lookup_order=('endpoint',)) \
+        is None
+    assert not dns_resolver.called
+
+    resolver = MagicMock()
+    resolver.query.side_effect = dns.resolver.Timeout
+    assert get_bucket_region(s3, 'my-mint-bucket', endpoint, resolver, ('dns', 'endpoint')) == 'eu-west-1'
+    resolver.query.assert_called_with('my-mint-bucket.s3.amazonaws.com', 'CNAME')
+
+    args = default_args()
+    args.application_id = 'myapp'
+    args.mint_bucket = 'my-mint-bucket'
+    args.config_file = None
+    args.region_lookup_order = 'dns,carrier-pigeon'
+    with pytest.raises(UsageError) as excinfo:
+        run_berry(args)
+    assert 'Unknown region lookup method(s) carrier-pigeon' in excinfo.value.msg
+
+
+def test_lazy_imports():
+    # "berry --once" in boot scripts should not pay for unused dependencies
+    script = 'import sys, berry.cli; print(sorted(m for m in ("boto3", "botocore", "dns", "yaml") if m in sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', script])
+    assert output.decode('utf-8').strip() == '[]'
+
+
+def test_load_config_c_loader(monkeypatch, tmpdir):
+    path = tmpdir.join('taupage.yaml')
+    path.write('application_id: myapp\nmint_bucket: my-mint-bucket\n')
+    assert berry.cli.load_config(str(path)) == {'application_id': 'myapp', 'mint_bucket': 'my-mint-bucket'}
+    # pure Python fallback
+    monkeypatch.delattr('yaml.CSafeLoader', raising=False)
+    assert berry.cli.load_config(str(path))['application_id'] == 'myapp'
+    path.write('')
+    assert berry.cli.load_config(str(path)) == {}
+
+
 def test_main_noargs(monkeypatch):
     monkeypatch.setattr('sys.argv', ['berry'])
     try:
@@ -134,7 +874,7 @@ def test_main_missingargs(monkeypatch):
         ('Usage Error: Application ID missing, please set "application_id" in your '
          'configuration YAML')
     )
-    args = MagicMock()
+    args = default_args()
     args.config_file = None
     args.application_id = 'myapp'
     args.aws_credentials_file = None
@@ -165,7 +905,7 @@ def test_s3_error_message(monkeypatch, tmpdir):
     dns_resolver = MagicMock()
     monkeypatch.setattr('dns.resolver.query', dns_resolver)
 
-    args = MagicMock()
+    args = default_args()
     args.application_id = 'myapp'
     args.config_file = str(tmpdir.join('taupage.yaml'))
     args.once = True
@@ -177,8 +917,9 @@ def test_s3_error_message(monkeypatch, tmpdir):
 
     logging.basicConfig(level=logging.INFO)
 
+    log_error.reset_mock()
     assert run_berry(args) is False
-    log_error.assert_called_with(
+    log_error.assert_any_call(
         ('Access denied while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Check your IAM role/user policy to allow read access! '
          '(S3 error message: Access Denied)'))
@@ -186,8 +927,9 @@ def test_s3_error_message(monkeypatch, tmpdir):
     s3.get_object.side_effect = botocore.exceptions.ClientError(
         {'ResponseMetadata': {'HTTPStatusCode': 404},
          'Error': {}}, 'get_object')
+    log_error.reset_mock()
     assert run_berry(args) is False
-    log_error.assert_called_with(
+    log_error.assert_any_call(
         'Credentials file "myapp/client.json" not found in mint S3 bucket "my-mint-bucket". '
         'Mint either did not sync them yet or the mint configuration is wrong. (S3 error message: None)')
 
@@ -202,8 +944,9 @@ def test_s3_error_message(monkeypatch, tmpdir):
                               'HostId': '',
                               'RequestId': ''}}, 'get_object')
     s3.get_bucket_location.return_value = {'LocationConstraint': 'eu-foobar-1'}
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region eu-foobar-1, endpoint '
          'my-mint-bucket.s3-eu-foobar-1.amazonaws.com! (S3 error message: The bucket '
@@ -226,8 +969,9 @@ def test_s3_error_message(monkeypatch, tmpdir):
          'ResponseMetadata': {'HTTPStatusCode': 403,
                               'HostId': '',
                               'RequestId': ''}}, 'get_bucket_location')
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region eu-foobar-1, endpoint '
          'my-mint-bucket.s3-eu-foobar-1.amazonaws.com! (S3 error message: The bucket '
@@ -266,8 +1010,9 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3.eu-foobar-1.amazonaws.com.
         dns.rdatatype.CNAME,
         dns.rdataclass.IN,
         dns.message.from_text(message_text)))
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region eu-foobar-1, endpoint '
          'my-mint-bucket.s3.amazonaws.com! (S3 error message: The bucket you are '
@@ -290,8 +1035,9 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3-eu-foobar-1.amazonaws.com.
         dns.rdatatype.CNAME,
         dns.rdataclass.IN,
         dns.message.from_text(message_text)))
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region eu-foobar-1, endpoint '
          'my-mint-bucket.s3.amazonaws.com! (S3 error message: The bucket you are '
@@ -314,8 +1060,9 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3.amazonaws.com.
         dns.rdatatype.CNAME,
         dns.rdataclass.IN,
         dns.message.from_text(message_text)))
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region None, endpoint '
          'my-mint-bucket.s3.amazonaws.com! (S3 error message: The bucket you are '
@@ -323,8 +1070,9 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3.amazonaws.com.
          'Please send all future requests to this endpoint.)'))
 
     dns_resolver.side_effect = dns.resolver.NXDOMAIN
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    assert run_berry(args) is False
+    log_debug.assert_any_call(
         ('Got Redirect while trying to read "myapp/client.json" from mint S3 bucket '
          '"my-mint-bucket". Retrying with region None, endpoint '
          'my-mint-bucket.s3.amazonaws.com! (S3 error message: The bucket you are '
@@ -338,8 +1086,13 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3.amazonaws.com.
          'ResponseMetadata': {'HTTPStatusCode': 400,
                               'HostId': '',
                               'RequestId': ''}}, 'get_object')
-    assert run_berry(args) is True
-    log_debug.assert_called_with(
+    log_debug.reset_mock()
+    log_error.reset_mock()
+    # every attempt is used up by retrying with signature version v4
+    assert run_berry(args) is False
+    log_error.assert_any_call(
+        'Could not read "myapp/client.json" from mint S3 bucket "my-mint-bucket" after 3 attempts')
+    log_debug.assert_any_call(
         ('Invalid Request while trying to read "myapp/client.json" from mint S3 '
          'bucket "my-mint-bucket". Retrying with signature version v4! (S3 error '
          'message: The authorization mechanism you have provided is not supported. '
@@ -348,12 +1101,32 @@ my-mint-bucket.s3.amazonaws.com. 1 IN CNAME s3.amazonaws.com.
     # generic ClientError
     s3.get_object.side_effect = botocore.exceptions.ClientError(
         {'ResponseMetadata': {'HTTPStatusCode': 999}, 'Error': {}}, 'get_object')
+    log_error.reset_mock()
     assert run_berry(args) is False
-    log_error.assert_called_with(
+    log_error.assert_any_call(
         ('Could not read from mint S3 bucket "my-mint-bucket": An error occurred '
          '(Unknown) when calling the get_object operation: Unknown'))
 
     # generic Exception
     s3.get_object.side_effect = Exception('foobar')
+    log_error.reset_mock()
     assert run_berry(args) is False
-    log_error.assert_called_with('Failed to download client credentials', exc_info=True)
+    log_error.assert_any_call('Failed to download client credentials', exc_info=True)
+
+
+def test_aws_credentials_index(monkeypatch, tmpdir):
+    p = tmpdir.join('aws-creds')
+    p.write('# myapp:commented:out\nmyapp:abc123:456789\nmyapp:second:entry\nbroken\notherapp:foo:bar\n')
+    assert lookup_aws_credentials('myapp', str(p)) == ('abc123', '456789')
+    assert lookup_aws_credentials('otherapp', str(p)) == ('foo', 'bar')
+    assert lookup_aws_credentials('broken', str(p)) == (None, None)
+
+    # the file is only parsed again after it changed
+    opened = MagicMock(side_effect=open)
+    monkeypatch.setattr('berry.cli.open', opened, raising=False)
+    assert lookup_aws_credentials('unknown', str(p)) == (None, None)
+    assert not opened.called
+
+    p.write('myapp:new:key\n')
+    assert lookup_aws_credentials('myapp', str(p)) == ('new', 'key')
+    assert opened.call_count == 1
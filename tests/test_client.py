@@ -0,0 +1,122 @@
+from berry.client import S3ClientManager
+from berry.metrics import Metrics
+from berry.retry import RetryPolicy
+from berry.state import EndpointCache
+from mock import MagicMock
+
+
+def test_client_manager_reuses_session(monkeypatch, tmpdir):
+    sessions = []
+
+    def session_factory(**kwargs):
+        session = MagicMock()
+        session.credentials = kwargs
+        sessions.append(session)
+        return session
+    monkeypatch.setattr('boto3.session.Session', session_factory)
+
+    p = tmpdir.join('aws-creds')
+    p.write('myapp:abc123:456789')
+    load_credentials = MagicMock(return_value={'aws_access_key_id': 'abc123', 'aws_secret_access_key': '456789'})
+    clients = S3ClientManager(str(p), load_credentials)
+
+    clients.refresh()
+    s3 = clients.client('my-mint-bucket')
+    clients.refresh()
+    assert clients.client('my-mint-bucket') is s3
+    assert len(sessions) == 1
+    assert load_credentials.call_count == 1
+
+    # negotiated endpoint settings are kept across cycles
+    clients.use_region('my-mint-bucket', 'eu-west-1')
+    clients.use_signature_version('my-mint-bucket', 's3v4')
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    args, kwargs = sessions[0].client.call_args
+    assert kwargs['region_name'] == 'eu-west-1'
+    assert kwargs['config'].signature_version == 's3v4'
+
+    # changed credentials file
+    p.write('myapp:abc123:456789\n# other comment')
+    clients.refresh()
+    assert len(sessions) == 2
+    assert load_credentials.call_count == 2
+    assert clients.endpoint('my-mint-bucket')['region'] == 'eu-west-1'
+
+    clients.reset()
+    clients.refresh()
+    assert len(sessions) == 3
+
+
+def test_client_manager_without_credentials_file(monkeypatch):
+    session = MagicMock()
+    factory = MagicMock(return_value=session)
+    monkeypatch.setattr('boto3.session.Session', factory)
+    metrics = Metrics()
+    clients = S3ClientManager(metrics=metrics)
+    clients.refresh()
+    clients.refresh()
+    assert clients.client('my-mint-bucket') is session.client.return_value
+    assert clients.client('my-mint-bucket') is session.client.return_value
+    factory.assert_called_once_with()
+    # only creating the session and the client is timed, not taking them from the cache
+    assert sum(metrics.client_setup_seconds.counts) == 2
+
+
+def test_client_manager_endpoint_cache(monkeypatch, tmpdir):
+    session = MagicMock()
+    monkeypatch.setattr('boto3.session.Session', MagicMock(return_value=session))
+    path = str(tmpdir.join('endpoints.json'))
+
+    clients = S3ClientManager(endpoint_cache=EndpointCache(path, 3600))
+    clients.refresh()
+    clients.use_region('my-mint-bucket', 'eu-west-1')
+    clients.endpoint_cache.save()
+
+    # a restarted berry goes straight to the remembered region
+    clients = S3ClientManager(endpoint_cache=EndpointCache(path, 3600))
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    session.client.assert_called_with('s3', region_name='eu-west-1')
+
+    clients.invalidate_endpoint('my-mint-bucket')
+    assert clients.endpoint('my-mint-bucket') == {'region': None, 'signature_version': None}
+    assert clients.endpoint_cache.get('my-mint-bucket') is None
+
+
+def test_client_manager_endpoint_url(monkeypatch):
+    session = MagicMock()
+    monkeypatch.setattr('boto3.session.Session', MagicMock(return_value=session))
+    clients = S3ClientManager(endpoint_url='http://127.0.0.1:9000')
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    args, kwargs = session.client.call_args
+    assert kwargs['endpoint_url'] == 'http://127.0.0.1:9000'
+    assert kwargs['config'].s3 == {'addressing_style': 'path'}
+
+
+def test_client_manager_pool_size(monkeypatch):
+    session = MagicMock()
+    monkeypatch.setattr('boto3.session.Session', MagicMock(return_value=session))
+    clients = S3ClientManager(max_pool_connections=4)
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    session.client.assert_called_with('s3')
+
+    clients = S3ClientManager(max_pool_connections=32)
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    args, kwargs = session.client.call_args
+    assert kwargs['config'].max_pool_connections == 32
+
+
+def test_client_manager_timeouts(monkeypatch):
+    session = MagicMock()
+    monkeypatch.setattr('boto3.session.Session', MagicMock(return_value=session))
+    clients = S3ClientManager(retry_policy=RetryPolicy(connect_timeout=2, read_timeout=7))
+    clients.refresh()
+    clients.client('my-mint-bucket')
+    args, kwargs = session.client.call_args
+    assert kwargs['config'].connect_timeout == 2
+    assert kwargs['config'].read_timeout == 7
+    assert kwargs['config'].retries == {'max_attempts': 0}
@@ -0,0 +1,29 @@
+import os
+
+from berry.config import ConfigWatcher
+
+
+def test_config_watcher(tmpdir):
+    path = tmpdir.join('taupage.yaml')
+    path.write('application_id: myapp\n')
+    watcher = ConfigWatcher(str(path))
+    assert not watcher.changed()
+
+    path.write('application_id: otherapp\n')
+    os.utime(str(path), (0, 0))
+    assert watcher.changed()
+    assert not watcher.changed()
+
+    watcher.request_reload()
+    assert watcher.changed()
+    assert not watcher.changed()
+
+    path.remove()
+    assert watcher.changed()
+
+
+def test_config_watcher_without_file():
+    watcher = ConfigWatcher(None)
+    assert not watcher.changed()
+    watcher.request_reload()
+    assert watcher.changed()
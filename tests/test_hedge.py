@@ -0,0 +1,100 @@
+import threading
+
+import botocore.exceptions
+from berry.hedge import BucketHealth, HedgedReader
+from berry.metrics import Metrics
+from mock import MagicMock
+
+
+def client_error(status_code, code):
+    return botocore.exceptions.ClientError({'ResponseMetadata': {'HTTPStatusCode': status_code},
+                                            'Error': {'Code': code}}, 'GetObject')
+
+
+def client_manager(get_object):
+    clients = MagicMock()
+    clients.client_error = botocore.exceptions.ClientError
+    clients.client.return_value.get_object.side_effect = get_object
+    return clients
+
+
+def test_bucket_health(monkeypatch):
+    current_time = [1000.0]
+    monkeypatch.setattr('berry.hedge.now', lambda: current_time[0])
+    health = BucketHealth(1.0, ttl=300)
+    assert health.order(['primary', 'replica1', 'replica2']) == ['primary', 'replica1', 'replica2']
+
+    health.observe('primary', 0.05, True)
+    health.observe('replica1', 0.01, True)
+    # healthy buckets keep the configured order
+    assert health.order(['primary', 'replica1', 'replica2']) == ['primary', 'replica1', 'replica2']
+
+    health.observe('primary', 0.1, False)
+    health.observe('primary', 0.1, False)
+    health.observe('replica2', 1.5, True)
+    assert health.order(['primary', 'replica1', 'replica2']) == ['replica1', 'replica2', 'primary']
+
+    # recovers
+    for i in range(10):
+        health.observe('primary', 0.05, True)
+    assert health.order(['primary', 'replica1', 'replica2']) == ['primary', 'replica1', 'replica2']
+
+    health.observe('primary', 10, True)
+    assert health.order(['primary', 'replica1']) == ['replica1', 'primary']
+    # forgotten after a while, the primary is tried first again
+    current_time[0] += 301
+    assert health.order(['primary', 'replica1']) == ['primary', 'replica1']
+
+
+def test_hedge_slow_bucket():
+    release = threading.Event()
+
+    def get_object(Bucket, Key):
+        if Bucket == 'primary':
+            release.wait(5)
+            return {'ETag': '"slow"'}
+        return {'ETag': '"fast"'}
+
+    clients = client_manager(get_object)
+    metrics = Metrics()
+    reader = HedgedReader(0.01, 2, metrics)
+    try:
+        bucket, future = reader.get_object(clients, ['primary', 'replica'], Key='myapp/user.json')
+        assert bucket == 'replica'
+        assert future.result() == {'ETag': '"fast"'}
+        assert metrics.hedged_requests.values == {'replica': 1}
+        release.set()
+    finally:
+        reader.close()
+
+
+def test_hedge_failed_bucket():
+    def get_object(Bucket, Key, IfNoneMatch):
+        if Bucket == 'primary':
+            raise client_error(403, 'AccessDenied')
+        raise client_error(304, '304')
+
+    reader = HedgedReader(5, 2)
+    try:
+        # "Not Modified" is a valid response
+        bucket, future = reader.get_object(client_manager(get_object), ['primary', 'replica'],
+                                           Key='myapp/user.json', IfNoneMatch='"abc"')
+        assert bucket == 'replica'
+        assert future.exception().response['Error']['Code'] == '304'
+        assert reader.health.order(['primary', 'replica']) == ['replica', 'primary']
+    finally:
+        reader.close()
+
+
+def test_hedge_all_failed():
+    def get_object(Bucket, Key):
+        raise client_error(404 if Bucket == 'primary' else 500, Bucket)
+
+    reader = HedgedReader(5, 2)
+    try:
+        # the error of the preferred bucket
+        bucket, future = reader.get_object(client_manager(get_object), ['primary', 'replica'], Key='myapp/user.json')
+        assert bucket == 'primary'
+        assert future.exception().response['Error']['Code'] == 'primary'
+    finally:
+        reader.close()
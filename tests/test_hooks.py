@@ -0,0 +1,88 @@
+import os
+import signal
+import threading
+
+from berry.cli import Application
+from berry.hooks import HookRunner, RotationHook
+from mock import MagicMock
+
+
+def test_touch_and_command(tmpdir):
+    app = Application('myapp', 'my-mint-bucket', str(tmpdir))
+    trigger = tmpdir.join('trigger')
+    output = tmpdir.join('output')
+    hook = RotationHook(touch=str(trigger),
+                        command='echo "$BERRY_APPLICATION_ID $BERRY_ROTATED_FILES" > {}'.format(output))
+    hook.run(app, ['client', 'user'])
+    assert trigger.exists()
+    assert output.read() == 'myapp client,user\n'
+
+
+def test_command_timeout(monkeypatch, tmpdir):
+    log_error = MagicMock()
+    monkeypatch.setattr('logging.error', log_error)
+    app = Application('myapp', 'my-mint-bucket', str(tmpdir))
+    RotationHook(command='sleep 10', timeout=0.1).run(app, ['user'])
+    log_error.assert_called_with('Rotation hook command "sleep 10" for myapp failed: killed after 0.1 seconds')
+
+    RotationHook(command='exit 3').run(app, ['user'])
+    log_error.assert_called_with('Rotation hook command "exit 3" for myapp failed: exit code 3')
+
+
+def test_signal(tmpdir):
+    received = []
+    previous = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+    try:
+        pidfile = tmpdir.join('app.pid')
+        pidfile.write('{}\n'.format(os.getpid()))
+        RotationHook(signal.SIGUSR1, pidfile=str(pidfile)).run(Application('myapp', 'b', str(tmpdir)), ['user'])
+        RotationHook(signal.SIGUSR1, pid=os.getpid()).run(Application('myapp', 'b', str(tmpdir)), ['user'])
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    assert received == [signal.SIGUSR1, signal.SIGUSR1]
+
+
+def test_hook_runner_coalesces(tmpdir):
+    release = threading.Event()
+    calls = []
+
+    def run(app, files):
+        calls.append(files)
+        release.wait(5)
+
+    app = Application('myapp', 'my-mint-bucket', str(tmpdir))
+    app.hook = MagicMock(timeout=5)
+    app.hook.run.side_effect = run
+    runner = HookRunner()
+    runner.notify(app, ['user'])
+    # rotations while the hook runs result in a single further notification
+    runner.notify(app, ['user'])
+    runner.notify(app, ['client'])
+    release.set()
+    runner.join(5)
+    assert calls == [['user'], ['client', 'user']]
+    assert runner.threads == {}
+
+
+def test_hook_runner_same_application_id(tmpdir):
+    release = threading.Event()
+    calls = []
+
+    def hook():
+        def run(app, files):
+            calls.append((app.local_directory, files))
+            release.wait(5)
+        return MagicMock(timeout=5, run=MagicMock(side_effect=run))
+
+    # the same application ID with two local directories (e.g. from two mint buckets)
+    first = Application('myapp', 'my-mint-bucket', str(tmpdir.join('first')))
+    second = Application('myapp', 'other-mint-bucket', str(tmpdir.join('second')))
+    first.hook = hook()
+    second.hook = hook()
+    runner = HookRunner()
+    runner.notify(first, ['user'])
+    runner.notify(second, ['client'])
+    release.set()
+    runner.join(5)
+    assert sorted(calls) == [(first.local_directory, ['user']), (second.local_directory, ['client'])]
+    assert runner.threads == {}
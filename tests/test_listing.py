@@ -0,0 +1,112 @@
+import datetime
+
+import botocore.exceptions
+import pytest
+from berry.cli import Application, FetchContext
+from berry.engine import ThreadFetchEngine
+from berry.listing import ChangeDetector
+from berry.state import content_digest
+from mock import MagicMock
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    # logging would configure the root logger on its own, see test_cli.test_rotate_credentials
+    monkeypatch.setattr('berry.listing.logging', MagicMock())
+
+
+def client_manager(s3):
+    clients = MagicMock()
+    clients.client.return_value = s3
+    clients.client_error = botocore.exceptions.ClientError
+    clients.timeout_errors = ()
+    clients.connection_errors = ()
+    return clients
+
+
+def application(tmpdir, application_id, etags):
+    app = Application(application_id, 'my-mint-bucket', str(tmpdir.join(application_id)))
+    tmpdir.join(application_id).ensure(dir=True)
+    for fn, etag in etags.items():
+        tmpdir.join(application_id, '{}.json'.format(fn)).write('{}')
+        app.fetch_state.update('{}/{}.json'.format(application_id, fn), {'ETag': etag}, content_digest({}))
+    return app
+
+
+def test_skip_unchanged(tmpdir):
+    s3 = MagicMock()
+    s3.list_objects_v2.side_effect = [
+        {'Contents': [{'Key': 'app1/client.json', 'ETag': '"a"', 'LastModified': datetime.datetime(2016, 1, 1)},
+                      {'Key': 'app1/user.json', 'ETag': '"b"'}],
+         'IsTruncated': True, 'NextContinuationToken': 'app1/user.json'},
+        {'Contents': [{'Key': 'app2/client.json', 'ETag': '"c"'}, {'Key': 'app2/user.json', 'ETag': '"new"'}],
+         'IsTruncated': False}]
+    clients = client_manager(s3)
+    app1 = application(tmpdir, 'app1', {'client': '"a"', 'user': '"b"'})
+    app2 = application(tmpdir, 'app2', {'client': '"c"', 'user': '"d"'})
+    context = FetchContext(scheduler=MagicMock())
+    engine = ThreadFetchEngine(None, context, 2)
+    try:
+        jobs = [(app, fn, clients) for app in (app1, app2) for fn in ('user', 'client')]
+        assert ChangeDetector(context).filter(jobs, engine) == [(app2, 'user', clients)]
+    finally:
+        engine.close()
+    s3.list_objects_v2.assert_any_call(Bucket='my-mint-bucket', Prefix='app')
+    s3.list_objects_v2.assert_any_call(Bucket='my-mint-bucket', Prefix='app', ContinuationToken='app1/user.json')
+    context.scheduler.observe_modified.assert_any_call('app1/client.json', datetime.datetime(2016, 1, 1))
+    assert set(context.metrics.last_success) == set([('app1', 'user'), ('app1', 'client'), ('app2', 'client')])
+
+
+def test_missing_local_file(tmpdir):
+    s3 = MagicMock()
+    s3.list_objects_v2.return_value = {'Contents': [{'Key': 'app1/user.json', 'ETag': '"a"'}]}
+    clients = client_manager(s3)
+    app = application(tmpdir, 'app1', {'user': '"a"'})
+    tmpdir.join('app1', 'user.json').remove()
+    context = FetchContext()
+    engine = ThreadFetchEngine(None, context, 1)
+    try:
+        jobs = [(app, 'user', clients)]
+        assert ChangeDetector(context).filter(jobs, engine) == jobs
+    finally:
+        engine.close()
+    s3.list_objects_v2.assert_called_once_with(Bucket='my-mint-bucket', Prefix='app1/user.json')
+
+
+def test_access_denied(tmpdir):
+    s3 = MagicMock()
+    s3.list_objects_v2.side_effect = botocore.exceptions.ClientError(
+        {'ResponseMetadata': {'HTTPStatusCode': 403}, 'Error': {'Code': 'AccessDenied'}}, 'ListObjectsV2')
+    clients = client_manager(s3)
+    app = application(tmpdir, 'app1', {'user': '"a"', 'client': '"b"'})
+    context = FetchContext()
+    engine = ThreadFetchEngine(None, context, 1)
+    detector = ChangeDetector(context)
+    try:
+        jobs = [(app, 'user', clients), (app, 'client', clients)]
+        assert detector.filter(jobs, engine) == jobs
+        # not listed again
+        assert detector.filter(jobs, engine) == jobs
+    finally:
+        engine.close()
+    assert s3.list_objects_v2.call_count == 1
+
+
+def test_list_error(tmpdir):
+    s3 = MagicMock()
+    s3.list_objects_v2.side_effect = [
+        botocore.exceptions.ClientError({'ResponseMetadata': {'HTTPStatusCode': 503}, 'Error': {'Code': 'SlowDown'}},
+                                        'ListObjectsV2'),
+        {'Contents': [{'Key': 'app1/user.json', 'ETag': '"a"'}]}]
+    clients = client_manager(s3)
+    app = application(tmpdir, 'app1', {'user': '"a"'})
+    context = FetchContext()
+    engine = ThreadFetchEngine(None, context, 1)
+    detector = ChangeDetector(context)
+    try:
+        jobs = [(app, 'user', clients)]
+        assert detector.filter(jobs, engine) == jobs
+        # listed again in the next cycle
+        assert detector.filter(jobs, engine) == []
+    finally:
+        engine.close()
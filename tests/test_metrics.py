@@ -0,0 +1,64 @@
+import contextlib
+
+from berry.metrics import Counter, Histogram, Metrics, start_metrics_server
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:  # Python 2
+    from urllib2 import urlopen, HTTPError
+
+
+def test_histogram():
+    histogram = Histogram('berry_test_seconds', 'Test histogram', (0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert histogram.render() == [
+        '# HELP berry_test_seconds Test histogram',
+        '# TYPE berry_test_seconds histogram',
+        'berry_test_seconds_bucket{le="0.1"} 1',
+        'berry_test_seconds_bucket{le="1.0"} 2',
+        'berry_test_seconds_bucket{le="+Inf"} 3',
+        'berry_test_seconds_sum 5.55',
+        'berry_test_seconds_count 3']
+
+    with histogram.time():
+        pass
+    assert histogram.counts[0] == 2
+
+
+def test_counter():
+    counter = Counter('berry_test_total', 'Test counter', 'error', ('403', '404'))
+    counter.inc('404')
+    counter.inc('other', 2)
+    assert counter.render()[2:] == ['berry_test_total{error="403"} 0.0',
+                                    'berry_test_total{error="404"} 1.0',
+                                    'berry_test_total{error="other"} 2.0']
+
+
+def test_metrics_endpoint():
+    metrics = Metrics()
+    metrics.get_object_seconds.observe(0.2)
+    metrics.errors.inc('redirect')
+    metrics.refreshed('myapp', 'user')
+
+    server = start_metrics_server(metrics, 0)
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        with contextlib.closing(urlopen(url + '/metrics')) as response:
+            assert response.getcode() == 200
+            body = response.read().decode('utf-8')
+        assert 'berry_get_object_seconds_count 1' in body
+        assert 'berry_s3_errors_total{error="redirect"} 1.0' in body
+        assert 'berry_seconds_since_last_refresh{application_id="myapp",file="user"}' in body
+        assert '# TYPE berry_get_bucket_region_seconds histogram' in body
+
+        try:
+            urlopen(url + '/other')
+            assert False
+        except HTTPError as e:
+            assert e.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
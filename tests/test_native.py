@@ -0,0 +1,147 @@
+import datetime
+import socket
+
+import pytest
+from berry.native import (EMPTY_SHA256, Credentials, CredentialsChain, NativeClientManager, NativeS3Client,
+                          NativeSession, S3ClientError, signature_headers)
+from berry.retry import RetryPolicy
+from mock import MagicMock
+
+
+def fake_response(status, body=b'', headers=None):
+    response = MagicMock()
+    response.status = status
+    response.read.return_value = body
+    headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+    response.getheader.side_effect = lambda name, default=None: headers.get(name.lower(), default)
+    response.getheaders.return_value = list(headers.items())
+    return response
+
+
+def native_client(responses, region='eu-west-1'):
+    connection = MagicMock()
+    connection.getresponse.side_effect = responses
+    session = NativeSession(MagicMock(), 10)
+    session.credentials.get.return_value = Credentials('AKID', 'SECRET')
+    session.pool.acquire = MagicMock(return_value=(connection, False))
+    session.pool.release = MagicMock()
+    return NativeS3Client(session, region), connection
+
+
+def test_signature_matches_botocore():
+    from botocore.auth import S3SigV4Auth
+    from botocore.awsrequest import AWSRequest
+    from botocore.credentials import Credentials as BotocoreCredentials
+
+    request = AWSRequest(method='GET', url='https://my-mint-bucket.s3.eu-west-1.amazonaws.com/myapp/user.json',
+                         headers={'If-None-Match': '"abc"', 'X-Amz-Content-SHA256': EMPTY_SHA256})
+    S3SigV4Auth(BotocoreCredentials('AKID', 'SECRET', 'TOKEN'), 's3', 'eu-west-1').add_auth(request)
+    now = datetime.datetime.strptime(request.headers['X-Amz-Date'], '%Y%m%dT%H%M%SZ')
+
+    headers = signature_headers(Credentials('AKID', 'SECRET', 'TOKEN'), 'eu-west-1', 'GET',
+                                'my-mint-bucket.s3.eu-west-1.amazonaws.com', '/myapp/user.json', {},
+                                {'If-None-Match': '"abc"'}, now)
+    assert headers['Authorization'] == request.headers['Authorization']
+    assert headers['x-amz-security-token'] == 'TOKEN'
+
+
+def test_get_object():
+    s3, connection = native_client([fake_response(200, b'{"a": 1}', {
+        'ETag': '"abc"', 'Last-Modified': 'Sat, 02 Jan 2016 03:04:05 GMT'})])
+    response = s3.get_object(Bucket='my-mint-bucket', Key='myapp/user.json', IfNoneMatch='"old"',
+                             IfModifiedSince='2016-01-01T00:00:00+00:00')
+    assert response['Body'].read() == b'{"a": 1}'
+    assert response['ETag'] == '"abc"'
+    assert response['LastModified'] == datetime.datetime(2016, 1, 2, 3, 4, 5)
+
+    args, kwargs = connection.request.call_args
+    assert args == ('GET', '/myapp/user.json')
+    assert kwargs['headers']['If-None-Match'] == '"old"'
+    assert kwargs['headers']['If-Modified-Since'] == 'Fri, 01 Jan 2016 00:00:00 GMT'
+    s3.session.pool.acquire.assert_called_with('https', 'my-mint-bucket.s3.eu-west-1.amazonaws.com')
+    assert s3.session.pool.release.called
+
+
+def test_errors():
+    s3, connection = native_client([
+        fake_response(304),
+        fake_response(301, b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>PermanentRedirect</Code>'
+                      b'<Message>Please send all future requests to this endpoint.</Message>'
+                      b'<Endpoint>my-mint-bucket.s3-eu-central-1.amazonaws.com</Endpoint></Error>',
+                      {'x-amz-bucket-region': 'eu-central-1'}),
+        fake_response(403, b'<Error><Code>AccessDenied</Code><Message>Access Denied</Message></Error>'),
+    ], region='us-east-1')
+
+    with pytest.raises(S3ClientError) as excinfo:
+        s3.get_object(Bucket='my-mint-bucket', Key='myapp/user.json')
+    assert excinfo.value.response['ResponseMetadata']['HTTPStatusCode'] == 304
+
+    with pytest.raises(S3ClientError) as excinfo:
+        s3.get_object(Bucket='my-mint-bucket', Key='myapp/user.json')
+    assert excinfo.value.response['Error'] == {'Code': 'PermanentRedirect',
+                                               'Message': 'Please send all future requests to this endpoint.',
+                                               'Endpoint': 'my-mint-bucket.s3-eu-central-1.amazonaws.com',
+                                               'Region': 'eu-central-1'}
+
+    with pytest.raises(S3ClientError) as excinfo:
+        s3.get_object(Bucket='my.dotted.bucket', Key='myapp/user.json')
+    assert str(excinfo.value) == ('An error occurred (AccessDenied) when calling the GetObject operation: '
+                                  'Access Denied')
+    s3.session.pool.acquire.assert_called_with('https', 's3.amazonaws.com')
+    assert connection.request.call_args[0][1] == '/my.dotted.bucket/myapp/user.json'
+
+
+def test_get_bucket_location():
+    body = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/">eu-central-1</LocationConstraint>')
+    s3, connection = native_client([fake_response(200, body)])
+    assert s3.get_bucket_location(Bucket='my-mint-bucket') == {'LocationConstraint': 'eu-central-1'}
+    assert connection.request.call_args[0][1] == '/?location'
+
+
+def test_list_objects_v2():
+    body = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>my-mint-bucket</Name>'
+            b'<Prefix>app</Prefix><IsTruncated>true</IsTruncated>'
+            b'<Contents><Key>app1/user.json</Key><LastModified>2016-01-02T03:04:05.000Z</LastModified>'
+            b'<ETag>&quot;abc&quot;</ETag><Size>64</Size></Contents>'
+            b'<NextContinuationToken>1ueGcxLPRx1Tr</NextContinuationToken></ListBucketResult>')
+    s3, connection = native_client([fake_response(200, body)])
+    assert s3.list_objects_v2(Bucket='my-mint-bucket', Prefix='app', ContinuationToken='0a/b=') == {
+        'Contents': [{'Key': 'app1/user.json', 'ETag': '"abc"', 'Size': 64,
+                      'LastModified': datetime.datetime(2016, 1, 2, 3, 4, 5)}],
+        'IsTruncated': True, 'NextContinuationToken': '1ueGcxLPRx1Tr'}
+    assert connection.request.call_args[0][1] == '/?continuation-token=0a%2Fb%3D&list-type=2&prefix=app'
+
+
+def test_credentials_chain(monkeypatch):
+    metadata = MagicMock(return_value=Credentials('META', 'SECRET', 'TOKEN', expiration=1))
+    monkeypatch.delenv('AWS_ACCESS_KEY_ID', raising=False)
+    monkeypatch.delenv('AWS_SECRET_ACCESS_KEY', raising=False)
+
+    chain = CredentialsChain({'aws_access_key_id': 'FILE', 'aws_secret_access_key': 'SECRET'}, metadata)
+    assert chain.get().access_key == 'FILE'
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'ENV')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'SECRET')
+    assert CredentialsChain({}, metadata).get().access_key == 'ENV'
+
+    monkeypatch.delenv('AWS_ACCESS_KEY_ID')
+    chain = CredentialsChain({}, metadata)
+    assert chain.get().access_key == 'META'
+    # expired instance profile credentials are fetched again
+    chain.get()
+    assert metadata.call_count == 2
+
+
+def test_native_client_manager():
+    clients = NativeClientManager(endpoint_url='http://127.0.0.1:9000', retry_policy=RetryPolicy(read_timeout=5))
+    clients.refresh()
+    s3 = clients.use_region('my-mint-bucket', 'eu-central-1')
+    assert isinstance(s3, NativeS3Client)
+    assert s3.region == 'eu-central-1'
+    assert s3.address('my-mint-bucket', 'myapp/user.json') == \
+        ('http', '127.0.0.1:9000', '/my-mint-bucket/myapp/user.json')
+    assert clients.client_error is S3ClientError
+    assert clients.session.pool.read_timeout == 5
+    assert clients.timeout_errors == (socket.timeout,)
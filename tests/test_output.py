@@ -0,0 +1,116 @@
+import os
+
+import pytest
+from berry.cli import Application
+from berry.metrics import Metrics
+from berry.output import RENDER_FORMATS, FileOutput, GenerationOutput, render
+from mock import MagicMock
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    # logging would configure the root logger on its own, see test_cli.test_rotate_credentials
+    monkeypatch.setattr('berry.output.logging', MagicMock())
+
+
+def test_file_output(tmpdir):
+    app = Application('myapp', 'bucket', str(tmpdir))
+    output = FileOutput()
+    output.write(app, 'user', b'{"a": 1}', 'digest')
+    assert tmpdir.join('user.json').read() == '{"a": 1}'
+    assert app.fetch_state.local_digest(str(tmpdir.join('user.json'))) == 'digest'
+    assert output.commit(app) == 0
+
+
+def test_generations(tmpdir):
+    app = Application('myapp', 'bucket', str(tmpdir))
+    # written before the generations were enabled
+    tmpdir.join('client.json').write('{"client": 0}')
+    output = GenerationOutput(2)
+
+    output.write(app, 'user', b'{"user": 1}', 'user1')
+    assert not tmpdir.join('user.json').exists()
+    assert output.commit(app) == 0
+    assert os.readlink(str(tmpdir.join('current'))) == os.path.join('generations', '1')
+    assert os.readlink(str(tmpdir.join('user.json'))) == os.path.join('current', 'user.json')
+    assert tmpdir.join('current', 'user.json').read() == '{"user": 1}'
+    assert tmpdir.join('current', 'client.json').read() == '{"client": 0}'
+    assert app.fetch_state.local_digest(str(tmpdir.join('user.json'))) == 'user1'
+    # nothing written, no new generation
+    assert output.commit(app) == 0
+
+    output.write(app, 'user', b'{"user": 2}', 'user2')
+    output.write(app, 'client', b'{"client": 2}', 'client2')
+    output.commit(app)
+    assert tmpdir.join('user.json').read() == '{"user": 2}'
+    assert tmpdir.join('client.json').read() == '{"client": 2}'
+    assert tmpdir.join('generations', '1', 'user.json').read() == '{"user": 1}'
+
+    output.write(app, 'client', b'{"client": 3}', 'client3')
+    output.commit(app)
+    assert os.readlink(str(tmpdir.join('current'))) == os.path.join('generations', '3')
+    assert sorted(os.listdir(str(tmpdir.join('generations')))) == ['2', '3']
+    # unchanged files are shared with the previous generation
+    assert tmpdir.join('generations', '3', 'user.json').stat().ino == tmpdir.join('generations', '2',
+                                                                                  'user.json').stat().ino
+
+
+def test_generation_error(tmpdir):
+    app = Application('myapp', 'bucket', str(tmpdir.join('missing')))
+    app.fetch_state.update('myapp/user.json', {'ETag': '"abc"'})
+    app.rotated = ['user']
+    output = GenerationOutput(2)
+    output.write(app, 'user', b'{"user": 1}', 'user1')
+    tmpdir.join('missing').write('not a directory')
+    metrics = Metrics()
+    assert output.commit(app, metrics) == 1
+    assert metrics.file_status('myapp', 'user')['error_class'] == 'other'
+    assert app.rotated == []
+    # downloaded again
+    assert app.fetch_state.conditions('myapp/user.json', str(tmpdir.join('user.json'))) == {}
+    assert 'myapp/user.json' not in app.fetch_state.entries
+
+
+def test_render():
+    content = {'application_username': 'myteam_myapp', 'application_password': "it's = secreté",
+               'enabled': True, 'count': 3, 'nested': {'a': 1}, '../escape': 'x'}
+    files = render('user', content, RENDER_FORMATS)
+    assert files['user.env'] == (b"___ESCAPE='x'\nAPPLICATION_PASSWORD='it'\"'\"'s = secret\xc3\xa9'\n"
+                                 b"APPLICATION_USERNAME='myteam_myapp'\nCOUNT='3'\nENABLED='true'\n")
+    assert files['user.properties'] == (b'../escape=x\napplication_password=it\'s \\= secret\\u00e9\n'
+                                        b'application_username=myteam_myapp\ncount=3\nenabled=true\n')
+    assert files[os.path.join('user', 'application_password')] == "it's = secreté".encode('utf-8')
+    assert files[os.path.join('user', 'enabled')] == b'true'
+    assert sorted(name for name in files if name.startswith('user' + os.sep)) == [
+        os.path.join('user', name) for name in ('application_password', 'application_username', 'count', 'enabled')]
+    assert render('user', ['not', 'a', 'mapping'], ['env']) == {'user.env': b''}
+
+    # invalid and duplicate variable names are skipped
+    files = render('user', {'1st': 'a', 'db-host': 'b', 'db_host': 'c', 'emoji': u'\U0001f600'}, RENDER_FORMATS)
+    assert files['user.env'] == b"DB_HOST='b'\nEMOJI='\xf0\x9f\x98\x80'\n"
+    # characters outside the BMP as UTF-16 surrogate pairs
+    assert b'emoji=\\ud83d\\ude00\n' in files['user.properties']
+
+
+def test_rendered_output(tmpdir):
+    app = Application('myapp', 'bucket', str(tmpdir))
+    output = FileOutput(['env', 'fields'])
+    assert not output.complete(app, 'user')
+    output.write(app, 'user', b'{"a": "1", "b": "2"}', 'digest', {'a': '1', 'b': '2'})
+    assert output.complete(app, 'user')
+    assert tmpdir.join('user.env').read() == "A='1'\nB='2'\n"
+    assert tmpdir.join('user', 'b').read() == '2'
+
+    output.write(app, 'user', b'{"a": "3"}', 'digest2', {'a': '3'})
+    assert os.listdir(str(tmpdir.join('user'))) == ['a']
+    assert not tmpdir.join('user.json.tmp').exists()
+
+    generations = GenerationOutput(2, ['env', 'fields'])
+    generations.write(app, 'client', b'{"client_id": "c"}', 'digest3', {'client_id': 'c'})
+    generations.commit(app)
+    # the rendered files of the unchanged user.json were taken over
+    assert tmpdir.join('user.env').read() == "A='3'\n"
+    assert os.readlink(str(tmpdir.join('user'))) == os.path.join('current', 'user')
+    assert tmpdir.join('user', 'a').read() == '3'
+    assert tmpdir.join('client', 'client_id').read() == 'c'
+    assert generations.complete(app, 'client')
@@ -0,0 +1,48 @@
+import time
+
+from berry.resolver import CachingResolver
+from mock import MagicMock
+
+
+def answer(ttl):
+    result = MagicMock()
+    result.rrset.ttl = ttl
+    return result
+
+
+def test_caching_resolver_ttl(monkeypatch):
+    query = MagicMock(side_effect=lambda name, rdtype, lifetime: answer(30))
+    monkeypatch.setattr('dns.resolver.query', query)
+    resolver = CachingResolver(timeout=0.5)
+
+    first = resolver.query('my-mint-bucket.s3.amazonaws.com', 'CNAME')
+    assert resolver.query('my-mint-bucket.s3.amazonaws.com', 'CNAME') is first
+    query.assert_called_once_with('my-mint-bucket.s3.amazonaws.com', 'CNAME', lifetime=0.5)
+
+    now = time.time()
+    monkeypatch.setattr('time.time', lambda: now + 31)
+    assert resolver.query('my-mint-bucket.s3.amazonaws.com', 'CNAME') is not first
+    assert query.call_count == 2
+
+
+def test_caching_resolver_eviction(monkeypatch):
+    query = MagicMock(side_effect=lambda name, rdtype, lifetime: answer(30))
+    monkeypatch.setattr('dns.resolver.query', query)
+    resolver = CachingResolver(max_size=2)
+
+    resolver.query('a', 'CNAME')
+    resolver.query('b', 'CNAME')
+    resolver.query('a', 'CNAME')
+    resolver.query('c', 'CNAME')
+    # "b" was the least recently used entry
+    assert list(resolver.entries.keys()) == [('a', 'CNAME'), ('c', 'CNAME')]
+    assert query.call_count == 3
+
+
+def test_caching_resolver_zero_ttl(monkeypatch):
+    query = MagicMock(side_effect=lambda name, rdtype, lifetime: answer(0))
+    monkeypatch.setattr('dns.resolver.query', query)
+    resolver = CachingResolver()
+    resolver.query('a', 'CNAME')
+    resolver.query('a', 'CNAME')
+    assert query.call_count == 2
@@ -0,0 +1,34 @@
+from berry.retry import RetryPolicy
+from mock import MagicMock
+
+
+def test_delay():
+    policy = RetryPolicy(backoff=0.5, max_backoff=1.5)
+    for attempt, limit in ((1, 0.5), (2, 1.0), (3, 1.5), (10, 1.5)):
+        delays = [policy.delay(attempt) for i in range(100)]
+        assert all(0 <= delay <= limit for delay in delays)
+        # full jitter
+        assert len(set(delays)) > 1
+
+
+def test_wait(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+    monkeypatch.setattr('berry.retry.now', lambda: 100.0)
+    policy = RetryPolicy(attempts=3, backoff=1, max_backoff=1)
+    monkeypatch.setattr(policy, 'delay', lambda attempt: 1.0)
+
+    assert policy.wait(1) is True
+    assert policy.wait(2, deadline=102) is True
+    assert sleep.call_count == 2
+    # no attempts left
+    assert policy.wait(3) is False
+    # the retry would not start before the deadline
+    assert policy.wait(1, deadline=100.5) is False
+    assert sleep.call_count == 2
+
+
+def test_deadline(monkeypatch):
+    monkeypatch.setattr('berry.retry.now', lambda: 100.0)
+    assert RetryPolicy().deadline() is None
+    assert RetryPolicy(cycle_deadline=30).deadline() == 130.0
@@ -0,0 +1,48 @@
+import datetime
+
+from berry.scheduler import PollScheduler
+
+
+def test_jitter(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda a, b: b)
+    scheduler = PollScheduler(100, jitter=0.2)
+    assert scheduler.next_delay() == 120
+    assert scheduler.startup_delay() == 20
+
+    monkeypatch.setattr('random.uniform', lambda a, b: a)
+    assert scheduler.next_delay() == 80
+
+
+def test_backoff(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda a, b: 1)
+    scheduler = PollScheduler(100, jitter=0, max_backoff=500)
+    scheduler.record_cycle(False)
+    assert scheduler.next_delay() == 200
+    scheduler.record_cycle(False)
+    assert scheduler.next_delay() == 400
+    scheduler.record_cycle(False)
+    assert scheduler.next_delay() == 500
+    scheduler.record_cycle(True)
+    assert scheduler.next_delay() == 100
+
+
+def test_rotation_prediction(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda a, b: 1)
+    scheduler = PollScheduler(120, jitter=0, fast_interval=10)
+    start = datetime.datetime(2016, 1, 1)
+    for hours in (0, 1, 2, 2, 3):
+        scheduler.observe_modified('myapp/user.json', start + datetime.timedelta(hours=hours))
+    # ignored, no usable timestamp
+    scheduler.observe_modified('myapp/user.json', None)
+
+    rotation = scheduler.predict_rotation('myapp/user.json')
+    assert rotation == scheduler.history['myapp/user.json'][-1] + 3600
+
+    # far away from the next rotation
+    assert scheduler.next_delay(rotation - 1000) == 120
+    # poll right when the rotation is expected
+    assert scheduler.next_delay(rotation - 50) == 50
+    # expected rotation did not show up yet: poll fast
+    assert scheduler.next_delay(rotation + 5) == 10
+    # until it is clearly late
+    assert scheduler.next_delay(rotation + 500) == 120
@@ -0,0 +1,121 @@
+import json
+import socket
+import threading
+import time
+
+from berry.server import CredentialStore, is_loopback, start_credentials_server
+
+try:
+    import http.client as httplib
+except ImportError:  # Python 2
+    import httplib
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def get(connection, path, headers=None):
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.getheader('ETag'), response.read()
+
+
+def test_store(tmpdir):
+    store = CredentialStore()
+    assert store.get('myapp', ('user',)) == (None, None)
+
+    path = tmpdir.join('user.json')
+    path.write('{"application_username": "myapp"}')
+    store.load('myapp', 'user', str(path))
+    etag, files = store.get('myapp', ('user',))
+    assert files == {'user': b'{"application_username": "myapp"}'}
+
+    # downloaded content wins over the local file
+    store.put('myapp', 'user', b'{"a": 1}', 'abc')
+    store.load('myapp', 'user', str(path))
+    assert store.get('myapp', ('user',)) == ('"abc"', {'user': b'{"a": 1}'})
+
+    store.put('myapp', 'client', b'{"b": 2}', 'def')
+    etag, files = store.get('myapp', ('user', 'client'))
+    assert etag not in ('"abc"', '"def"')
+    assert files == {'user': b'{"a": 1}', 'client': b'{"b": 2}'}
+
+
+def test_store_wait():
+    store = CredentialStore()
+    store.put('myapp', 'user', b'{"a": 1}', 'abc')
+
+    # times out without a rotation
+    assert store.get('myapp', ('user',), '"abc"', wait=0.05) == ('"abc"', {'user': b'{"a": 1}'})
+
+    timer = threading.Timer(0.05, store.put, ['myapp', 'user', b'{"a": 2}', 'def'])
+    timer.start()
+    start = time.time()
+    assert store.get('myapp', ('user',), '"abc"', wait=5) == ('"def"', {'user': b'{"a": 2}'})
+    assert time.time() - start < 4
+
+
+def test_http_server():
+    store = CredentialStore()
+    store.put('myapp', 'user', b'{"a": 1}', 'abc')
+    server = start_credentials_server(store, ('127.0.0.1', 0))
+    try:
+        connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        assert get(connection, '/credentials/myapp/user') == (200, '"abc"', b'{"a": 1}')
+        assert get(connection, '/credentials/myapp/user', {'If-None-Match': '"abc"'}) == (304, '"abc"', b'')
+        assert get(connection, '/credentials/myapp/client')[0] == 404
+        assert get(connection, '/credentials/otherapp/user')[0] == 404
+        assert get(connection, '/other')[0] == 404
+
+        store.put('myapp', 'client', b'{"b": 2}', 'def')
+        status, etag, body = get(connection, '/credentials/myapp')
+        assert status == 200
+        assert json.loads(body.decode('utf-8')) == {'user': {'a': 1}, 'client': {'b': 2}}
+
+        # long-poll until the next rotation
+        timer = threading.Timer(0.05, store.put, ['myapp', 'client', b'{"b": 3}', 'ghi'])
+        timer.start()
+        status, new_etag, body = get(connection, '/credentials/myapp?wait=5', {'If-None-Match': etag})
+        assert status == 200
+        assert new_etag != etag
+        assert json.loads(body.decode('utf-8')) == {'user': {'a': 1}, 'client': {'b': 3}}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unix_socket_server(tmpdir):
+    path = str(tmpdir.join('berry.sock'))
+    store = CredentialStore()
+    store.put('myapp', 'user', b'{"a": 1}', 'abc')
+    server = start_credentials_server(store, path)
+    try:
+        assert get(UnixHTTPConnection(path), '/credentials/myapp/user') == (200, '"abc"', b'{"a": 1}')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not tmpdir.join('berry.sock').exists()
+
+    # a stale socket file does not prevent a restart
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = start_credentials_server(store, path)
+    server.server_close()
+
+
+def test_is_loopback():
+    assert is_loopback('127.0.0.1')
+    assert is_loopback('127.1.2.3')
+    assert is_loopback('::1')
+    assert not is_loopback('0.0.0.0')
+    assert not is_loopback('::')
+    assert not is_loopback('10.0.0.1')
+    assert not is_loopback('')
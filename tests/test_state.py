@@ -0,0 +1,93 @@
+import datetime
+import os
+import time
+
+from berry.state import EndpointCache, FetchState, STATE_FILE_NAME, content_digest
+
+
+def test_fetch_state_conditions(tmpdir):
+    local_file = str(tmpdir.join('user.json'))
+    state = FetchState(str(tmpdir))
+    assert state.conditions('myapp/user.json', local_file) == {}
+
+    last_modified = datetime.datetime(2016, 1, 2, 3, 4, 5)
+    state.update('myapp/user.json', {'ETag': '"abc"', 'LastModified': last_modified}, content_digest({}))
+    # no local file yet: always download
+    assert state.conditions('myapp/user.json', local_file) == {}
+
+    tmpdir.join('user.json').write('{}')
+    assert state.conditions('myapp/user.json', local_file) == {
+        'IfNoneMatch': '"abc"', 'IfModifiedSince': '2016-01-02T03:04:05'}
+
+    state.save()
+    assert os.path.exists(str(tmpdir.join(STATE_FILE_NAME)))
+    # restarts pick up the persisted state
+    state = FetchState(str(tmpdir))
+    assert state.conditions('myapp/user.json', local_file)['IfNoneMatch'] == '"abc"'
+
+    # edited or corrupted local file: download again
+    tmpdir.join('user.json').write('{"edited": true}')
+    assert state.conditions('myapp/user.json', local_file) == {}
+    assert not state.unchanged('myapp/user.json', local_file, '"abc"')
+    tmpdir.join('user.json').write('not JSON')
+    assert state.conditions('myapp/user.json', local_file) == {}
+    tmpdir.join('user.json').write('{ }')
+    assert state.unchanged('myapp/user.json', local_file, '"abc"')
+
+    # state files written without the digest
+    state.update('myapp/user.json', {'ETag': '"abc"'})
+    assert state.conditions('myapp/user.json', local_file) == {}
+
+    state.forget('myapp/user.json')
+    assert state.conditions('myapp/user.json', local_file) == {}
+
+
+def test_fetch_state_corrupt_file(tmpdir):
+    tmpdir.join(STATE_FILE_NAME).write('not JSON')
+    state = FetchState(str(tmpdir))
+    assert state.entries == {}
+
+
+def test_endpoint_cache(tmpdir, monkeypatch):
+    path = str(tmpdir.join('endpoints.json'))
+    cache = EndpointCache(path, 60)
+    assert cache.get('my-mint-bucket') is None
+
+    cache.set('my-mint-bucket', 'eu-west-1', 's3v4')
+    cache.save()
+
+    cache = EndpointCache(path, 60)
+    assert cache.get('my-mint-bucket') == {'region': 'eu-west-1', 'signature_version': 's3v4'}
+
+    now = time.time()
+    monkeypatch.setattr('time.time', lambda: now + 61)
+    assert cache.get('my-mint-bucket') is None
+
+    cache.invalidate('my-mint-bucket')
+    cache.save()
+    assert EndpointCache(path, 60).entries == {}
+
+
+def test_local_digest(tmpdir, monkeypatch):
+    local_file = str(tmpdir.join('user.json'))
+    state = FetchState(str(tmpdir))
+    assert state.local_digest(local_file) is None
+
+    tmpdir.join('user.json').write('{"b": 2, "a": 1}')
+    digest = state.local_digest(local_file)
+    assert digest == content_digest({'a': 1, 'b': 2})
+
+    # unchanged stat: no need to read the file again
+    monkeypatch.setattr('json.load', None)
+    assert state.local_digest(local_file) == digest
+    monkeypatch.undo()
+
+    tmpdir.join('user.json').write('{"a": 1, "b": 3, "c": "edited"}')
+    assert state.local_digest(local_file) == content_digest({'a': 1, 'b': 3, 'c': 'edited'})
+
+    tmpdir.join('user.json').remove()
+    assert state.local_digest(local_file) is None
+
+    tmpdir.join('user.json').write('{}')
+    state.written(local_file, content_digest({}))
+    assert state.local_digests[local_file][1] == content_digest({})
@@ -0,0 +1,82 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+from berry.trace import NULL_SPAN, StackSampler, Tracer, format_stack
+from mock import MagicMock
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    # logging would configure the root logger on its own, see test_cli.test_rotate_credentials
+    monkeypatch.setattr('berry.trace.logging', MagicMock())
+
+
+def test_tracer(tmpdir):
+    path = tmpdir.join('trace.json')
+    tracer = Tracer(str(path))
+    tracer.start_cycle()
+    with tracer.span('get_object', application_id='myapp', file='user'):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.span('json_decode', application_id='myapp', file='user'):
+            raise ValueError()
+    tracer.end_cycle(success=False)
+    tracer.start_cycle()
+    tracer.end_cycle(success=True)
+
+    first, second = [json.loads(line) for line in path.read().splitlines()]
+    assert first['cycle'] == 1
+    assert first['success'] is False
+    assert [span['name'] for span in first['spans']] == ['get_object', 'json_decode']
+    assert first['spans'][0]['application_id'] == 'myapp'
+    assert first['spans'][0]['duration'] >= 0
+    assert 'error' not in first['spans'][0]
+    assert first['spans'][1]['error'] == 'ValueError'
+    assert second['cycle'] == 2
+    assert second['spans'] == []
+
+
+def test_tracer_log(monkeypatch):
+    log_info = MagicMock()
+    monkeypatch.setattr('berry.trace.logging.info', log_info)
+    tracer = Tracer()
+    tracer.start_cycle()
+    tracer.end_cycle()
+    assert log_info.call_args[0][0].startswith('TRACE {')
+
+    disabled = Tracer(enabled=False)
+    assert disabled.span('get_object') is NULL_SPAN
+    disabled.start_cycle()
+    disabled.end_cycle()
+    assert log_info.call_count == 1
+
+
+def busy(stopped):
+    while not stopped.is_set():
+        time.sleep(0.001)
+
+
+def test_stack_sampler(tmpdir):
+    assert format_stack(sys._getframe()).endswith('test_trace.py:test_stack_sampler')
+
+    stopped = threading.Event()
+    thread = threading.Thread(target=busy, args=(stopped,))
+    thread.start()
+    path = tmpdir.join('profile.txt')
+    sampler = StackSampler(str(path), interval=0.001)
+    try:
+        sampler.toggle()
+        while sampler.samples < 5:
+            time.sleep(0.01)
+        sampler.toggle()
+    finally:
+        stopped.set()
+        thread.join()
+    lines = path.read().splitlines()
+    assert any('test_trace.py:busy' in line for line in lines)
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert sampler.thread is None